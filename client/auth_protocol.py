@@ -1,8 +1,13 @@
 import os
-import json
+import time
 import hmac
 import hashlib
 from utils import encrypt, decrypt, generate_nonce, load_user_key
+from framing import FrameReader, send_frame
+from record_layer import SUPPORTED_SUITES, LEGACY_SUITE
+import wire_codec
+from wire_codec import (FORMAT_BINARY, CLIENT_HELLO, SERVER_HELLO, CLIENT_RESPONSE, NEW_SESSION_TICKET,
+                        SERVER_RESUME)
 
 
 # ===============================================================
@@ -11,7 +16,83 @@ from utils import encrypt, decrypt, generate_nonce, load_user_key
 # ===============================================================
 
 
-def start_key_exchange(sock, username):
+# Encoding of every message we send: 'binary' (compact, typed results) or
+# 'json' (the original format, for servers without binary support)
+WIRE_FORMAT = FORMAT_BINARY
+
+# Resumption tickets from earlier sessions (kept in memory only):
+# username -> (ticket bytes, master secret of the session it resumes, expiry time)
+session_tickets = {}
+
+# Handshake cookies from servers that ask for one (HELLO_COOKIE): username -> cookie.
+# Sent in the first ClientHello of later connections, so only the first pays the extra round trip.
+hello_cookies = {}
+
+
+class ServerBusy(ConnectionError):
+    """
+    The server refused the connection because it is overloaded (SERVER_BUSY).
+    `retry_after` is how long it asks us to wait, in seconds.
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server busy: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def check_busy(frame):
+    """
+    Raises ServerBusy if the handshake reply is a SERVER_BUSY message instead.
+    """
+    busy = wire_codec.busy_message(frame)
+    if busy is not None:
+        raise ServerBusy(busy.get('reason', ''), busy.get('retry_after', 0) / 1000)
+
+
+def send_client_hello(sock, reader, client_hello, wire_format):
+    """
+    Sends a ClientHello, with our cookie for the user if we have one, and
+    receives the server's reply. A HELLO_COOKIE reply (server asking for a
+    cookie first) is answered by sending the hello again with the new cookie.
+
+    Returns:
+        tuple: (the ClientHello last sent (bytes), the server's reply (bytes))
+    """
+    username = client_hello['username']
+    for _ in range(2):
+        client_hello['cookie'] = hello_cookies.get(username)
+        raw_hello = wire_codec.dumps(CLIENT_HELLO, client_hello, wire_format)
+        send_frame(sock, raw_hello)
+        reply = reader.recv_frame()
+        if reply is None:
+            raise ConnectionError("Server closed the connection during the handshake")
+        cookie = wire_codec.cookie_message(reply)
+        if cookie is None:
+            return raw_hello, reply
+        hello_cookies[username] = cookie
+    raise ConnectionError("Server did not accept the handshake cookie it sent")
+
+
+def store_ticket(username, message, master_secret):
+    """
+    Remembers the ticket from a NewSessionTicket / ServerResume message
+    together with the Master Secret it was issued for.
+    """
+    if message.get('ticket'):
+        expires = time.time() + message.get('lifetime', 0)
+        session_tickets[username] = (message['ticket'], master_secret, expires)
+
+
+def start_key_exchange(sock, username, reader=None, suites=SUPPORTED_SUITES, wire_format=WIRE_FORMAT):
+    """
+    Full handshake. Returns (master_secret, suite): the Master Secret and the
+    record protection suite the server picked from `suites`. Every message
+    is sent in `wire_format`, which the server keeps for the whole connection.
+    """
+    if reader is None:
+        reader = FrameReader(sock)
+
     # Step 1: Generate a client nonce (nonce_c) for this session
     nonce_c = generate_nonce()
 
@@ -21,21 +102,23 @@ def start_key_exchange(sock, username):
     client_hello = { #################include password here too
         # 'password': password,  # Include password in the ClientHello message
         'username': username,
-        'nonce': nonce_c.hex()  # Convert nonce_c to a hexadecimal string for transmission
+        'nonce': nonce_c,  # Raw bytes in binary, hex in JSON
+        'tickets': True,  # We can resume later: ask for a NewSessionTicket
+        'suites': list(suites)  # Record protection suites we support, most preferred first
     }
-    sock.sendall(json.dumps(client_hello).encode())  # Send the JSON-encoded message over the socket
+    _, enc_response = send_client_hello(sock, reader, client_hello, wire_format)  # (again with a cookie if asked)
 
 
     # Step 3: Receive ServerHello message from the server
     # ServerHello = ENC_K_ATM({nonce_c, nonce_s})
     K_ATM = load_user_key(username)  
-    enc_response = sock.recv(4096)  
-    response_json = decrypt(K_ATM, enc_response)  
-    data = json.loads(response_json.decode())  # Parse the decrypted JSON data
+    check_busy(enc_response)  # an overloaded server answers before any crypto
+    response_data = decrypt(K_ATM, enc_response)  
+    data = wire_codec.loads(SERVER_HELLO, response_data, wire_format)  # Parse the decrypted ServerHello
 
     # Extract the server's response: nonce_c (echoed back) and nonce_s (server-generated nonce)
-    received_nonce_c = bytes.fromhex(data['nonce_c'])  # Convert the received nonce_c back to bytes
-    nonce_s = bytes.fromhex(data['nonce_s'])  # Convert the received nonce_s back to bytes
+    received_nonce_c = data['nonce_c']
+    nonce_s = data['nonce_s']
 
 
     # Step 4: Verify that the server echoed back the correct nonce_c
@@ -43,13 +126,19 @@ def start_key_exchange(sock, username):
     if received_nonce_c != nonce_c:
         raise Exception("Server failed to prove identity")  
 
+    # The server picks one of our suites (a server without suite support sends none)
+    suite = data.get('suite', LEGACY_SUITE)
+    if suite not in suites:
+        raise Exception(f"Server chose an unsupported cipher suite: {suite}")
+
 
     # Step 5: Send confirmation message back to the server
-    # Confirmation = ENC_K_ATM({nonce_s})
-    confirmation = json.dumps({
-        'nonce_s': nonce_s.hex()  # Convert nonce_s to a hexadecimal string for transmission
-    }).encode()
-    sock.sendall(encrypt(K_ATM, confirmation))  # Encrypt the confirmation and send it to the server
+    # Confirmation = ENC_K_ATM({nonce_s, suites})
+    confirmation = wire_codec.dumps(CLIENT_RESPONSE, {
+        'nonce_s': nonce_s,
+        'suites': list(suites)  # Repeat our offer under K_ATM so the server can detect a downgrade
+    }, wire_format)
+    send_frame(sock, encrypt(K_ATM, confirmation))  # Encrypt the confirmation and send it to the server
 
 
     # Step 6: Derive the Master Secret (MS) using HMAC
@@ -58,5 +147,79 @@ def start_key_exchange(sock, username):
     master_secret = hmac.new(K_ATM, ms_input, hashlib.sha256).digest()  
 
 
-    # Return the derived Master Secret (MS) to the caller
-    return master_secret
\ No newline at end of file
+    # Step 7: Receive NewSessionTicket {ticket, lifetime} for resuming later
+    # (a closed connection here means the server rejected our confirmation)
+    ticket_frame = reader.recv_frame()
+    if ticket_frame is None:
+        raise ConnectionError("Server closed the connection during the handshake")
+    store_ticket(username, wire_codec.loads(NEW_SESSION_TICKET, ticket_frame, wire_format), master_secret)
+
+
+    # Return the derived Master Secret (MS) and the negotiated suite to the caller
+    return master_secret, suite
+
+
+def resume_key_exchange(sock, username, reader, suites=SUPPORTED_SUITES, wire_format=WIRE_FORMAT):
+    """
+    Abbreviated handshake using a stored ticket: one round trip, no K_ATM.
+    The ticket is consumed whether or not the server accepts it.
+
+    Returns:
+        tuple or None: (master_secret, suite), or None if there is no usable
+                       ticket or the server refused it (then do a full handshake
+                       on the same connection).
+    """
+    ticket, old_master_secret, expires = session_tickets.pop(username, (None, None, 0))
+    if ticket is None or time.time() >= expires:
+        return None
+
+    # Step 1: ClientHello with the ticket and a fresh nonce_c
+    nonce_c = generate_nonce()
+    client_hello, raw = send_client_hello(sock, reader, {
+        'username': username,
+        'nonce': nonce_c,
+        'tickets': True,
+        'ticket': ticket,
+        'suites': list(suites)
+    }, wire_format)
+
+    # Step 2: ServerResume {resumed, nonce_s, suite, proof, ticket}
+    try:
+        check_busy(raw)
+    except ServerBusy:
+        session_tickets[username] = (ticket, old_master_secret, expires)  # never opened, still good
+        raise
+    reply = wire_codec.loads(SERVER_RESUME, raw, wire_format)
+    if not reply.get('resumed'):
+        return None
+
+    # Step 3: MS' = HMAC(MS, "resume" || nonce_c || nonce_s); the proof shows the
+    # server could open the ticket, i.e. it is the server we authenticated before,
+    # and that it saw our ClientHello and chose this suite
+    nonce_s = reply['nonce_s']
+    suite = reply.get('suite', LEGACY_SUITE)
+    master_secret = hmac.new(old_master_secret, b"resume" + nonce_c + nonce_s, hashlib.sha256).digest()
+    expected_proof = hmac.new(master_secret, b"server resumed" + client_hello + suite.encode(),
+                              hashlib.sha256).digest()
+    if not hmac.compare_digest(expected_proof, reply['proof']):
+        raise Exception("Server failed to prove identity")
+    if suite not in suites:
+        raise Exception(f"Server chose an unsupported cipher suite: {suite}")
+    store_ticket(username, reply, master_secret)
+    return master_secret, suite
+
+
+def establish_session(sock, username, reader=None, suites=SUPPORTED_SUITES, wire_format=WIRE_FORMAT):
+    """
+    Resumes the previous session if we hold a ticket for this user,
+    otherwise runs the full key exchange.
+
+    Returns:
+        tuple: (master_secret (bytes), suite (str), resumed (bool))
+    """
+    if reader is None:
+        reader = FrameReader(sock)
+    resumed = resume_key_exchange(sock, username, reader, suites, wire_format)
+    if resumed is not None:
+        return resumed + (True,)
+    return start_key_exchange(sock, username, reader, suites, wire_format) + (False,)
@@ -0,0 +1,64 @@
+import time
+import socket
+import argparse
+import statistics
+import auth_protocol
+from auth_protocol import establish_session
+from framing import FrameReader
+
+
+# =============================
+# Reconnect Benchmark
+# Times full handshakes against ticket resumptions on a running server.
+# Usage: python client/bench_resume.py --user alice --connections 500
+# =============================
+
+
+def connect_once(host, port, username):
+    """
+    Opens one connection, completes the handshake and closes it.
+
+    Returns:
+        tuple: (seconds taken, resumed (bool))
+    """
+    start = time.perf_counter()
+    with socket.create_connection((host, port)) as s:
+        _, _, resumed = establish_session(s, username, FrameReader(s))
+        elapsed = time.perf_counter() - start
+    return elapsed, resumed
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<10} n={len(samples):<6} mean={statistics.mean(samples) * 1000:.3f}ms "
+          f"p50={p50 * 1000:.3f}ms p99={p99 * 1000:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full handshake vs. session resumption")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=65432)
+    parser.add_argument('--user', default='alice')
+    parser.add_argument('--connections', type=int, default=500)
+    args = parser.parse_args()
+
+    full, resumed = [], []
+    for _ in range(args.connections):
+        auth_protocol.session_tickets.clear()     # force a full handshake
+        elapsed, was_resumed = connect_once(args.host, args.port, args.user)
+        full.append(elapsed)
+    for _ in range(args.connections):
+        elapsed, was_resumed = connect_once(args.host, args.port, args.user)
+        if not was_resumed:
+            print("Resumption was refused; falling back to the full handshake")
+        resumed.append(elapsed)
+
+    report("full", full)
+    report("resumed", resumed)
+    print(f"speedup (mean): {statistics.mean(full) / statistics.mean(resumed):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
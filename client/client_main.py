@@ -1,8 +1,10 @@
+import time
 import socket
 import json
-from auth_protocol import start_key_exchange
-from key_derivation import derive_keys
+from auth_protocol import establish_session, ServerBusy
+from record_layer import new_record_layer
 from transaction_interface import transaction_loop
+from framing import FrameReader
 
 
 # ===========================================================
@@ -13,6 +15,8 @@ from transaction_interface import transaction_loop
 
 HOST = '127.0.0.1'  
 PORT = 65432        
+RECONNECT_DELAY = 1.0   # seconds to wait before reconnecting after a dropped connection
+REPLY_TIMEOUT = 5.0     # seconds to wait for a reply before reconnecting (and resending, see transaction_loop)
 
 
 def main():
@@ -21,25 +25,55 @@ def main():
 #get password here too
     #password = input("Enter password: ")  # Prompt for password
 
-    # Create a TCP socket and connect to the server
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))  # Establish a connection to the server
+    # Reconnect (resuming the session with its ticket) until the user logs out;
+    # a deposit/withdraw/batch left unanswered is resent with its request ID
+    retry = {}
+    while True:
+        # Create a TCP socket and connect to the server
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.connect((HOST, PORT))  # Establish a connection to the server
+                s.settimeout(REPLY_TIMEOUT)
+            except OSError as e:
+                print(f"Could not connect to the server: {e}. Retrying...")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            reader = FrameReader(s)  # One receive buffer for the whole session
 
 
-        # Begin authenticated key exchange (Point 2)
-        # This step establishes a shared Master Secret (MS) between the client and server
-        master_secret = start_key_exchange(s, username) #send password here too
+            # Begin authenticated key exchange (Point 2)
+            # This step establishes a shared Master Secret (MS) between the client and server;
+            # after the first login a session ticket lets us resume in a single round trip
+            try:
+                master_secret, suite, resumed = establish_session(s, username, reader) #send password here too
+            except ServerBusy as e:
+                # Refused before the handshake: wait as long as the server asks, then try again
+                delay = max(e.retry_after, RECONNECT_DELAY)
+                print(f"{e}. Retrying in {delay:g}s...")
+                time.sleep(delay)
+                continue
+            except OSError as e:
+                # The server dropped us or did not answer within REPLY_TIMEOUT mid-handshake
+                print(f"Handshake failed: {e}. Retrying...")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            if resumed:
+                print("Session resumed.")
 
 
-        # Derive keys for encryption and MAC (Point 3)
-        # Using the Master Secret (MS), derive separate keys for encryption (k_enc) and message authentication (k_mac)
-        k_enc, k_mac = derive_keys(master_secret)
+            # Derive keys for encryption and MAC (Point 3)
+            # Using the Master Secret (MS), derive the keys of the negotiated record suite:
+            # an AEAD key per direction, or k_enc/k_mac for CBC+HMAC
+            record = new_record_layer(suite, master_secret, is_server=False)
 
 
-        # Enter secure transaction loop (Point 4)
-        # This loop handles secure communication with the server for transactions
-        transaction_loop(s, k_enc, k_mac)
+            # Enter secure transaction loop (Point 4)
+            # This loop handles secure communication with the server for transactions
+            if transaction_loop(s, record, reader, username=username, retry=retry):
+                break
 
+        print("Reconnecting...")
+        time.sleep(RECONNECT_DELAY)
 
 if __name__ == '__main__':
     main()  # Entry point of the program
@@ -0,0 +1,230 @@
+import struct
+import asyncio
+
+
+# =============================
+# Wire Framing
+# Every protocol message travels as one length-prefixed frame:
+#     [4-byte big-endian payload length][payload]
+# so message boundaries no longer depend on how TCP splits or merges segments.
+# Frames are received into one preallocated buffer per connection (recv_into)
+# and can be handed out as memoryview slices of it; a large payload given in
+# several parts is sent together with its header by one scatter/gather sendmsg call.
+# Mirrored in server/framing.py
+# =============================
+
+
+HEADER = struct.Struct('>I')          # Frame header: unsigned 32-bit payload length
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024     # Reject absurd lengths instead of buffering them
+HANDSHAKE_MAX_FRAME_SIZE = 16 * 1024  # Limit before the peer has authenticated (handshake messages are small)
+RECV_CHUNK = 65536                    # Bytes asked from the socket per recv call
+RECV_BUFFER_SIZE = 16 * 1024          # Receive buffer per connection (grows for a larger frame, then shrinks back)
+GATHER_MIN_SIZE = 16 * 1024           # Smaller frames are joined: copying them is cheaper than sendmsg's set-up
+
+
+class FrameError(Exception):
+    """Raised when the peer sends a malformed frame or closes mid-frame."""
+
+
+def encode_frame(payload):
+    """
+    Prefixes a payload with its length header.
+
+    Parameters:
+        payload (bytes): The message to frame.
+
+    Returns:
+        bytes: Header followed by the payload.
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame too large ({len(payload)} bytes)")
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, *parts):
+    """
+    Sends one framed message over a blocking socket. The payload may be given
+    in several parts (e.g. record_layer seal_parts()); from GATHER_MIN_SIZE
+    bytes on they go out after the header without being joined first.
+    """
+    length = sum(map(len, parts))
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame too large ({length} bytes)")
+    buffers = [HEADER.pack(length), *parts]
+    if length < GATHER_MIN_SIZE or not hasattr(sock, 'sendmsg'):  # Windows has no sendmsg
+        sock.sendall(b''.join(buffers))
+        return
+    remaining = HEADER_SIZE + length
+    sent = sock.sendmsg(buffers)
+    while sent < remaining:
+        # Partial send: drop what went out and send the rest
+        remaining -= sent
+        while sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        buffers[0] = memoryview(buffers[0])[sent:]
+        sent = sock.sendmsg(buffers)
+
+
+class FrameReader:
+    """
+    Per-connection receive buffer with incremental frame parsing.
+
+    The socket reads straight into the free end of one preallocated bytearray;
+    complete frames are taken off the front and any partial frame waits for
+    more data. The unread bytes are moved back to the start only when the free
+    space runs out. A frame that does not fit gets a larger buffer, grown as
+    its bytes arrive (never from the length the peer declares), which is
+    given up again once it has been read.
+    on_partial, if given, is called when recv_frame*() has part of a frame and
+    has to wait for the rest (once per call), e.g. to start a request deadline.
+    """
+
+    def __init__(self, sock=None, size=RECV_BUFFER_SIZE, on_partial=None, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.size = size
+        self.max_frame_size = max_frame_size   # e.g. HANDSHAKE_MAX_FRAME_SIZE until the peer has authenticated
+        self.on_partial = on_partial
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+        self._start = 0   # first unread byte
+        self._end = 0     # end of the bytes received
+        self._missing = HEADER_SIZE   # bytes still missing from the frame at the front
+        self._min_free = min(RECV_CHUNK, size // 2)   # room asked of each recv_into
+
+    def _reserve(self, needed):
+        """
+        Makes room for at least `needed` more bytes after the unread ones.
+        """
+        unread = self._end - self._start
+        if unread + needed > len(self.buffer):
+            # Frames already handed out keep pointing into the old buffer
+            self.buffer = bytearray(max(2 * len(self.buffer), unread + needed))
+            view, self._view = self._view, memoryview(self.buffer)
+            self._view[:unread] = view[self._start:self._end]
+        else:
+            self._view[:unread] = self._view[self._start:self._end]
+        self._start, self._end = 0, unread
+
+    def feed(self, data):
+        """
+        Appends received bytes to the buffer.
+        """
+        if len(self.buffer) - self._end < len(data):
+            self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def next_frame_view(self):
+        """
+        Takes one complete frame off the buffer without copying it.
+
+        Returns:
+            memoryview or None: The payload, valid until the next recv_frame*() call
+                                (which may reuse its bytes), or None if a full frame is not buffered yet.
+        """
+        unread = self._end - self._start
+        if unread < HEADER_SIZE:
+            self._missing = HEADER_SIZE - unread
+            return None
+        (length,) = HEADER.unpack_from(self.buffer, self._start)
+        if length > self.max_frame_size:
+            raise FrameError(f"Frame too large ({length} bytes)")
+        end = self._start + HEADER_SIZE + length
+        if end > self._end:
+            self._missing = end - self._end
+            return None
+        payload = self._view[self._start + HEADER_SIZE:end]
+        self._start = end
+        if self._start == self._end:
+            self._start = self._end = 0   # empty: the next recv starts at the front again
+            if len(self.buffer) > self.size:
+                self.buffer = bytearray(self.size)
+                self._view = memoryview(self.buffer)
+        return payload
+
+    def next_frame(self):
+        """
+        Pops one complete frame from the buffer.
+
+        Returns:
+            bytes or None: The payload, or None if a full frame is not buffered yet.
+        """
+        payload = self.next_frame_view()
+        return None if payload is None else bytes(payload)
+
+    def recv_frame_view(self):
+        """
+        Blocks until one full frame has been received from the socket, and
+        returns it without copying it out of the receive buffer.
+
+        Returns:
+            memoryview or None: The payload (valid until the next recv_frame*() call),
+                                or None if the peer closed cleanly between frames.
+        """
+        waiting = False
+        while True:
+            payload = self.next_frame_view()
+            if payload is not None:
+                return payload
+            if self.on_partial is not None and not waiting and self._end > self._start:
+                waiting = True
+                self.on_partial()
+            # Room for the next chunk only: the buffer grows with the bytes received
+            needed = max(min(self._missing, RECV_CHUNK), self._min_free)
+            if len(self.buffer) - self._end < needed:
+                self._reserve(needed)
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                if self._end > self._start:
+                    raise FrameError("Connection closed in the middle of a frame")
+                return None
+            self._end += received
+
+    def recv_frame(self):
+        """
+        Blocks until one full frame has been received from the socket.
+
+        Returns:
+            bytes or None: The payload, or None if the peer closed cleanly between frames.
+        """
+        payload = self.recv_frame_view()
+        return None if payload is None else bytes(payload)
+
+
+async def read_frame_async(reader, on_partial=None, max_frame_size=MAX_FRAME_SIZE):
+    """
+    Reads one frame from an asyncio StreamReader (which does its own buffering).
+    on_partial, if given, is called once the header has arrived (see FrameReader).
+    Longer frames than max_frame_size are refused.
+
+    Returns:
+        bytes or None: The payload, or None if the peer closed cleanly between frames.
+    """
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise FrameError("Connection closed in the middle of a frame")
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > max_frame_size:
+        raise FrameError(f"Frame too large ({length} bytes)")
+    if on_partial is not None:
+        on_partial()
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError("Connection closed in the middle of a frame")
+
+
+async def write_frame_async(writer, *parts):
+    """
+    Writes one frame, given as one or more payload parts, to an asyncio
+    StreamWriter and waits for the buffer to drain.
+    """
+    length = sum(len(part) for part in parts)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame too large ({length} bytes)")
+    writer.writelines([HEADER.pack(length), *parts])
+    await writer.drain()
\ No newline at end of file
@@ -35,3 +35,24 @@ def derive_keys(master_secret):
 
     # Return the derived keys as a tuple
     return k_enc, k_mac
+
+
+def derive_record_keys(master_secret, suite):
+    """
+    Derives the AEAD record keys for a negotiated cipher suite. Each direction
+    gets its own key and 12-byte IV, so client and server never reuse a nonce
+    under the same key. The suite name is part of every label: if the two
+    sides disagree on the suite, no record will authenticate.
+
+    Parameters:
+        master_secret (bytes): The session's Master Secret (MS).
+        suite (str): The negotiated suite name, e.g. "aes-256-gcm".
+
+    Returns:
+        tuple: (client_key, client_iv, server_key, server_iv) as bytes
+    """
+    def expand(label):
+        return hmac.new(master_secret, label + b" " + suite.encode(), hashlib.sha256).digest()
+
+    return (expand(b"client write key"), expand(b"client write iv")[:12],
+            expand(b"server write key"), expand(b"server write iv")[:12])
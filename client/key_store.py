@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import threading
+import time
+
+
+# =============================
+# Pre-shared Key Store
+# Cached lookup of each user's K_ATM, reloaded automatically when the key
+# file changes. Two on-disk formats:
+#   - JSON  {"username": "<64 hex chars>", ...}  (parsed once per change)
+#   - binary: sorted, memory-mapped index looked up by binary search,
+#             so millions of users load instantly without parsing JSON
+# Mirrored in server/key_store.py
+# =============================
+
+
+KEY_STORE_PATH = 'server/user_keys.json'
+KEY_SIZE = 32
+RELOAD_CHECK_INTERVAL = 1.0   # seconds between mtime checks of the key file
+
+# Binary layout: header | (count + 1) u32 name offsets | count * 32-byte keys | names blob
+# Names are sorted as UTF-8 bytes; name i is blob[offset[i]:offset[i + 1]].
+BINARY_MAGIC = b'KSTORE1\x00'
+BINARY_HEADER = struct.Struct('>8sII')
+
+
+class JsonKeyIndex:
+    """
+    All keys parsed into a dict.
+    """
+
+    def __init__(self, path):
+        with open(path, 'r') as f:
+            self._keys = {name: bytes.fromhex(key) for name, key in json.load(f).items()}
+
+    def get(self, username):
+        return self._keys.get(username)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class BinaryKeyIndex:
+    """
+    Memory-mapped sorted key index; lookups binary-search the name table.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, names_len = BINARY_HEADER.unpack_from(self._map)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary key store")
+        self._offsets_at = BINARY_HEADER.size
+        self._keys_at = self._offsets_at + 4 * (self.count + 1)
+        self._names_at = self._keys_at + KEY_SIZE * self.count
+        if len(self._map) != self._names_at + names_len:
+            raise ValueError(f"{path} is truncated")
+
+    def _name(self, i):
+        start, end = struct.unpack_from('>II', self._map, self._offsets_at + 4 * i)
+        return self._map[self._names_at + start:self._names_at + end]
+
+    def get(self, username):
+        target = username.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = self._name(mid)
+            if name < target:
+                lo = mid + 1
+            elif name > target:
+                hi = mid
+            else:
+                start = self._keys_at + KEY_SIZE * mid
+                return self._map[start:start + KEY_SIZE]
+        return None
+
+    def __len__(self):
+        return self.count
+
+
+def open_key_index(path):
+    """
+    Opens a key file in whichever format it is written in.
+    """
+    with open(path, 'rb') as f:
+        binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    return BinaryKeyIndex(path) if binary else JsonKeyIndex(path)
+
+
+def write_binary_key_store(keys, path):
+    """
+    Writes {username: key_bytes} in the binary format (temp file + atomic rename).
+    """
+    items = sorted((name.encode(), key) for name, key in keys.items())
+    offsets = [0]
+    for name, key in items:
+        if len(key) != KEY_SIZE:
+            raise ValueError(f"Invalid key length ({len(key)} bytes) for user {name.decode()}. Must be 32.")
+        offsets.append(offsets[-1] + len(name))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, len(items), offsets[-1]))
+        f.write(struct.pack(f'>{len(offsets)}I', *offsets))
+        f.write(b''.join(key for _, key in items))
+        f.write(b''.join(name for name, _ in items))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class KeyStore:
+    """
+    Cached, hot-reloadable view of a key file.
+
+    Lookups go to the in-memory index. At most every `check_interval`
+    seconds a lookup stats the file; if its mtime/size/inode changed, a new
+    index is built and swapped in atomically, so concurrent handshakes see
+    either the old or the new key set, never a half-loaded one. If the file is
+    missing or cannot be parsed the old keys stay in use.
+    """
+
+    def __init__(self, path=KEY_STORE_PATH, check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._signature = None
+        self._next_check = 0.0
+
+    def _file_signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._index is not None and now < self._next_check:
+            return
+        with self._lock:
+            if self._index is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                signature = self._file_signature()
+                if signature == self._signature:
+                    return
+                index = open_key_index(self.path)
+            except (ValueError, OSError):
+                if self._index is None:
+                    raise
+                return  # keep serving the previous keys
+            self._index, self._signature = index, signature
+
+    def reload(self):
+        """
+        Forces a reload on the next lookup.
+        """
+        self._next_check = 0.0
+        self._signature = None
+
+    def get(self, username):
+        """
+        Returns the user's key bytes.
+
+        Raises:
+            KeyError: Unknown user.
+        """
+        self._maybe_reload()
+        key = self._index.get(username)
+        if key is None:
+            raise KeyError(username)
+        return key
+
+    def __len__(self):
+        self._maybe_reload()
+        return len(self._index)
+
+
+# Process-wide store used by load_user_key
+key_store = KeyStore()
+
+
+def main():
+    # python client/key_store.py build <keys.json> <keys.bin>
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Usage: python client/key_store.py build <user_keys.json> <user_keys.bin>")
+        sys.exit(1)
+    start = time.perf_counter()
+    keys = JsonKeyIndex(sys.argv[2])._keys
+    write_binary_key_store(keys, sys.argv[3])
+    print(f"Wrote {len(keys):,} keys to {sys.argv[3]} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,290 @@
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from auth_protocol import start_key_exchange, establish_session, ServerBusy
+from record_layer import SUPPORTED_SUITES, new_record_layer
+from framing import FrameReader, send_frame
+import wire_codec
+from wire_codec import FORMAT_JSON, WIRE_FORMATS, REQUEST, RESPONSE, BUSY, ERROR
+
+
+# =============================
+# Headless Load Generator
+# Runs N concurrent ATM sessions against a live server without the
+# interactive menu, and reports throughput plus p50/p99/p999 latency for
+# handshakes and transactions separately.
+#
+#   closed loop: each session sends its next request as soon as the previous
+#                reply arrives (plus optional think time)
+#   open loop:   requests arrive on a Poisson schedule at --rate per second in
+#                total; latency is measured from the scheduled arrival time, so
+#                a slow server cannot hide queueing delay by slowing the client
+#
+# Usage: python client/load_generator.py --sessions 50 --duration 30 --mix deposit=40,withdraw=30,balance=25,view_log=5
+#        python client/load_generator.py --mode open --rate 2000 --output results.json
+# =============================
+
+
+DEFAULT_MIX = 'deposit=40,withdraw=30,balance=25,view_log=5'
+ACTIONS = ('deposit', 'withdraw', 'balance', 'view_log')
+
+
+def parse_mix(text):
+    """
+    Parses "deposit=40,withdraw=30,..." into (actions, weights).
+    """
+    actions, weights = [], []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action in mix: {name}")
+        actions.append(name)
+        weights.append(float(weight or 1))
+    return actions, weights
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * p))]
+
+
+def summarize(samples):
+    """
+    Latency summary in milliseconds.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'p999_ms': percentile(samples, 0.999) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+class SessionStats:
+    """
+    Samples collected by one session thread (merged at the end, so no locking).
+    """
+
+    def __init__(self):
+        self.handshakes = []
+        self.transactions = {action: [] for action in ACTIONS}
+        self.errors = {}
+
+    def error(self, e):
+        self.count_error(type(e).__name__)
+
+    def count_error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+class AtmSession:
+    """
+    One headless ATM: connects, runs the handshake and sends sealed requests.
+    """
+
+    def __init__(self, args, username, stats):
+        self.args = args
+        self.username = username
+        self.stats = stats
+        self.sock = None
+        self.sent_on_connection = 0
+
+    def connect(self):
+        self.close()
+        start = time.perf_counter()
+        self.sock = socket.create_connection((self.args.host, self.args.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.sock)
+        suites = self.args.suites or SUPPORTED_SUITES
+        if self.args.resume:
+            master_secret, suite, _ = establish_session(self.sock, self.username, self.reader, suites,
+                                                        self.args.encoding)
+        else:
+            master_secret, suite = start_key_exchange(self.sock, self.username, self.reader, suites,
+                                                      self.args.encoding)
+        self.record = new_record_layer(suite, master_secret, is_server=False)
+        self.stats.handshakes.append(time.perf_counter() - start)
+        self.sent_on_connection = 0
+
+    def ensure_connected(self):
+        """
+        (Re)connects if there is no connection or it has served its quota of requests.
+        """
+        if self.sock is None or (self.args.requests_per_connection
+                                 and self.sent_on_connection >= self.args.requests_per_connection):
+            self.connect()
+
+    def request(self, data):
+        """
+        Sends one request and waits for its reply.
+        """
+        if self.args.encoding == FORMAT_JSON:
+            payload = json.dumps(data).encode()
+        else:
+            payload = wire_codec.encode(REQUEST, data)
+        send_frame(self.sock, *self.record.seal_parts(payload))
+        reply = self.reader.recv_frame_view()
+        if reply is None:
+            raise ConnectionError("Server closed the connection")
+        self.sent_on_connection += 1
+        reply = self.record.open(reply)
+        if self.args.encoding == FORMAT_JSON:
+            return json.loads(reply.decode())
+        return wire_codec.decode(RESPONSE, reply)[0]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def build_request(rng, action):
+    if action in ('deposit', 'withdraw'):
+        # With a request ID, as the interactive client sends them
+        return {'action': action, 'amount': rng.randint(1, 20), 'request_id': '%032x' % rng.getrandbits(128)}
+    if action == 'view_log':
+        return {'action': 'view_log', 'limit': 20}
+    return {'action': action}
+
+
+def run_session(args, index, actions, weights, stats, start_barrier):
+    """
+    Body of one session thread. All sessions start together once every
+    thread is ready, and run for args.duration seconds.
+    """
+    rng = random.Random(args.seed + index)
+    users = args.users.split(',')
+    session = AtmSession(args, users[index % len(users)], stats)
+    interval = args.sessions / args.rate if args.mode == 'open' else 0.0
+    start_barrier.wait()
+    deadline = time.perf_counter() + args.duration
+    next_arrival = time.perf_counter() + (rng.expovariate(1 / interval) if interval else 0.0)
+    sent = 0
+    try:
+        while time.perf_counter() < deadline and (not args.requests or sent < args.requests):
+            action = rng.choices(actions, weights)[0]
+            try:
+                # Handshakes are timed on their own, never as part of a transaction
+                session.ensure_connected()
+            except Exception as e:
+                stats.error(e)
+                session.close()
+                # A refused connection says how long to back off for
+                time.sleep(e.retry_after if isinstance(e, ServerBusy) else 0.1)
+                continue
+            if args.mode == 'open':
+                # Wait for the scheduled arrival; if we are behind, send now
+                # but still charge the delay to this request's latency
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                start = next_arrival
+                next_arrival += rng.expovariate(1 / interval)
+            else:
+                start = time.perf_counter()
+            try:
+                reply = session.request(build_request(rng, action))
+                if reply.get('status') == BUSY or reply.get('busy'):
+                    stats.count_error('Shed')   # refused by admission control, not a served transaction
+                    time.sleep(reply.get('retry_after', 0) / 1000)
+                elif reply.get('status') == ERROR:
+                    stats.count_error('ServerError')   # answered, but the transaction failed
+                else:
+                    stats.transactions[action].append(time.perf_counter() - start)
+            except Exception as e:
+                stats.error(e)
+                session.close()   # reconnect (and handshake again) on the next request
+            sent += 1
+            if args.mode == 'closed' and args.think_time:
+                time.sleep(rng.expovariate(1 / args.think_time))
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless ATM load generator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=65432)
+    parser.add_argument('--users', default='alice,bob,charlie', help="comma-separated; sessions use them round-robin")
+    parser.add_argument('--sessions', type=int, default=20, help="concurrent ATM sessions")
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--rate', type=float, default=1000.0, help="open loop: total requests per second")
+    parser.add_argument('--think-time', type=float, default=0.0, help="closed loop: mean seconds between requests")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run")
+    parser.add_argument('--requests', type=int, default=0, help="stop each session after this many requests (0 = no limit)")
+    parser.add_argument('--requests-per-connection', type=int, default=0,
+                        help="reconnect (new handshake) after this many requests (0 = never)")
+    parser.add_argument('--resume', action='store_true', help="reconnect with session tickets")
+    parser.add_argument('--suites', type=lambda s: s.split(','), default=None,
+                        help="record suites to offer, most preferred first (default: all supported)")
+    parser.add_argument('--encoding', choices=WIRE_FORMATS, default=WIRE_FORMATS[0],
+                        help="wire encoding of every message (default: %(default)s)")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="action weights")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='', help="free text stored with the results (e.g. server version)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    actions, weights = parse_mix(args.mix)
+    all_stats = [SessionStats() for _ in range(args.sessions)]
+    start_barrier = threading.Barrier(args.sessions + 1)
+    threads = [threading.Thread(target=run_session, daemon=True,
+                                args=(args, i, actions, weights, all_stats[i], start_barrier))
+               for i in range(args.sessions)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    # Merge the per-session samples
+    handshakes = [x for s in all_stats for x in s.handshakes]
+    per_action = {a: [x for s in all_stats for x in s.transactions[a]] for a in ACTIONS}
+    transactions = [x for samples in per_action.values() for x in samples]
+    errors = {}
+    for s in all_stats:
+        for name, count in s.errors.items():
+            errors[name] = errors.get(name, 0) + count
+
+    results = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'elapsed_s': elapsed,
+        'throughput_tps': len(transactions) / elapsed if elapsed else 0.0,
+        'handshake': summarize(handshakes),
+        'transaction': summarize(transactions),
+        'per_action': {a: summarize(samples) for a, samples in per_action.items() if samples},
+        'errors': errors,
+    }
+
+    print(f"{args.sessions} sessions, {args.mode} loop, {elapsed:.1f}s: "
+          f"{results['throughput_tps']:.0f} transactions/s, {sum(errors.values())} errors")
+    for name in ('handshake', 'transaction'):
+        r = results[name]
+        if r['count']:
+            print(f"  {name:<12} n={r['count']:<8} p50={r['p50_ms']:.3f}ms "
+                  f"p99={r['p99_ms']:.3f}ms p999={r['p999_ms']:.3f}ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
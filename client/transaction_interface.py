@@ -1,6 +1,16 @@
+import os
 import json
 
-from utils import encrypt, decrypt, generate_mac, verify_mac
+from framing import FrameReader, send_frame
+from record_layer import RecordError
+import wire_codec
+from wire_codec import FORMAT_JSON, REQUEST, RESPONSE
+from auth_protocol import WIRE_FORMAT
+
+
+# Requests that change the balance carry a fresh request ID, so one whose reply
+# was lost can be sent again without being applied twice
+IDEMPOTENT_ACTIONS = ('deposit', 'withdraw', 'batch')
 
 
 # ============================================================
@@ -9,62 +19,173 @@ from utils import encrypt, decrypt, generate_mac, verify_mac
 # ============================================================
 
 
-def transaction_loop(sock, k_enc, k_mac):
+def read_batch_operations():
+    """
+    Prompts for batch operations, one per line ("deposit 100", "withdraw 50",
+    "balance"), until an empty line.
+
+    Returns:
+        list: Operations in the request format, e.g. {'action': 'deposit', 'amount': 100}
+    """
+    operations = []
+    print("Enter operations (e.g. 'deposit 100', 'withdraw 50', 'balance'), blank line to finish:")
     while True:
-        print("\nSelect an action:")
-        print("1. Deposit")
-        print("2. Withdraw")
-        print("3. Check Balance")
-        print("4. View My Logs")
-        print("5. Exit")
-        choice = input("Enter your choice: ")
-
-
-        action = None
-        data = {}
-
-
-        if choice == '1':
-            action = 'deposit'
-            amount = int(input("Enter amount to deposit: "))
-            data['amount'] = amount
-        elif choice == '2':
-            action = 'withdraw'
-            amount = int(input("Enter amount to withdraw: "))
-            data['amount'] = amount
-        elif choice == '3':
-            action = 'balance'
-        elif choice == '4':
-            action = 'view_log'
-        elif choice == '5':
-            print("\nLogging out.")
+        line = input("> ").strip()
+        if not line:
             break
+        parts = line.split()
+        op = {'action': parts[0]}
+        if len(parts) > 1:
+            op['amount'] = int(parts[1])
+        operations.append(op)
+    return operations
+
+
+def encode_request(data, wire_format):
+    if wire_format == FORMAT_JSON:
+        return json.dumps(data).encode()
+    return wire_codec.encode(REQUEST, data)
+
+
+def decode_response(payload, wire_format, username):
+    """
+    Returns (text or list of texts, next_cursor, more, replayed) from a reply in
+    either encoding; `more` is set on every chunk of a streamed log except the
+    last, `replayed` when the server had already applied this request.
+    """
+    if wire_format == FORMAT_JSON:
+        result = json.loads(payload.decode())
+        text = result['result']
+    else:
+        result = wire_codec.decode(RESPONSE, payload)[0]
+        text = wire_codec.describe_result(result, username)
+    return text, result.get('next_cursor'), bool(result.get('more')), bool(result.get('replayed'))
+
+
+def transaction_loop(sock, record, reader=None, wire_format=WIRE_FORMAT, username='', retry=None):
+    """
+    Interactive menu for one secure session. `record` is the session's
+    record layer (record_layer.new_record_layer), used to seal requests and
+    open replies with the negotiated cipher suite. `wire_format` must be the
+    encoding the handshake used. `retry` is a dict kept across reconnects: a
+    balance-changing request left unanswered when the connection dropped is
+    stored in it and sent again (same request ID) by the next session.
+
+    Returns:
+        bool: True when the session is over (logout or tampering),
+              False if the connection dropped and the caller may reconnect.
+    """
+    if reader is None:
+        reader = FrameReader(sock)
+    follow_up = None
+
+    while True:
+        if retry and retry.get('request'):
+            # Unanswered when the last connection dropped: the server applies it at most once
+            data = retry.pop('request')
+            print(f"\nResending the unanswered {data['action']} request...")
+        elif follow_up is not None:
+            # Request queued by the previous reply (next page of logs)
+            data, follow_up = follow_up, None
         else:
-            print("Invalid choice")
+            print("\nSelect an action:")
+            print("1. Deposit")
+            print("2. Withdraw")
+            print("3. Check Balance")
+            print("4. View My Logs")
+            print("5. Submit Batch")
+            print("6. Exit")
+            choice = input("Enter your choice: ")
+
+
+            action = None
+            data = {}
+
+
+            if choice == '1':
+                action = 'deposit'
+                amount = int(input("Enter amount to deposit: "))
+                data['amount'] = amount
+            elif choice == '2':
+                action = 'withdraw'
+                amount = int(input("Enter amount to withdraw: "))
+                data['amount'] = amount
+            elif choice == '3':
+                action = 'balance'
+            elif choice == '4':
+                action = 'view_log'
+                # Streamed: the whole history, shown chunk by chunk as it arrives
+                data['stream'] = input("Show the whole log? (y/n): ").strip().lower() == 'y'
+            elif choice == '5':
+                action = 'batch'
+                data['operations'] = read_batch_operations()
+                data['atomic'] = input("All-or-nothing? (y/n): ").strip().lower() == 'y'
+            elif choice == '6':
+                print("\nLogging out.")
+                return True
+            else:
+                print("Invalid choice")
+                continue
+
+
+            data['action'] = action
+            if action in IDEMPOTENT_ACTIONS:
+                data['request_id'] = os.urandom(16).hex()
+
+
+        try:
+            payload = encode_request(data, wire_format)
+        except wire_codec.WireError as e:
+            print(f"Cannot send this request: {e}")
             continue
-
-
-        data['action'] = action
-        payload = json.dumps(data).encode()
-        encrypted_payload = encrypt(k_enc, payload)
-        mac = generate_mac(k_mac, encrypted_payload)
-
-
-        # Send encrypted message with MAC
-        sock.sendall(encrypted_payload + mac)
-
-
-        # Receive and validate response
-        response_packet = sock.recv(4096)
-        encrypted_response = response_packet[:-32]
-        received_mac = response_packet[-32:]
-
-
-        if not verify_mac(k_mac, encrypted_response, received_mac):
-            print("Integrity check failed. Possible tampering.")
-            break
-
-
-        decrypted_response = decrypt(k_enc, encrypted_response)
-        result = json.loads(decrypted_response.decode())
-        print("[Message from Server]:", result['result'])
+        encrypted_payload = record.seal(payload)
+
+
+        # Send the protected request as one frame, then
+        # receive and validate the response (a whole frame, whatever its size;
+        # a streamed log arrives as several frames, each checked on its own)
+        try:
+            send_frame(sock, encrypted_payload)
+        except OSError:
+            print("Server closed the connection.")
+            if retry is not None and data.get('request_id'):
+                retry['request'] = data
+            return False
+        more = True
+        first = True
+        while more:
+            try:
+                response_packet = reader.recv_frame()
+            except OSError:
+                response_packet = None
+            if response_packet is None:
+                print("Server closed the connection.")
+                if retry is not None and data.get('request_id'):
+                    retry['request'] = data
+                return False
+            try:
+                decrypted_response = record.open(response_packet)
+            except RecordError:
+                print("Integrity check failed. Possible tampering.")
+                return True
+
+
+            text, next_cursor, more, replayed = decode_response(decrypted_response, wire_format, username)
+            if replayed:
+                print("(The server had already applied this request; it was not repeated.)")
+            if isinstance(text, list):
+                # Batch reply: one result per operation
+                print("[Message from Server]:")
+                for i, line in enumerate(text, 1):
+                    print(f"  {i}. {line}")
+            elif first:
+                print("[Message from Server]:", text)
+            else:
+                print(text)  # next chunk of a streamed log
+            first = False
+
+
+        # view_log replies are paged: offer the next (older) page
+        if next_cursor is not None:
+            if input("Show older entries? (y/n): ").strip().lower() == 'y':
+                follow_up = dict(data, cursor=next_cursor)
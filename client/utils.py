@@ -5,6 +5,7 @@ import hashlib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
+from key_store import key_store
 
 
 # =============================
@@ -126,7 +127,8 @@ def verify_mac(mac_key, data, received_mac):
 
 def load_user_key(username):
     """
-    Loads the user's pre-shared key from a JSON file.
+    Loads the user's pre-shared key through the shared key store interface
+    (cached, reloaded when the key file changes; JSON or binary format).
 
     Parameters:
         username (str): The username whose key is to be loaded.
@@ -134,7 +136,4 @@ def load_user_key(username):
     Returns:
         bytes: The user's key as a byte array.
     """
-    with open('server/user_keys.json', 'r') as f:
-        key_store = json.load(f)  # Load the key store from the JSON file
-        print(f"\n[client]Loaded key for {username}: {key_store[username]}")
-    return bytes.fromhex(key_store[username])  # Convert the key from hex to bytes
+    return key_store.get(username)
@@ -0,0 +1,395 @@
+import json
+import struct
+
+
+# =============================
+# Wire Encoding
+# Every protocol message (handshake and transactions) in one of two encodings,
+# picked by the client's first message and kept for the whole connection:
+#   'json'   - the original JSON objects (nonces and tickets as hex strings,
+#              results as English text)
+#   'binary' - [magic][version][message type] header, a varint bitmap of the
+#              fields present, then those fields in schema order: varints for
+#              integers (zigzag for signed ones), length-prefixed raw bytes and
+#              UTF-8 strings, and typed result codes with numeric fields.
+#              Boolean fields are just their presence bit.
+# A JSON message always starts with '{', a binary one with WIRE_MAGIC, so the
+# server tells them apart from the ClientHello and old JSON clients keep working.
+# The ClientHello layout never changes: its version byte is the highest version
+# the client speaks, and the server answers with min(that, WIRE_VERSION).
+# Mirrored in server/wire_codec.py
+# =============================
+
+
+WIRE_MAGIC = 0xB7
+WIRE_VERSION = 1
+HEADER = struct.Struct('>BBB')     # magic | version | message type
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+WIRE_FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+
+# Message types
+CLIENT_HELLO = 1
+SERVER_HELLO = 2
+CLIENT_RESPONSE = 3
+NEW_SESSION_TICKET = 4
+SERVER_RESUME = 5
+REQUEST = 6
+RESPONSE = 7
+SERVER_BUSY = 8      # sent instead of the handshake reply by an overloaded server, always binary
+HELLO_COOKIE = 9     # sent instead of the ServerHello to ask for the ClientHello again with the cookie, always binary
+
+# Request actions (sent as their position in this tuple, starting at 1; 0 = unknown)
+ACTIONS = ('deposit', 'withdraw', 'balance', 'view_log', 'batch')
+
+# Result status codes
+DEPOSITED = 1
+WITHDREW = 2
+BALANCE = 3
+INSUFFICIENT_FUNDS = 4
+INVALID_ACTION = 5
+INVALID_BATCH_ACTION = 6
+LOG_PAGE = 7
+NO_LOG_FILE = 8
+BATCH = 9
+ROLLED_BACK = 10
+ERROR = 11
+LOG_CHUNK = 12       # one frame of a streamed view_log; 'more' is set on all but the last
+BUSY = 13            # request shed by admission control; retry after 'retry_after' ms
+
+# Field kinds
+UINT, INT, BYTES, STR, BOOL, STRS, ACTION = range(7)
+
+OPERATION = (('action', ACTION), ('amount', INT))
+LOG_ENTRY = (('timestamp', STR), ('action', STR))
+OP_RESULT = (('status', UINT), ('amount', INT), ('balance', INT))
+
+# Field order per message type; new fields may only be appended
+SCHEMAS = {
+    CLIENT_HELLO: (('username', STR), ('nonce', BYTES), ('tickets', BOOL), ('ticket', BYTES), ('suites', STRS),
+                   ('cookie', BYTES)),
+    SERVER_HELLO: (('nonce_c', BYTES), ('nonce_s', BYTES), ('suite', STR)),
+    CLIENT_RESPONSE: (('nonce_s', BYTES), ('suites', STRS)),
+    NEW_SESSION_TICKET: (('ticket', BYTES), ('lifetime', UINT)),
+    SERVER_RESUME: (('resumed', BOOL), ('nonce_s', BYTES), ('suite', STR), ('proof', BYTES),
+                    ('ticket', BYTES), ('lifetime', UINT)),
+    REQUEST: (('action', ACTION), ('amount', INT), ('atomic', BOOL), ('operations', OPERATION),
+              ('since', STR), ('until', STR), ('limit', UINT), ('cursor', UINT), ('stream', BOOL),
+              ('request_id', STR)),
+    RESPONSE: (('status', UINT), ('amount', INT), ('balance', INT), ('message', STR),
+               ('entries', LOG_ENTRY), ('next_cursor', UINT), ('results', OP_RESULT), ('more', BOOL),
+               ('replayed', BOOL), ('retry_after', UINT)),
+    SERVER_BUSY: (('reason', STR), ('retry_after', UINT)),
+    HELLO_COOKIE: (('cookie', BYTES),),
+}
+
+
+class WireError(Exception):
+    """Raised for a malformed or unsupported binary message."""
+
+
+# === Varints ===
+
+def write_uvarint(out, n):
+    if n < 0:
+        raise WireError("Negative value in an unsigned field")
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_uvarint(data, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise WireError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 70:
+            raise WireError("Varint too long")
+
+
+def write_svarint(out, n):
+    write_uvarint(out, (n << 1) if n >= 0 else (-n << 1) - 1)   # zigzag
+
+
+def read_svarint(data, pos):
+    n, pos = read_uvarint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def write_blob(out, blob):
+    write_uvarint(out, len(blob))
+    out += blob
+
+
+def read_blob(data, pos):
+    size, pos = read_uvarint(data, pos)
+    end = pos + size
+    if end > len(data):
+        raise WireError("Truncated field")
+    return bytes(data[pos:end]), end
+
+
+# === Records ===
+
+def _encode_value(out, kind, value):
+    if kind == UINT:
+        write_uvarint(out, value)
+    elif kind == INT:
+        if not isinstance(value, int):
+            raise WireError(f"Binary encoding only carries whole numbers, got {value!r}")
+        write_svarint(out, value)
+    elif kind == BYTES:
+        write_blob(out, value)
+    elif kind == STR:
+        write_blob(out, value.encode())
+    elif kind == STRS:
+        write_uvarint(out, len(value))
+        for item in value:
+            write_blob(out, item.encode())
+    elif kind == ACTION:
+        # An unknown action goes out as 0 so the server answers it as invalid
+        write_uvarint(out, ACTIONS.index(value) + 1 if value in ACTIONS else 0)
+    else:  # nested list of records
+        write_uvarint(out, len(value))
+        for item in value:
+            _encode_record(out, kind, item)
+
+
+def _decode_value(data, pos, kind):
+    if kind == UINT:
+        return read_uvarint(data, pos)
+    if kind == INT:
+        return read_svarint(data, pos)
+    if kind == BYTES:
+        return read_blob(data, pos)
+    if kind == STR:
+        raw, pos = read_blob(data, pos)
+        return raw.decode(), pos
+    if kind == STRS:
+        count, pos = read_uvarint(data, pos)
+        items = []
+        for _ in range(count):
+            raw, pos = read_blob(data, pos)
+            items.append(raw.decode())
+        return items, pos
+    if kind == ACTION:
+        code, pos = read_uvarint(data, pos)
+        return (ACTIONS[code - 1] if 0 < code <= len(ACTIONS) else None), pos
+    count, pos = read_uvarint(data, pos)
+    items = []
+    for _ in range(count):
+        item, pos = _decode_record(data, pos, kind)
+        items.append(item)
+    return items, pos
+
+
+def _encode_record(out, schema, fields):
+    present = 0
+    body = bytearray()
+    for bit, (name, kind) in enumerate(schema):
+        value = fields.get(name)
+        if value is None or value is False:
+            continue
+        present |= 1 << bit
+        if kind != BOOL:
+            _encode_value(body, kind, value)
+    write_uvarint(out, present)
+    out += body
+
+
+def _decode_record(data, pos, schema):
+    present, pos = read_uvarint(data, pos)
+    if present >> len(schema):
+        raise WireError("Unknown fields in message")
+    fields = {}
+    for bit, (name, kind) in enumerate(schema):
+        if present & (1 << bit):
+            if kind == BOOL:
+                fields[name] = True
+            else:
+                fields[name], pos = _decode_value(data, pos, kind)
+    return fields, pos
+
+
+def encode(msg_type, fields, version=WIRE_VERSION):
+    """
+    Encodes one message in the binary format.
+
+    Parameters:
+        msg_type (int): One of the message type constants.
+        fields (dict): Field values; None / False / missing fields are left out.
+        version (int): Version written in the header.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    out = bytearray(HEADER.pack(WIRE_MAGIC, version, msg_type))
+    _encode_record(out, SCHEMAS[msg_type], fields)
+    return bytes(out)
+
+
+def decode(msg_type, data):
+    """
+    Decodes one binary message of the expected type.
+
+    Returns:
+        tuple: (fields (dict), version (int))
+
+    Raises:
+        WireError: If the message is malformed, of another type or a newer version.
+    """
+    if len(data) < HEADER.size:
+        raise WireError("Truncated message header")
+    magic, version, found_type = HEADER.unpack_from(data)
+    if magic != WIRE_MAGIC:
+        raise WireError("Not a binary protocol message")
+    if found_type != msg_type:
+        raise WireError(f"Expected message type {msg_type}, got {found_type}")
+    if msg_type != CLIENT_HELLO and not 0 < version <= WIRE_VERSION:
+        raise WireError(f"Unsupported wire version {version}")
+    fields, pos = _decode_record(data, HEADER.size, SCHEMAS[msg_type])
+    if pos != len(data):
+        raise WireError("Trailing bytes after message")
+    return fields, version
+
+
+def detect_format(data):
+    """
+    Returns FORMAT_BINARY or FORMAT_JSON for a received message.
+    """
+    return FORMAT_BINARY if data[:1] == bytes([WIRE_MAGIC]) else FORMAT_JSON
+
+
+def busy_message(data):
+    """
+    Returns the fields of a SERVER_BUSY message (reason, retry_after in ms),
+    or None if `data` is anything else, such as the expected handshake reply.
+    """
+    if len(data) < HEADER.size or data[0] != WIRE_MAGIC or data[2] != SERVER_BUSY:
+        return None
+    try:
+        return decode(SERVER_BUSY, data)[0]
+    except (WireError, UnicodeDecodeError):
+        return None
+
+
+def cookie_message(data):
+    """
+    Returns the cookie of a HELLO_COOKIE message, or None if `data` is anything else.
+    """
+    if len(data) < HEADER.size or data[0] != WIRE_MAGIC or data[2] != HELLO_COOKIE:
+        return None
+    try:
+        return decode(HELLO_COOKIE, data)[0].get('cookie')
+    except WireError:
+        return None
+
+
+def negotiate_version(offered):
+    return max(1, min(offered, WIRE_VERSION))
+
+
+def dumps(msg_type, fields, wire_format, version=WIRE_VERSION):
+    """
+    Serializes a message in the session's encoding. In JSON, byte fields are
+    sent as hex strings (as the original protocol did).
+    """
+    if wire_format == FORMAT_BINARY:
+        return encode(msg_type, fields, version)
+    body = {}
+    for name, kind in SCHEMAS[msg_type]:
+        value = fields.get(name)
+        if value is not None:
+            body[name] = value.hex() if kind == BYTES else value
+    return json.dumps(body).encode()
+
+
+def loads(msg_type, data, wire_format=None):
+    """
+    Parses a message in the given encoding (None = detect it).
+
+    Returns:
+        dict: The fields, with byte fields as bytes in both encodings.
+    """
+    if wire_format is None:
+        wire_format = detect_format(data)
+    if wire_format == FORMAT_BINARY:
+        return decode(msg_type, data)[0]
+    fields = json.loads(data.decode())
+    for name, kind in SCHEMAS[msg_type]:
+        if kind == BYTES and fields.get(name):
+            fields[name] = bytes.fromhex(fields[name])
+    return fields
+
+
+# === Results ===
+
+def describe_operation(result):
+    """
+    The English text the JSON protocol uses for one (operation) result.
+    """
+    status = result['status']
+    if status == DEPOSITED:
+        return f"Deposited ${result['amount']}. New balance: ${result['balance']}"
+    if status == WITHDREW:
+        return f"Withdrew ${result['amount']}. New balance: ${result['balance']}"
+    if status == BALANCE:
+        return f"Current balance: ${result['balance']}"
+    if status == INSUFFICIENT_FUNDS:
+        return "Insufficient funds."
+    if status == INVALID_ACTION:
+        return "Invalid action."
+    if status == INVALID_BATCH_ACTION:
+        return "Invalid action in batch."
+    if status == BUSY:
+        return f"Server busy ({result.get('message')}), try again in {result.get('retry_after', 0) / 1000:g}s."
+    return result.get('message', '')
+
+
+def describe_result(result, username):
+    """
+    Turns a typed result into the text of the JSON protocol.
+
+    Returns:
+        str, or a list of str for batches.
+    """
+    status = result['status']
+    if status in (BATCH, ROLLED_BACK):
+        prefix = "Rolled back: " if status == ROLLED_BACK else ""
+        return [prefix + describe_operation(r) for r in result.get('results', [])]
+    if status == NO_LOG_FILE:
+        return "No log file found."
+    if status in (LOG_PAGE, LOG_CHUNK):
+        entries = result.get('entries') or []
+        if not entries:
+            return "No logs found."
+        return "\n".join(f"{entry['timestamp']} - {username} - {entry['action']}" for entry in entries)
+    return describe_operation(result)
+
+
+def json_response(result, username):
+    """
+    The reply body a JSON client expects: {"result": text} (plus next_cursor for
+    view_log pages, 'more' for streamed view_log chunks, 'replayed' when a
+    retried request_id was answered with its original result, and 'busy' with
+    'retry_after' in ms when the request was shed).
+    """
+    body = {"result": describe_result(result, username)}
+    if result.get('replayed'):
+        body["replayed"] = True
+    if result['status'] == BUSY:
+        body["busy"] = True
+        body["retry_after"] = result.get('retry_after', 0)
+    if result['status'] == LOG_CHUNK:
+        body["more"] = bool(result.get('more'))
+    if result['status'] in (LOG_PAGE, NO_LOG_FILE):
+        body["next_cursor"] = result.get('next_cursor')
+    return body
@@ -0,0 +1,242 @@
+import heapq
+import socket
+import asyncio
+import threading
+import time
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future
+import metrics
+import wire_codec
+from framing import send_frame, write_frame_async
+
+
+# =============================
+# Admission Control
+# Keeps an overloaded server responsive instead of letting every session slow down:
+#   - at most MAX_SESSIONS sessions per process; further connections get an
+#     immediate SERVER_BUSY message (before the handshake, so no crypto or key
+#     lookup is spent on them) and are closed
+#   - a token bucket per user (USER_RATE requests/s, bursts of USER_BURST)
+#   - priority classes: cheap requests run straight away on the session's thread
+#     (or the event loop); expensive ones (batch, view_log) queue for a bounded
+#     pool of POOL_WORKERS threads, lowest class first, and are shed with a BUSY
+#     reply once the queue is fuller than their class allows
+# Limits are per process (each pre-forked worker has its own).
+# =============================
+
+
+MAX_SESSIONS = 512          # Concurrent sessions; more are refused with SERVER_BUSY
+ACCEPT_BACKLOG = 128        # Connections the kernel queues before accept()
+POOL_WORKERS = 8            # Threads running the expensive request classes
+POOL_QUEUE = 64             # Expensive requests waiting for a pool thread
+USER_RATE = 1000.0          # Requests per second per user (0 = no limit)
+USER_BURST = 2000           # Requests a user may send at once after being idle
+BUSY_RETRY_AFTER = 1.0      # Seconds refused clients are told to wait
+REJECT_QUEUE = 256          # Refused connections waiting for their SERVER_BUSY message
+
+# Priority classes, lower served first
+PRIORITY = {'balance': 0, 'deposit': 1, 'withdraw': 1, 'batch': 2, 'view_log': 3}
+POOLED_ACTIONS = ('batch', 'view_log')
+# Fraction of POOL_QUEUE a class may fill before its requests are shed
+SHED_AT = {2: 1.0, 3: 0.5}
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; `retry_after` is in seconds."""
+
+    def __init__(self, reason, retry_after=BUSY_RETRY_AFTER):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class SessionLimiter:
+    """
+    Counts admitted sessions against a fixed maximum (non-blocking).
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._slots = threading.BoundedSemaphore(max_sessions)
+
+    def try_enter(self):
+        return self._slots.acquire(blocking=False)
+
+    def leave(self):
+        self._slots.release()
+
+
+class RateLimiter:
+    """
+    Token bucket per user; the least recently seen users are forgotten past `max_users`.
+    """
+
+    def __init__(self, rate=USER_RATE, burst=USER_BURST, max_users=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets = OrderedDict()   # username -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def check(self, username, now=None):
+        """
+        Takes one token for `username`.
+
+        Returns:
+            float: 0 if the request may go ahead, else seconds until a token is available.
+        """
+        if not self.rate:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(username, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[username] = (tokens, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / self.rate
+
+
+class PriorityPool:
+    """
+    Fixed pool of threads serving a bounded priority queue: the lowest
+    priority number runs first, equal priorities in arrival order.
+    """
+
+    def __init__(self, workers=POOL_WORKERS, max_queue=POOL_QUEUE, shed_at=SHED_AT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.shed_at = shed_at
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, priority, fn, *args):
+        """
+        Queues fn(*args).
+
+        Returns:
+            concurrent.futures.Future: Its result (wrap with asyncio.wrap_future on the event loop).
+
+        Raises:
+            Overloaded: If the queue is too full for this priority class.
+        """
+        future = Future()
+        with self._cond:
+            if len(self._heap) >= self.max_queue * self.shed_at.get(priority, 1.0):
+                raise Overloaded("request queue full")
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='request-pool', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._seq += 1
+            heapq.heappush(self._heap, (priority, self._seq, fn, args, future))
+            self._cond.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, fn, args, future = heapq.heappop(self._heap)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+
+# Process-wide instances (rebuilt by configure() from the server's flags)
+sessions = SessionLimiter()
+rate_limiter = RateLimiter()
+pool = PriorityPool()
+
+
+def configure(max_sessions=MAX_SESSIONS, pool_workers=POOL_WORKERS, pool_queue=POOL_QUEUE,
+              user_rate=USER_RATE, user_burst=USER_BURST):
+    """
+    Replaces the process-wide limits (call before serving).
+    """
+    global sessions, rate_limiter, pool
+    sessions = SessionLimiter(max_sessions)
+    rate_limiter = RateLimiter(user_rate, user_burst)
+    pool = PriorityPool(pool_workers, pool_queue)
+
+
+def busy_result(reason, retry_after=BUSY_RETRY_AFTER):
+    """
+    The typed BUSY result for a shed request.
+    """
+    metrics.count('shed:reason', reason)
+    return {'status': wire_codec.BUSY, 'message': reason, 'retry_after': int(retry_after * 1000)}
+
+
+def busy_frame(reason, retry_after=BUSY_RETRY_AFTER):
+    """
+    The SERVER_BUSY frame sent to a refused connection. It is always binary:
+    the client's encoding is not known yet, and every client that understands
+    SERVER_BUSY checks for it before parsing a handshake reply.
+    """
+    return wire_codec.encode(wire_codec.SERVER_BUSY, {'reason': reason, 'retry_after': int(retry_after * 1000)})
+
+
+class Rejector:
+    """
+    One background thread that tells refused connections the server is busy,
+    so the accept loop never waits on them. Its queue is bounded too: when it
+    is full, connections are closed without a message.
+    """
+
+    def __init__(self, max_queue=REJECT_QUEUE, linger=0.2):
+        self.linger = linger
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+
+    def reject(self, conn, reason="too many sessions"):
+        metrics.count('shed:reason', reason)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rejector', daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((conn, reason))
+        except queue.Full:
+            conn.close()
+
+    def _run(self):
+        while True:
+            conn, reason = self._queue.get()
+            try:
+                conn.settimeout(self.linger)
+                send_frame(conn, busy_frame(reason))
+                conn.shutdown(socket.SHUT_WR)
+                # Read what the client already sent (its ClientHello) so closing does not
+                # reset the connection and throw away the message before it is read
+                while conn.recv(4096):
+                    pass
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+async def reject_async(reader, writer, reason="too many sessions", linger=0.2):
+    """
+    asyncio counterpart of Rejector.reject.
+    """
+    metrics.count('shed:reason', reason)
+    try:
+        await write_frame_async(writer, busy_frame(reason))
+        writer.write_eof()
+        await asyncio.wait_for(reader.read(), linger)
+    except (OSError, asyncio.TimeoutError):
+        pass
@@ -1,24 +1,307 @@
 import os
 import json
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
 from utils import encrypt, get_audit_key
+from audit_store import UserAuditLog, AuditLogReader, compact_segment, write_checkpoint
 
 
 # =============================
 # Point 4: Encrypted Audit Logging (Per User)
 # Stores customer actions in separate encrypted files
+#
+# Entries are typed events (version EVENT_VERSION): besides customer_id,
+# action (display text) and timestamp they carry 'type' (the operation) and,
+# where they apply, 'amount', 'delta' (the signed balance change made),
+# 'balance' (the balance afterwards) and 'seq' (the ledger write, which
+# orders balance changes even when entries reach the log out of order).
+# Entries written before events were typed have none of these fields.
 # =============================
 
 
 AUDIT_LOG_DIR = 'server/audit_logs'  # Directory to store encrypted audit logs
 
-def log_encrypted_action(customer_id, action, timestamp):
+# Durability policy for request threads:
+#   'async' - enqueue the entry and carry on (it is fsynced within AUDIT_DURABILITY_WINDOW)
+#   'sync'  - wait until the entry has been fsynced before returning
+AUDIT_DURABILITY = 'async'
+AUDIT_DURABILITY_WINDOW = 0.05   # Max seconds between a write and its group fsync
+AUDIT_QUEUE_SIZE = 10000         # Bounded queue: producers block when the writer falls behind
+AUDIT_MAX_OPEN_FILES = 256       # Per-user file handles kept open (least recently used closed first)
+AUDIT_STREAM_CHUNK = 100         # Entries per frame of a streamed view_log
+AUDIT_SEGMENT_MAX_BYTES = 1 << 20    # Rotate a user's active segment past this size ...
+AUDIT_SEGMENT_MAX_AGE = 24 * 3600    # ... or once its first entry is this many seconds old
+AUDIT_BLOCK_ENTRIES = 256            # Entries per compressed, encrypted block of a sealed segment
+AUDIT_CHECKPOINT_EVERY = 1000        # Entries between a user's balance checkpoints
+EVENT_VERSION = 2                    # Version of the typed event fields (1 = action and timestamp only)
+
+
+class AuditWriter:
+    """
+    Background audit writer.
+
+    Request threads only enqueue entries. A dedicated writer thread encrypts
+    them, appends everything queued for the same user with one write on a
+    segment it keeps open (see audit_store), and fsyncs all touched files together at most
+    AUDIT_DURABILITY_WINDOW seconds after the first unsynced write (group fsync).
+    Full or old active segments are rotated out and compacted into sealed
+    segments by a second thread, so compaction never holds up new entries.
+    After a group fsync, users with AUDIT_CHECKPOINT_EVERY new entries get a
+    balance checkpoint covering everything now on disk.
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_dir=AUDIT_LOG_DIR, max_queue=AUDIT_QUEUE_SIZE,
+                 durability_window=AUDIT_DURABILITY_WINDOW, max_open_files=AUDIT_MAX_OPEN_FILES,
+                 segment_max_bytes=AUDIT_SEGMENT_MAX_BYTES, segment_max_age=AUDIT_SEGMENT_MAX_AGE,
+                 block_entries=AUDIT_BLOCK_ENTRIES, checkpoint_every=AUDIT_CHECKPOINT_EVERY):
+        self.log_dir = log_dir
+        self.durability_window = durability_window
+        self.max_open_files = max_open_files
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.block_entries = block_entries
+        self.checkpoint_every = checkpoint_every
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._files = OrderedDict()    # customer_id -> open UserAuditLog (LRU order)
+        self._dirty = set()            # customer_ids written since the last fsync
+        self._unsynced = []            # tickets released by the next fsync
+        self._sync_deadline = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._compact_queue = queue.Queue()   # (customer_id, first entry) of sealing segments
+        self._compactor = None
+        self._latest = {}              # customer_id -> (seq, balance) of the latest ledger write logged
+        self._since_checkpoint = {}    # customer_id -> entries written since its last checkpoint
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    os.makedirs(self.log_dir, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, audit_data, wait=False):
+        """
+        Queues one audit entry.
+
+        Parameters:
+            audit_data (dict): The entry; must include 'customer_id'.
+            wait (bool): Block until the entry is fsynced.
+        """
+        self.submit_many([audit_data], wait)
+
+    def submit_many(self, entries, wait=False):
+        """
+        Queues several audit entries in order, e.g. every operation of a batch.
+
+        Parameters:
+            entries (list of dict): The entries; each must include 'customer_id'.
+            wait (bool): Block until all of them are fsynced (one wait, on the last:
+                         entries are written in order and fsynced in groups).
+        """
+        self._ensure_started()
+        ticket = threading.Event() if wait else None
+        for n, audit_data in enumerate(entries, 1):
+            self._queue.put(('entry', audit_data, ticket if n == len(entries) else None))
+        if ticket is not None:
+            ticket.wait()
+
+    def flush(self, durable=False):
+        """
+        Barrier: returns once every entry queued before the call has been
+        written to its file (readers can see it), and fsynced if `durable`.
+        """
+        self._ensure_started()
+        ticket = threading.Event()
+        self._queue.put(('flush', durable, ticket))
+        ticket.wait()
+
+    def close(self):
+        """
+        Writes and fsyncs everything still queued, then stops the writer.
+        """
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+        if self._compactor is not None:
+            self._compact_queue.put(self._STOP)  # after whatever rotations are still queued
+            self._compactor.join()
+            self._compactor = None
+
+    # === Writer thread ===
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._sync_deadline is not None:
+                timeout = max(0.0, self._sync_deadline - time.monotonic())
+            try:
+                first = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._sync()
+                continue
+
+            # Drain whatever else is already queued into the same batch
+            batch = [first]
+            while len(batch) < 1024:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = self._write_batch(batch)
+            if stopping:
+                self._sync()
+                for f in self._files.values():
+                    f.close()
+                self._files.clear()
+                return
+            # Sync when the window expires, or right away if someone is waiting
+            # and nothing else is queued to share the fsync with
+            if self._sync_deadline is not None and (time.monotonic() >= self._sync_deadline
+                                                    or (self._unsynced and self._queue.empty())):
+                self._sync()
+
+    def _write_batch(self, batch):
+        """
+        Encrypts and appends a batch (one write per user); handles flush
+        barriers in order. Returns True when a stop request was seen.
+        """
+        pending = OrderedDict()   # customer_id -> list of (ciphertext, timestamp)
+        stopping = False
+        for item in batch:
+            if item is self._STOP:
+                stopping = True
+                continue
+            kind, payload, ticket = item
+            if kind == 'entry':
+                log_entry = json.dumps(payload).encode()
+                encrypted_entry = encrypt(get_audit_key(), log_entry)
+                customer_id = payload['customer_id']
+                pending.setdefault(customer_id, []).append((encrypted_entry, payload['timestamp']))
+                self._since_checkpoint[customer_id] = self._since_checkpoint.get(customer_id, 0) + 1
+                seq = payload.get('seq')
+                if seq is not None and seq >= self._latest.get(customer_id, (0, None))[0]:  # a batch's last entry wins
+                    self._latest[customer_id] = (seq, payload['balance'])
+                if ticket is not None:
+                    self._unsynced.append(ticket)
+            else:
+                # Flush barrier: everything before it must reach the files first
+                self._write_pending(pending)
+                pending = OrderedDict()
+                if payload:
+                    self._unsynced.append(ticket)
+                    self._sync()
+                else:
+                    ticket.set()
+        self._write_pending(pending)
+        return stopping
+
+    def _write_pending(self, pending):
+        for customer_id, items in pending.items():
+            # Written through to the OS so readers see it; fsync comes with the group
+            f = self._file_for(customer_id)
+            f.append_many(items)
+            self._dirty.add(customer_id)
+            if f.offset >= self.segment_max_bytes or f.age() >= self.segment_max_age:
+                self._compact(customer_id, f.rotate())
+        if pending and self._sync_deadline is None:
+            self._sync_deadline = time.monotonic() + self.durability_window
+
+    def _file_for(self, customer_id):
+        f = self._files.get(customer_id)
+        if f is not None:
+            self._files.move_to_end(customer_id)
+            return f
+        if len(self._files) >= self.max_open_files:
+            old_id, old_file = self._files.popitem(last=False)
+            if old_id in self._dirty:
+                old_file.fsync()  # don't lose durability when evicting
+                self._dirty.discard(old_id)
+            old_file.close()
+        # Each customer has their own encrypted log <customer_id>.enc (+ .idx index)
+        f = UserAuditLog(self.log_dir, customer_id)
+        self._files[customer_id] = f
+        for first_entry in f.pending:
+            self._compact(customer_id, first_entry)  # left over from a crash or a failed compaction
+        return f
+
+    def _compact(self, customer_id, first_entry):
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=self._compact_loop, name='audit-compactor', daemon=True)
+            self._compactor.start()
+        self._compact_queue.put((customer_id, first_entry))
+
+    def _compact_loop(self):
+        while True:
+            item = self._compact_queue.get()
+            if item is self._STOP:
+                return
+            customer_id, first_entry = item
+            try:
+                before, after = compact_segment(self.log_dir, customer_id, first_entry, self.block_entries)
+                print(f"[AUDIT] Compacted {customer_id} entries from {first_entry}: {before} -> {after} bytes")
+            except Exception as e:
+                # The sealing pair stays readable and is retried when the writer next opens this user
+                print(f"[AUDIT] Compaction of {customer_id} entries from {first_entry} failed: {e}")
+
+    def _checkpoint(self, customer_id, f):
+        """
+        Writes the user's balance checkpoint once enough entries have been
+        fsynced since the last one (and some entry has told us the balance).
+        """
+        if self._since_checkpoint.get(customer_id, 0) < self.checkpoint_every or customer_id not in self._latest:
+            return
+        seq, balance = self._latest[customer_id]
+        try:
+            write_checkpoint(self.log_dir, customer_id, {'entry': f.base + f.count, 'seq': seq, 'balance': balance})
+            self._since_checkpoint[customer_id] = 0
+        except OSError as e:
+            print(f"[AUDIT] Checkpoint of {customer_id} failed: {e}")  # replay just starts further back
+
+    def _sync(self):
+        """
+        Group fsync of every file written since the last sync; releases waiters.
+        """
+        for customer_id in self._dirty:
+            f = self._files.get(customer_id)
+            if f is not None:
+                f.fsync()
+                self._checkpoint(customer_id, f)
+        self._dirty.clear()
+        self._sync_deadline = None
+        for ticket in self._unsynced:
+            ticket.set()
+        self._unsynced = []
+
+
+# Process-wide writer used by log_encrypted_action; started on first use
+audit_writer = AuditWriter()
+atexit.register(audit_writer.close)
+
+
+def log_encrypted_action(customer_id, action, timestamp, event=None, wait=None):
     """
     Logs a customer's action in an encrypted audit log file.
+    The entry is handed to the background audit writer; with
+    AUDIT_DURABILITY = 'sync' this waits until it has been fsynced.
+    A batch's operations come as event['ops']: each is logged as its own
+    entry ahead of the request's, all submitted together with one wait.
 
     Parameters:
         customer_id (str): The unique identifier for the customer.
         action (str): The action performed by the customer (e.g., "deposit", "withdraw").
         timestamp (str): The timestamp of when the action occurred.
+        event (dict): Typed event fields (type, amount, delta, balance, seq); type defaults to `action`.
+                      'ops' lists the typed events of a batch's operations.
+        wait (bool): Overrides AUDIT_DURABILITY for this call (None = use the policy).
 
     Returns:
         None
@@ -26,40 +309,83 @@ def log_encrypted_action(customer_id, action, timestamp):
 
 
     # Step 1: Prepare the audit data
-    # Create a dictionary containing the customer ID, action, and timestamp
+    # Create a dictionary containing the customer ID, action, timestamp and the typed event fields
+    # (one per batch operation, then the request's own)
+    event = dict(event or {})
+    entries = [audit_entry(customer_id, op['type'], timestamp, op) for op in event.pop('ops', ())]
+    entries.append(audit_entry(customer_id, action, timestamp, event))
+
+
+    # Step 2: Queue them; the writer thread encrypts and appends them to the customer's active segment
+    if wait is None:
+        wait = AUDIT_DURABILITY == 'sync'
+    audit_writer.submit_many(entries, wait=wait)
+
+
+def audit_entry(customer_id, action, timestamp, event):
     audit_data = {
         'customer_id': customer_id,
         'action': action,
-        'timestamp': timestamp
+        'timestamp': timestamp,
+        'v': EVENT_VERSION,
+        'type': action,
     }
+    audit_data.update(event)
+    return audit_data
 
 
-    # Step 2: Serialize the audit data to JSON and encrypt it
-    log_entry = json.dumps(audit_data).encode()  
-    encrypted_entry = encrypt(get_audit_key(), log_entry)  
-
-
-    # Step 3: Ensure the audit_logs directory exists
-    # Create the directory if it does not already exist
-    os.makedirs(AUDIT_LOG_DIR, exist_ok=True)
-
+def query_audit_log(customer_id, since=None, until=None, limit=100, cursor=None):
+    """
+    Reads one page of a customer's audit log through the index.
 
-    # Step 4: Determine the per-user log file path
-    # Each customer has their own encrypted log file named <customer_id>.enc
-    user_log_file = os.path.join(AUDIT_LOG_DIR, f"{customer_id}.enc")
+    Parameters:
+        customer_id (str): Whose log to read.
+        since, until (str): Optional 'YYYY-MM-DD HH:MM:SS' bounds (inclusive).
+        limit (int): Maximum number of entries.
+        cursor (int): Entry number returned by the previous page (pages go back in time).
 
+    Returns:
+        tuple: (entries (list of dict) or None if the user has no log, next_cursor)
+    """
+    with AuditLogReader(AUDIT_LOG_DIR, customer_id) as reader:
+        if not reader and not os.path.exists(os.path.join(AUDIT_LOG_DIR, f"{customer_id}.enc")):
+            return None, None
+        return reader.page(since=since, until=until, limit=limit, cursor=cursor)
 
 
-    # Step 5: Append the encrypted log entry to the user's log file
-    # Open the file in append-binary mode ('ab') to add the new entry
-    with open(user_log_file, 'ab') as f:
-        f.write(encrypted_entry + b'\n')  # Write the encrypted entry followed by a newline
-        f.flush()  
-        os.fsync(f.fileno())  
+def stream_audit_log(customer_id, since=None, until=None, cursor=None, chunk_size=AUDIT_STREAM_CHUNK):
+    """
+    Opens a customer's audit log for streaming. The reader is opened right
+    away (so entries logged after this call are not included), but entries are
+    only decrypted as the returned generator is consumed, one chunk at a time.
 
+    Parameters:
+        customer_id (str): Whose log to read.
+        since, until (str): Optional 'YYYY-MM-DD HH:MM:SS' bounds (inclusive).
+        cursor (int): Only entries before this entry number.
+        chunk_size (int): Entries per chunk.
 
+    Returns:
+        generator of lists of entry dicts (oldest first; a log with no matching
+        entries yields one empty chunk), or None if the user has no log.
+    """
+    reader = AuditLogReader(AUDIT_LOG_DIR, customer_id)
+    if not reader and not os.path.exists(os.path.join(AUDIT_LOG_DIR, f"{customer_id}.enc")):
+        reader.close()
+        return None
+    lo, hi = reader.span(since, until, cursor)
+    return _iter_chunks(reader, lo, hi, chunk_size)
 
 
-    # Debugging information
-    print(f"\n[DEBUG] Logging for {customer_id}: {action} at {timestamp}")
-    print(f"[DEBUG] Saving to file: {user_log_file}\n")
\ No newline at end of file
+def _iter_chunks(reader, lo, hi, chunk_size):
+    with reader:
+        chunk = []
+        sent = False
+        for entry in reader.entries(lo, hi):
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+                sent = True
+        if chunk or not sent:
+            yield chunk
@@ -0,0 +1,773 @@
+import os
+import glob
+import json
+import mmap
+import time
+import zlib
+import fcntl
+import struct
+import bisect
+from contextlib import contextmanager
+from utils import encrypt, decrypt, get_audit_key
+
+
+# =============================
+# Audit Log Storage Format
+# Per-user audit segment with a sidecar index, so view_log can seek straight
+# to a page of entries instead of decrypting the whole history.
+#
+#   <customer_id>.enc  data:  SEGMENT_MAGIC, then records of
+#                             [u32 payload length][19-byte timestamp][IV + AES-CBC ciphertext]
+#   <customer_id>.idx  index: one fixed-size record per entry:
+#                             [u64 record offset][u32 payload length][19-byte timestamp]
+#
+# Entry number N is the N-th entry of the user's whole history. Timestamps are
+# 'YYYY-MM-DD HH:MM:SS' strings, which sort correctly as bytes; the indexed copy
+# is clamped so it never goes backwards, keeping every index sorted for binary search.
+#
+# Rotation and compaction: the pair above is the *active* segment. Once it is
+# large or old enough the audit writer renames it to
+#   <customer_id>.<first entry>.sealing.enc / .sealing.idx
+# and starts an empty active segment. A compactor thread then rewrites the
+# sealing pair as one immutable sealed segment
+#   <customer_id>.<first entry>.seg   SEALED_MAGIC, then blocks of up to BLOCK_ENTRIES
+#                                     entries (zlib-compressed JSON, encrypted as one
+#                                     unit: one IV and one padding per block), then a
+#                                     table of BLOCK_RECORDs and the block count
+# lists it in <customer_id>.manifest and deletes the sealing pair. Readers see
+# sealed segments, sealing pairs and the active segment as one sequence of
+# entries; renames and manifest updates happen under an exclusive flock on
+# SEGMENT_LOCK_FILE, and readers take it shared while opening, so they never
+# see an entry twice or miss one.
+#
+# Balance checkpoints: <customer_id>.ckpt holds one encrypted JSON object
+# {entry, seq, balance}: every entry numbered below `entry` is on disk, and
+# `balance` is the account's balance after ledger write `seq`, the latest
+# write among those entries' events. Rebuilding balances from the events
+# (ledger_rebuild.py) starts there instead of at entry 0.
+# =============================
+
+
+SEGMENT_MAGIC = b'AUDSEG1\n'
+RECORD_HEADER = struct.Struct('>I19s')
+INDEX_RECORD = struct.Struct('>QI19s')
+TIMESTAMP_WIDTH = 19
+
+SEALED_MAGIC = b'AUDBLK1\n'
+BLOCK_RECORD = struct.Struct('>QII19s19s')   # offset | length | entries | first timestamp | last timestamp
+SEALED_TRAILER = struct.Struct('>I')         # number of blocks
+BLOCK_ENTRIES = 256
+SEGMENT_LOCK_FILE = 'segments.lock'
+
+def data_path(log_dir, customer_id):
+    return os.path.join(log_dir, f"{customer_id}.enc")
+
+
+def index_path(log_dir, customer_id):
+    return os.path.join(log_dir, f"{customer_id}.idx")
+
+
+def manifest_path(log_dir, customer_id):
+    return os.path.join(log_dir, f"{customer_id}.manifest")
+
+
+def sealed_path(log_dir, customer_id, first_entry):
+    return os.path.join(log_dir, f"{customer_id}.{first_entry:012d}.seg")
+
+
+def checkpoint_path(log_dir, customer_id):
+    return os.path.join(log_dir, f"{customer_id}.ckpt")
+
+
+def sealing_paths(log_dir, customer_id, first_entry):
+    base = os.path.join(log_dir, f"{customer_id}.{first_entry:012d}.sealing")
+    return base + '.enc', base + '.idx'
+
+
+def encode_timestamp(timestamp):
+    return timestamp.encode()[:TIMESTAMP_WIDTH].ljust(TIMESTAMP_WIDTH, b' ')
+
+
+def user_files(log_dir, customer_id):
+    """
+    Every file that makes up one user's audit log (active, sealing and sealed segments, manifest, checkpoint).
+    """
+    prefix = os.path.join(log_dir, glob.escape(customer_id))
+    paths = [data_path(log_dir, customer_id), index_path(log_dir, customer_id), manifest_path(log_dir, customer_id),
+             checkpoint_path(log_dir, customer_id)]
+    paths += glob.glob(prefix + '.[0-9]*.seg') + glob.glob(prefix + '.[0-9]*.sealing.*')
+    return [p for p in paths if os.path.exists(p)]
+
+
+@contextmanager
+def segment_lock(log_dir, shared=False):
+    """
+    Serializes segment renames and manifest updates (exclusive) against
+    readers assembling their view of a log (shared), across processes.
+    """
+    with open(os.path.join(log_dir, SEGMENT_LOCK_FILE), 'a+b') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _write_file(path, data):
+    """
+    Replaces `path` atomically (temp file + fsync + rename).
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_dir(log_dir):
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(log_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def load_manifest(log_dir, customer_id):
+    """
+    Returns the user's sealed segments, ordered by first entry:
+    [{'file', 'first_entry', 'count', 'first_ts', 'last_ts'}, ...]
+    """
+    try:
+        with open(manifest_path(log_dir, customer_id), 'rb') as f:
+            return json.loads(f.read().decode())['segments']
+    except FileNotFoundError:
+        return []
+
+
+def write_checkpoint(log_dir, customer_id, checkpoint):
+    """
+    Atomically replaces the user's balance checkpoint ({entry, seq, balance}).
+    """
+    _write_file(checkpoint_path(log_dir, customer_id), encrypt(get_audit_key(), json.dumps(checkpoint).encode()))
+
+
+def read_checkpoint(log_dir, customer_id):
+    """
+    Returns:
+        dict: The user's latest balance checkpoint, or None if there is none (or it cannot be read).
+    """
+    try:
+        with open(checkpoint_path(log_dir, customer_id), 'rb') as f:
+            checkpoint = json.loads(decrypt(get_audit_key(), f.read()).decode())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(checkpoint, dict) or \
+            not all(isinstance(checkpoint.get(key), int) for key in ('entry', 'seq', 'balance')):
+        return None
+    return checkpoint
+
+
+def pending_sealing(log_dir, customer_id):
+    """
+    First entry numbers of sealing pairs still waiting for compaction.
+    """
+    pattern = os.path.join(log_dir, glob.escape(customer_id) + '.[0-9]*.sealing.enc')
+    firsts = []
+    for path in glob.glob(pattern):
+        number = os.path.basename(path)[len(customer_id) + 1:-len('.sealing.enc')]
+        if number.isdigit():
+            firsts.append(int(number))
+    return sorted(firsts)
+
+
+# === Legacy format (one raw ciphertext per line) ===
+
+def iter_legacy_entries(data):
+    """
+    Yields (ciphertext, entry) from an old newline-separated log. Raw
+    ciphertext can itself contain b'\\n', so pieces are re-joined until they
+    decrypt to a JSON entry, recovering entries the old reader skipped.
+    """
+    key = get_audit_key()
+    buf = None
+    for piece in data.split(b'\n'):
+        buf = piece if buf is None else buf + b'\n' + piece
+        if len(buf) >= 32 and len(buf) % 16 == 0:
+            try:
+                entry = json.loads(decrypt(key, buf).decode())
+            except Exception:
+                entry = None
+            if isinstance(entry, dict):
+                yield buf, entry
+                buf = None
+                continue
+        if len(buf) > 65536:
+            buf = None  # unrecoverable garbage, resynchronise at the next piece
+
+
+def is_segment(path):
+    with open(path, 'rb') as f:
+        return f.read(len(SEGMENT_MAGIC)) == SEGMENT_MAGIC
+
+
+def is_legacy(path):
+    return os.path.exists(path) and os.path.getsize(path) > 0 and not is_segment(path)
+
+
+def migrate_legacy_log(log_dir, customer_id):
+    """
+    Rewrites <customer_id>.enc from the legacy line format into the segment
+    format (plus index), holding the segment lock exclusively so no other
+    process converts or reads it at the same time. Only the process that owns
+    the audit writer calls this.
+
+    Returns:
+        bool: True if the file was converted, False if it is missing or already converted.
+    """
+    path = data_path(log_dir, customer_id)
+    if not os.path.exists(path):
+        return False
+    with segment_lock(log_dir):
+        if not is_legacy(path):
+            return False
+        with open(path, 'rb') as f:
+            legacy = f.read()
+
+        data_parts = [SEGMENT_MAGIC]
+        index_parts = []
+        offset = len(SEGMENT_MAGIC)
+        last_ts = b''
+        for ciphertext, entry in iter_legacy_entries(legacy):
+            ts = max(encode_timestamp(str(entry.get('timestamp', ''))), last_ts)
+            last_ts = ts
+            data_parts.append(RECORD_HEADER.pack(len(ciphertext), ts) + ciphertext)
+            index_parts.append(INDEX_RECORD.pack(offset, len(ciphertext), ts))
+            offset += RECORD_HEADER.size + len(ciphertext)
+
+        # Index first, then atomically swap the data file in
+        _write_file(index_path(log_dir, customer_id), b''.join(index_parts))
+        _write_file(path, b''.join(data_parts))
+        return True
+
+
+def migrate_legacy_logs(log_dir):
+    """
+    Converts every legacy log in `log_dir` (see migrate_legacy_log). Run once
+    at start-up, before serving, by the process that owns the audit writer.
+
+    Returns:
+        int: Number of logs converted.
+    """
+    converted = 0
+    for path in glob.glob(os.path.join(glob.escape(log_dir), '*.enc')):
+        if migrate_legacy_log(log_dir, os.path.basename(path)[:-len('.enc')]):
+            converted += 1
+    return converted
+
+
+# === Writer side ===
+
+class UserAuditLog:
+    """
+    Append handle on one user's segment + index, kept open by the audit writer.
+    """
+
+    def __init__(self, log_dir, customer_id):
+        migrate_legacy_log(log_dir, customer_id)
+        self.log_dir = log_dir
+        self.customer_id = customer_id
+        self.data_path = data_path(log_dir, customer_id)
+        self.index_path = index_path(log_dir, customer_id)
+        if not os.path.exists(self.data_path) or os.path.getsize(self.data_path) == 0:
+            self._create_empty()
+        self._reconcile()
+        self.first_ts = None
+        if self.count:
+            with open(self.index_path, 'rb') as f:
+                self.first_ts = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[2]
+
+        # Entries before the active segment: sealed segments, then sealing pairs
+        # a crash left behind (the writer queues those for compaction again)
+        sealed = load_manifest(log_dir, customer_id)
+        self.base = sum(segment['count'] for segment in sealed)
+        previous_ts = encode_timestamp(sealed[-1]['last_ts']) if sealed else b''
+        self.pending = pending_sealing(log_dir, customer_id)
+        for first in self.pending:
+            if first >= self.base:  # otherwise already in the manifest, only the cleanup is left
+                with RecordSegment(*sealing_paths(log_dir, customer_id, first)) as segment:
+                    self.base += segment.count
+                    if segment.count:
+                        previous_ts = max(previous_ts, segment.last_ts)
+        self.last_ts = max(self.last_ts, previous_ts)  # keep timestamps ordered across segments
+        self._open()
+
+    def _create_empty(self):
+        with open(self.data_path, 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+        open(self.index_path, 'wb').close()
+
+    def _open(self):
+        self.data = open(self.data_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+
+    def _reconcile(self):
+        """
+        Repairs the files after a crash: drops a torn tail record from the
+        data file and re-indexes data records the index is missing.
+        """
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'wb').close()
+        data_size = os.path.getsize(self.data_path)
+        with open(self.index_path, 'r+b') as f:
+            count = os.fstat(f.fileno()).st_size // INDEX_RECORD.size
+            # Keep index records whose data made it to disk (only the tail is read)
+            last = None
+            while count:
+                f.seek((count - 1) * INDEX_RECORD.size)
+                last = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+                if last[0] + RECORD_HEADER.size + last[1] <= data_size:
+                    break
+                count -= 1
+            f.truncate(count * INDEX_RECORD.size)
+            if count:
+                offset, length, ts = last
+                end = offset + RECORD_HEADER.size + length
+                self.last_ts = ts
+            else:
+                end = len(SEGMENT_MAGIC)
+                self.last_ts = b''
+
+            # Re-index any complete records written after the last index entry
+            with open(self.data_path, 'rb') as data:
+                data.seek(end)
+                tail = data.read()
+            pos = 0
+            missing = []
+            while pos + RECORD_HEADER.size <= len(tail):
+                length, ts = RECORD_HEADER.unpack_from(tail, pos)
+                if pos + RECORD_HEADER.size + length > len(tail):
+                    break
+                missing.append(INDEX_RECORD.pack(end + pos, length, ts))
+                self.last_ts = ts
+                pos += RECORD_HEADER.size + length
+            f.seek(0, os.SEEK_END)
+            f.write(b''.join(missing))
+        if end + pos != data_size:
+            with open(self.data_path, 'r+b') as data:
+                data.truncate(end + pos)
+        self.offset = end + pos
+        self.count = count + len(missing)
+
+    def append_many(self, items):
+        """
+        Appends [(ciphertext, timestamp_str), ...]: one write to the data file, then one to the index.
+        """
+        data_parts = []
+        index_parts = []
+        for ciphertext, timestamp in items:
+            ts = max(encode_timestamp(timestamp), self.last_ts)
+            self.last_ts = ts
+            if self.first_ts is None:
+                self.first_ts = ts
+            data_parts.append(RECORD_HEADER.pack(len(ciphertext), ts))
+            data_parts.append(ciphertext)
+            index_parts.append(INDEX_RECORD.pack(self.offset, len(ciphertext), ts))
+            self.offset += RECORD_HEADER.size + len(ciphertext)
+        self.data.write(b''.join(data_parts))
+        self.data.flush()   # data before index: an index record never points past the data
+        self.index.write(b''.join(index_parts))
+        self.index.flush()
+        self.count += len(items)
+
+    def fsync(self):
+        os.fsync(self.data.fileno())
+        os.fsync(self.index.fileno())
+
+    def age(self):
+        """
+        Seconds since the first entry of the active segment (0 while it is empty).
+        """
+        if self.first_ts is None:
+            return 0.0
+        try:
+            started = time.mktime(time.strptime(self.first_ts.decode().strip(), '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            return 0.0
+        return time.time() - started
+
+    def rotate(self):
+        """
+        Moves the active segment aside as a sealing pair and starts an empty
+        one. Pass the returned first entry number to compact_segment().
+        """
+        self.fsync()
+        self.close()
+        first = self.base
+        sealing_data, sealing_index = sealing_paths(self.log_dir, self.customer_id, first)
+        with segment_lock(self.log_dir):
+            os.replace(self.index_path, sealing_index)
+            os.replace(self.data_path, sealing_data)
+            self._create_empty()
+            _fsync_dir(self.log_dir)
+        self.base += self.count
+        self.count = 0
+        self.offset = len(SEGMENT_MAGIC)
+        self.first_ts = None
+        self._open()
+        return first
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+# === Reader side ===
+
+class RecordSegment:
+    """
+    One uncompacted segment (the active pair or a sealing pair): memory-maps
+    the data and index files; entries are read one record at a time.
+    """
+
+    def __init__(self, data_file, index_file):
+        self.data_file = data_file
+        self.index_file = index_file
+        self._data = self._map(data_file)
+        self._index = self._map(index_file)
+        count = len(self._index) // INDEX_RECORD.size if self._index is not None else 0
+        # Ignore index records whose data is not fully visible yet
+        data_size = len(self._data) if self._data is not None else 0
+        while count:
+            offset, length, _ = INDEX_RECORD.unpack_from(self._index, (count - 1) * INDEX_RECORD.size)
+            if offset + RECORD_HEADER.size + length <= data_size:
+                break
+            count -= 1
+        self.count = count
+
+    @staticmethod
+    def _map(path):
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def last_ts(self):
+        return self.timestamp(self.count - 1)
+
+    def timestamp(self, n):
+        return INDEX_RECORD.unpack_from(self._index, n * INDEX_RECORD.size)[2]
+
+    def read(self, n):
+        offset, length, _ = INDEX_RECORD.unpack_from(self._index, n * INDEX_RECORD.size)
+        start = offset + RECORD_HEADER.size
+        return json.loads(decrypt(get_audit_key(), self._data[start:start + length]).decode())
+
+    def scan(self, start, stop):
+        """
+        Yields (n, index timestamp, entry, problem) for entries start..stop-1,
+        checking each data record against its index record; entry is None and
+        problem a description when the record cannot be read.
+        """
+        for n in range(start, min(stop, self.count)):
+            offset, length, ts = INDEX_RECORD.unpack_from(self._index, n * INDEX_RECORD.size)
+            if RECORD_HEADER.unpack_from(self._data, offset) != (length, ts):
+                yield n, ts, None, "data record does not match its index record"
+                continue
+            try:
+                yield n, ts, self.read(n), None
+            except Exception as e:
+                yield n, ts, None, f"does not decrypt ({type(e).__name__})"
+
+    def bisect(self, ts, after=False):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self.timestamp(mid)
+            if t < ts or (after and t == ts):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def close(self):
+        for m in (self._data, self._index):
+            if m is not None:
+                m.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SealedSegment:
+    """
+    One compacted segment. The file is only mapped once an entry in it is
+    needed, and the most recently used block is kept decrypted, so reading a
+    range of entries costs one decryption and decompression per block.
+    """
+
+    def __init__(self, path, count, last_ts):
+        self.path = path
+        self.count = count
+        self.last_ts = encode_timestamp(last_ts)
+        self._map = None
+        self._blocks = None     # [(offset, length, entries, first ts, last ts), ...]
+        self._starts = None     # segment-relative entry number of each block's first entry
+        self._cached = (None, None)
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SEALED_MAGIC)] != SEALED_MAGIC:
+            raise ValueError(f"Not a sealed audit segment: {self.path}")
+        (blocks,) = SEALED_TRAILER.unpack_from(self._map, len(self._map) - SEALED_TRAILER.size)
+        table = len(self._map) - SEALED_TRAILER.size - blocks * BLOCK_RECORD.size
+        self._blocks = [BLOCK_RECORD.unpack_from(self._map, table + i * BLOCK_RECORD.size) for i in range(blocks)]
+        self._starts = []
+        start = 0
+        for block in self._blocks:
+            self._starts.append(start)
+            start += block[2]
+        self.table_count = start   # entries according to the block table (the manifest says self.count)
+
+    def _block(self, b):
+        """
+        Block number b as a list of (timestamp, entry or None).
+        """
+        if self._cached[0] != b:
+            offset, length = self._blocks[b][:2]
+            plain = zlib.decompress(decrypt(get_audit_key(), self._map[offset:offset + length]))
+            items = [(encode_timestamp(ts), entry) for ts, entry in json.loads(plain.decode())]
+            self._cached = (b, items)
+        return self._cached[1]
+
+    def _locate(self, n):
+        if self._blocks is None:
+            self._load()
+        b = bisect.bisect_right(self._starts, n) - 1
+        return self._block(b)[n - self._starts[b]]
+
+    def timestamp(self, n):
+        return self._locate(n)[0]
+
+    def read(self, n):
+        entry = self._locate(n)[1]
+        if entry is None:
+            raise ValueError("Unreadable audit entry")  # kept at compaction so numbering stays stable
+        return entry
+
+    def scan(self, start, stop):
+        """
+        Yields (n, timestamp, entry, problem) for entries start..stop-1,
+        decrypting each block once; entry is None and problem a description
+        when the entry cannot be read.
+        """
+        if self._blocks is None:
+            self._load()
+        b = max(0, bisect.bisect_right(self._starts, start) - 1)
+        while b < len(self._blocks) and self._starts[b] < stop:
+            first = self._starts[b]
+            entries, first_ts = self._blocks[b][2], self._blocks[b][3]
+            numbers = range(max(start, first), min(stop, first + entries))
+            try:
+                items = self._block(b)
+            except Exception as e:
+                for n in numbers:
+                    yield n, first_ts, None, f"block {b} does not decrypt ({type(e).__name__})"
+            else:
+                if len(items) != entries:
+                    for n in numbers:
+                        yield n, first_ts, None, f"block {b} holds {len(items)} entries, its table record {entries}"
+                else:
+                    for n in numbers:
+                        ts, entry = items[n - first]
+                        yield n, ts, entry, (None if entry is not None else "was already unreadable when compacted")
+            b += 1
+
+    def bisect(self, ts, after=False):
+        if self._blocks is None:
+            self._load()
+        # The first block that can hold the answer, from the plaintext block table
+        b = 0
+        while b < len(self._blocks):
+            last = self._blocks[b][4]
+            if last > ts or (not after and last == ts):
+                break
+            b += 1
+        if b == len(self._blocks):
+            return self.count
+        for i, (t, _) in enumerate(self._block(b)):
+            if t > ts or (not after and t == ts):
+                return self._starts[b] + i
+        return self._starts[b] + self._blocks[b][2]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class AuditLogReader:
+    """
+    Random-access reader over one user's whole history: sealed segments,
+    sealing pairs and the active segment, numbered as one sequence. Finding
+    an entry by number or by timestamp is a binary search over segments and
+    blocks, so cost does not grow with history size.
+    """
+
+    def __init__(self, log_dir, customer_id):
+        # Readers never write: legacy logs are converted by the writer's process at start-up
+        if is_legacy(data_path(log_dir, customer_id)):
+            raise ValueError(f"Audit log of {customer_id} is still in the legacy format; "
+                             f"it is converted when the server starts")
+        self.segments = []
+        if os.path.isdir(log_dir):
+            with segment_lock(log_dir, shared=True):
+                sealed = load_manifest(log_dir, customer_id)
+                for segment in sealed:
+                    self.segments.append(SealedSegment(os.path.join(log_dir, segment['file']),
+                                                        segment['count'], segment['last_ts']))
+                sealed_count = sum(segment['count'] for segment in sealed)
+                for first in pending_sealing(log_dir, customer_id):
+                    if first >= sealed_count:  # lower ones are compacted and about to be removed
+                        self.segments.append(RecordSegment(*sealing_paths(log_dir, customer_id, first)))
+                self.segments.append(RecordSegment(data_path(log_dir, customer_id),
+                                                    index_path(log_dir, customer_id)))
+        self.bases = []
+        self.count = 0
+        for segment in self.segments:
+            self.bases.append(self.count)
+            self.count += segment.count
+
+    def __len__(self):
+        return self.count
+
+    def _segment(self, n):
+        i = bisect.bisect_right(self.bases, n) - 1
+        return self.segments[i], n - self.bases[i]
+
+    def timestamp(self, n):
+        segment, local = self._segment(n)
+        return segment.timestamp(local)
+
+    def read(self, n):
+        """
+        Decrypts entry number n.
+        """
+        segment, local = self._segment(n)
+        return segment.read(local)
+
+    def bisect(self, timestamp, after=False):
+        """
+        First entry number whose timestamp is >= `timestamp` (> if `after`).
+        """
+        ts = encode_timestamp(timestamp)
+        for base, segment in zip(self.bases, self.segments):
+            if segment.count and (segment.last_ts > ts or (not after and segment.last_ts == ts)):
+                return base + segment.bisect(ts, after)
+        return self.count
+
+    def span(self, since=None, until=None, cursor=None):
+        """
+        Entry numbers [lo, hi) with timestamps in [since, until] that come before entry number `cursor`.
+        """
+        lo = self.bisect(since) if since else 0
+        hi = self.bisect(until, after=True) if until else self.count
+        if cursor is not None:
+            hi = min(hi, max(0, int(cursor)))
+        return lo, max(lo, hi)
+
+    def entries(self, start, stop):
+        """
+        Yields the decrypted entries start..stop-1 one at a time, skipping unreadable ones.
+        """
+        for n in range(start, stop):
+            try:
+                yield self.read(n)
+            except Exception:
+                continue  # Skip invalid log entries
+
+    def page(self, since=None, until=None, limit=100, cursor=None):
+        """
+        Returns the newest `limit` entries in [since, until] that come before
+        entry number `cursor`, oldest first, and the cursor for the next
+        (older) page or None when there is nothing older.
+
+        Returns:
+            tuple: (list of entry dicts, next_cursor)
+        """
+        lo, hi = self.span(since, until, cursor)
+        start = max(lo, hi - limit)
+        return list(self.entries(start, hi)), (start if start > lo else None)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# === Compaction ===
+
+def compact_segment(log_dir, customer_id, first_entry, block_entries=BLOCK_ENTRIES):
+    """
+    Rewrites the sealing pair starting at `first_entry` as a sealed segment,
+    adds it to the manifest and removes the pair. Safe to run again after a
+    crash at any point. Entries that no longer decrypt are kept as gaps so
+    entry numbers (and client cursors) do not shift.
+
+    Returns:
+        tuple: (bytes before, bytes after) compaction
+    """
+    sealing_data, sealing_index = sealing_paths(log_dir, customer_id, first_entry)
+    before = sum(os.path.getsize(p) for p in (sealing_data, sealing_index) if os.path.exists(p))
+    path = sealed_path(log_dir, customer_id, first_entry)
+    key = get_audit_key()
+    parts = [SEALED_MAGIC]
+    table = []
+    offset = len(SEALED_MAGIC)
+    done = any(segment['first_entry'] == first_entry for segment in load_manifest(log_dir, customer_id))
+    with RecordSegment(sealing_data, sealing_index) as source:
+        count = 0 if done else source.count  # done: a crash came between the manifest update and the cleanup
+        for start in range(0, count, block_entries):
+            items = []
+            for n in range(start, min(start + block_entries, count)):
+                try:
+                    entry = source.read(n)
+                except Exception:
+                    entry = None
+                items.append((source.timestamp(n).decode(), entry))
+            block = encrypt(key, zlib.compress(json.dumps(items, separators=(',', ':')).encode(), 9))
+            parts.append(block)
+            table.append(BLOCK_RECORD.pack(offset, len(block), len(items),
+                                           encode_timestamp(items[0][0]), encode_timestamp(items[-1][0])))
+            offset += len(block)
+        first_ts = source.timestamp(0).decode() if count else ''
+        last_ts = source.last_ts.decode() if count else ''
+
+    if count:
+        _write_file(path, b''.join(parts + table) + SEALED_TRAILER.pack(len(table)))
+    with segment_lock(log_dir):
+        segments = load_manifest(log_dir, customer_id)
+        if count and all(segment['first_entry'] != first_entry for segment in segments):
+            segments.append({'file': os.path.basename(path), 'first_entry': first_entry, 'count': count,
+                             'first_ts': first_ts, 'last_ts': last_ts})
+            segments.sort(key=lambda segment: segment['first_entry'])
+            _write_file(manifest_path(log_dir, customer_id), json.dumps({'segments': segments}).encode())
+        for p in (sealing_data, sealing_index):
+            if os.path.exists(p):
+                os.remove(p)
+        _fsync_dir(log_dir)
+    return before, (os.path.getsize(path) if os.path.exists(path) else 0)
@@ -0,0 +1,239 @@
+import io
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from audit_store import (AuditLogReader, RecordSegment, SealedSegment, data_path, sealed_path,
+                         is_segment, iter_legacy_entries, encode_timestamp)
+
+
+# =============================
+# Offline Audit Log Verifier / Exporter
+# Finds every user's audit log under the log directory, decrypts and checks
+# every entry on a pool of worker processes and streams the entries out as
+# JSON Lines or CSV, in log order. Work is split into ranges of at most
+# TASK_ENTRIES entries (whole blocks for sealed segments), and only a few
+# ranges per worker are in flight at once, so memory stays flat however
+# large the logs are. Read-only: legacy line-based logs are checked as they are,
+# without converting them.
+# Usage: python server/audit_tool.py --export audit.jsonl
+#        python server/audit_tool.py --export audit.csv --format csv --report problems.jsonl
+# Progress and problems go to stderr, so '--export -' can pipe the entries.
+# Exits with status 1 when any entry is corrupt or undecryptable.
+# =============================
+
+
+AUDIT_LOG_DIR = 'server/audit_logs'
+TASK_ENTRIES = 50000           # Entries per unit of work
+TASKS_IN_FLIGHT = 4            # Per worker process
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+EXPORT_FIELDS = ('customer_id', 'entry', 'timestamp', 'action')
+
+
+def discover_users(log_dir):
+    """
+    Customer IDs with an audit log in `log_dir` (active segment or manifest).
+    """
+    users = set()
+    for path in glob.glob(os.path.join(glob.escape(log_dir), '*.enc')) + \
+            glob.glob(os.path.join(glob.escape(log_dir), '*.manifest')):
+        name = os.path.basename(path)
+        if name.endswith('.sealing.enc'):
+            continue
+        users.add(name.rsplit('.', 1)[0])
+    return sorted(users)
+
+
+def plan_tasks(log_dir, export_format=None):
+    """
+    Yields one task per range of entries, user by user in log order:
+    (kind, customer_id, base, start, stop, files, export_format), where
+    base + n is the entry number of segment entry n.
+    """
+    for customer_id in discover_users(log_dir):
+        path = data_path(log_dir, customer_id)
+        if os.path.exists(path) and os.path.getsize(path) and not is_segment(path):
+            yield ('legacy', customer_id, 0, 0, 0, (path,), export_format)
+            continue
+        with AuditLogReader(log_dir, customer_id) as reader:
+            for base, segment in zip(reader.bases, reader.segments):
+                if isinstance(segment, SealedSegment):
+                    kind, files = 'sealed', (segment.path, segment.count)
+                else:
+                    kind, files = 'records', (segment.data_file, segment.index_file,
+                                              sealed_path(log_dir, customer_id, base), segment.count)
+                for start in range(0, segment.count, TASK_ENTRIES):
+                    yield (kind, customer_id, base, start, min(start + TASK_ENTRIES, segment.count),
+                           files, export_format)
+
+
+def check_entry(customer_id, ts, entry):
+    """
+    Returns what is wrong with a decrypted entry, or None if it is valid.
+    """
+    if not isinstance(entry, dict):
+        return "not a JSON object"
+    missing = [key for key in ('customer_id', 'action', 'timestamp') if not isinstance(entry.get(key), str)]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    if entry['customer_id'] != customer_id:
+        return f"belongs to {entry['customer_id']!r}"
+    try:
+        time.strptime(entry['timestamp'], TIMESTAMP_FORMAT)
+    except ValueError:
+        return f"bad timestamp {entry['timestamp']!r}"
+    if ts is not None and encode_timestamp(entry['timestamp']) > ts:
+        return "timestamp is later than its indexed timestamp"  # the index only ever clamps forwards
+    return None
+
+
+def _scan_task(kind, customer_id, start, stop, files):
+    """
+    Yields (n, indexed timestamp, entry, problem) for one task.
+    """
+    if kind == 'legacy':
+        with open(files[0], 'rb') as f:
+            for n, (_, entry) in enumerate(iter_legacy_entries(f.read())):
+                yield n, None, entry, None
+        return
+    if kind == 'records' and not os.path.exists(files[0]):
+        # A sealing pair compacted since the task was planned: same entries, now sealed
+        kind, files = 'sealed', (files[2], files[3])
+    if kind == 'sealed':
+        segment = SealedSegment(files[0], files[1], '')
+        try:
+            yield from segment.scan(start, stop)
+            if start == 0 and segment.table_count != segment.count:
+                yield 0, None, None, f"manifest lists {segment.count} entries, the segment holds {segment.table_count}"
+        finally:
+            segment.close()
+        return
+    with RecordSegment(files[0], files[1]) as segment:
+        yield from segment.scan(start, stop)
+        if segment.count < stop:
+            yield segment.count, None, None, f"{stop - segment.count} entries missing from the segment"
+
+
+def verify_task(task):
+    """
+    Runs in a worker process: decrypts and checks one range of entries.
+
+    Returns:
+        tuple: (customer_id, entries checked, problems (list of dict), export text)
+    """
+    kind, customer_id, base, start, stop, files, export_format = task
+    problems = []
+    out = io.StringIO()
+    writer = csv.writer(out) if export_format == 'csv' else None
+    checked = 0
+    try:
+        for n, ts, entry, problem in _scan_task(kind, customer_id, start, stop, files):
+            checked += 1
+            if problem is None:
+                problem = check_entry(customer_id, ts, entry)
+            if problem is not None:
+                problems.append({'customer_id': customer_id, 'entry': base + n, 'file': files[0], 'problem': problem})
+                continue
+            if export_format is None:
+                continue
+            row = (customer_id, base + n, entry['timestamp'], entry['action'])
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n')
+    except Exception as e:
+        problems.append({'customer_id': customer_id, 'entry': base + start, 'file': files[0],
+                         'problem': f"cannot read the segment ({type(e).__name__}: {e})"})
+    return customer_id, checked, problems, out.getvalue()
+
+
+def run(log_dir, processes=None, export=None, export_format='jsonl', report=None, quiet=False):
+    """
+    Verifies (and optionally exports) every audit log in `log_dir`.
+
+    Parameters:
+        log_dir (str): Audit log directory.
+        processes (int): Worker processes (default: one per core).
+        export (file): Where to stream valid entries, or None to only verify.
+        export_format (str): 'jsonl' or 'csv'.
+        report (file): Where to write one JSON line per problem, or None.
+        quiet (bool): Print only the summary and problems.
+
+    Returns:
+        tuple: (entries checked, problems found)
+    """
+    processes = processes or os.cpu_count() or 1
+    started = time.monotonic()
+    checked = found = 0
+    users = set()
+    if export is not None and export_format == 'csv':
+        csv.writer(export).writerow(EXPORT_FIELDS)
+
+    def collect(result):
+        nonlocal checked, found
+        customer_id, count, problems, text = result
+        users.add(customer_id)
+        checked += count
+        found += len(problems)
+        if text:
+            export.write(text)
+        for problem in problems:
+            print(f"[AUDIT CHECK] {problem['customer_id']} entry {problem['entry']}: {problem['problem']}"
+                  f" ({problem['file']})", file=sys.stderr)
+            if report is not None:
+                report.write(json.dumps(problem) + '\n')
+
+    tasks = plan_tasks(log_dir, export_format if export is not None else None)
+    with multiprocessing.Pool(processes) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.apply_async(verify_task, (task,)))
+            if len(in_flight) >= processes * TASKS_IN_FLIGHT:
+                collect(in_flight.popleft().get())   # results come back in log order
+        while in_flight:
+            collect(in_flight.popleft().get())
+
+    elapsed = time.monotonic() - started
+    print(f"[AUDIT CHECK] {checked} entries in {len(users)} logs verified in {elapsed:.1f}s, {found} problems",
+          file=sys.stderr)
+    if not quiet and elapsed > 0:
+        print(f"[AUDIT CHECK] {checked / elapsed:.0f} entries/s on {processes} processes", file=sys.stderr)
+    return checked, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and export the encrypted audit logs")
+    parser.add_argument('--log-dir', default=AUDIT_LOG_DIR, help="audit log directory (default: %(default)s)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--export', default=None, help="write valid entries to this file ('-' = stdout)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help="export format")
+    parser.add_argument('--report', default=None, help="write problems as JSON Lines to this file")
+    parser.add_argument('--quiet', action='store_true', help="print only problems and the summary")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.log_dir):
+        print(f"No audit log directory at {args.log_dir}")
+        return 0
+    export = report = None
+    try:
+        if args.export == '-':
+            export = sys.stdout
+        elif args.export:
+            export = open(args.export, 'w', newline='')
+        if args.report:
+            report = open(args.report, 'w')
+        _, found = run(args.log_dir, args.processes, export, args.format, report, args.quiet)
+    finally:
+        for f in (export, report):
+            if f is not None and f is not sys.stdout:
+                f.close()
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
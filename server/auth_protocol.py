@@ -1,8 +1,17 @@
 import os
-import json
 import hmac
+import asyncio
 import hashlib
+import metrics
+import hello_cookie
 from utils import encrypt, decrypt, generate_nonce, load_user_key
+from framing import FrameReader, send_frame, read_frame_async, write_frame_async, HANDSHAKE_MAX_FRAME_SIZE
+from session_ticket import (TicketError, TICKET_LIFETIME, issue_ticket, redeem_ticket,
+                            compute_resumed_master_secret, compute_resume_proof)
+from record_layer import negotiate_suite
+import wire_codec
+from wire_codec import (FORMAT_JSON, CLIENT_HELLO, SERVER_HELLO, CLIENT_RESPONSE, NEW_SESSION_TICKET,
+                        SERVER_RESUME)
 
 
 # =============================
@@ -11,68 +20,327 @@ from utils import encrypt, decrypt, generate_nonce, load_user_key
 # =============================
 
 
-def authenticate_and_generate_master_secret(conn):
+def parse_client_hello(raw):
+    """
+    Parses a ClientHello message {username, nonce_c[, tickets][, ticket][, suites][, cookie]}.
+    'tickets' means the client accepts a NewSessionTicket after the handshake
+    (older clients do not and never get one); a 'ticket' means it asks to
+    resume an earlier session; 'suites' lists the record protection suites
+    it supports (older clients send none and get CBC+HMAC); a 'cookie' echoes
+    an earlier HELLO_COOKIE (see hello_cookie.py).
+    The ClientHello's encoding (JSON or binary) is used for the rest of the connection.
+
+    Parameters:
+        raw (bytes): The raw ClientHello received from the client.
+
+    Returns:
+        tuple: (username (str), nonce_c (bytes), options (dict with 'tickets', 'ticket',
+                'suites', 'cookie', 'wire_format' and 'version'))
+    """
+    wire_format = wire_codec.detect_format(raw)
+    version = 1
+    if wire_format == FORMAT_JSON:
+        client_hello = wire_codec.loads(CLIENT_HELLO, raw, FORMAT_JSON)
+    else:
+        client_hello, offered_version = wire_codec.decode(CLIENT_HELLO, raw)
+        version = wire_codec.negotiate_version(offered_version)
+    username = client_hello['username']   ##########################check passsord first here
+    nonce_c = client_hello['nonce']
+    #password = client_hello['password']  # Extract the password from the ClientHello message
+    # Check if the password is correct for the given username
+    # This is a placeholder for the actual password verification logic.
+    # In a real implementation, you would check the password against a secure database or hash.
+    options = {
+        'tickets': bool(client_hello.get('tickets')),
+        'ticket': client_hello.get('ticket') or None,
+        'suites': client_hello.get('suites'),
+        'cookie': client_hello.get('cookie'),
+        'wire_format': wire_format,
+        'version': version
+    }
+    return username, nonce_c, options
+
+
+def build_server_hello(K_ATM, nonce_c, suite=None, wire_format=FORMAT_JSON, version=1):
+    """
+    Builds the ServerHello = ENC_K_ATM({nonce_c, nonce_s[, suite]}).
+
+    Parameters:
+        K_ATM (bytes): The pre-shared key of the user.
+        nonce_c (bytes): The client's nonce.
+        suite (str): The chosen record suite, only sent to clients that offered suites.
+        wire_format (str): The connection's encoding (from the ClientHello).
+        version (int): Negotiated binary wire version.
+
+    Returns:
+        tuple: (nonce_s (bytes), encrypted ServerHello (bytes))
+    """
+    nonce_s = generate_nonce()  # Generate a random server nonce
+    server_hello = {
+        'nonce_c': nonce_c,  # Echo the client's nonce (nonce_c)
+        'nonce_s': nonce_s,  # Include the server's nonce (nonce_s)
+        'suite': suite
+    }
+    server_hello_data = wire_codec.dumps(SERVER_HELLO, server_hello, wire_format, version)
+    return nonce_s, encrypt(K_ATM, server_hello_data)  # Encrypt the response using K_ATM
+
+
+def verify_client_response(K_ATM, nonce_s, raw, offered_suites=None, wire_format=FORMAT_JSON):
+    """
+    Checks the ClientResponse = ENC_K_ATM({nonce_s[, suites]}) against the nonce we sent.
+
+    Parameters:
+        K_ATM (bytes): The pre-shared key of the user.
+        nonce_s (bytes): The server nonce sent in the ServerHello.
+        raw (bytes): The encrypted ClientResponse.
+        offered_suites (list): Suites from the (unencrypted) ClientHello; the client
+                               repeats its offer here so a stripped offer is detected.
+        wire_format (str): The connection's encoding.
+
+    Returns:
+        None (raises on mismatch)
+    """
+    decrypted_response = decrypt(K_ATM, raw)
+    response_data = wire_codec.loads(CLIENT_RESPONSE, decrypted_response, wire_format)
+    received_nonce_s = response_data['nonce_s']
+
+    # Verify the received nonce_s matches the one sent by the server
+    # This ensures the client knows the pre-shared key (K_ATM) and proves its identity.
+    if received_nonce_s != nonce_s:
+        raise Exception("Authentication failed: Nonce mismatch")  # Raise an error if the nonces don't match
+
+    # Downgrade check: the suites we negotiated from must be the ones the client sent
+    if offered_suites and response_data.get('suites') != offered_suites:
+        raise Exception("Authentication failed: cipher suite offer was altered")
+
+
+def compute_master_secret(K_ATM, nonce_c, nonce_s):
+    """
+    Derives the Master Secret: MS = HMAC(K_ATM, nonce_c || nonce_s)
+
+    Returns:
+        bytes: The Master Secret (MS).
+    """
+    ms_input = nonce_c + nonce_s  # Concatenate the client and server nonces
+    return hmac.new(K_ATM, ms_input, hashlib.sha256).digest()
+
+
+def build_new_session_ticket(username, master_secret, wire_format=FORMAT_JSON, version=1):
+    """
+    Builds the NewSessionTicket message sent after a completed handshake.
+    The ticket is sealed under the server's ticket key, so it can travel in clear.
+
+    Returns:
+        bytes: {ticket, lifetime} in the connection's encoding
+    """
+    return wire_codec.dumps(NEW_SESSION_TICKET, {
+        'ticket': issue_ticket(username, master_secret),
+        'lifetime': TICKET_LIFETIME
+    }, wire_format, version)
+
+
+def resume_session(username, nonce_c, ticket, suite, client_hello, wire_format=FORMAT_JSON, version=1):
+    """
+    Abbreviated handshake: redeems the ticket and derives a fresh Master Secret
+    MS' = HMAC(MS, "resume" || nonce_c || nonce_s) without using K_ATM.
+
+    Parameters:
+        username (str): The user named in the ClientHello.
+        nonce_c (bytes): The client's fresh nonce.
+        ticket (bytes): The ticket from the client's previous session.
+        suite (str): The negotiated record suite.
+        client_hello (bytes): The raw ClientHello, covered by the server's proof.
+        wire_format (str): The connection's encoding.
+        version (int): Negotiated binary wire version.
+
+    Returns:
+        tuple: (master_secret (bytes) or None if refused, ServerResume reply (bytes))
+               On refusal the client continues with a full ClientHello on the same connection.
+    """
+    try:
+        old_master_secret = redeem_ticket(ticket, username)
+    except (TicketError, ValueError, KeyError) as e:
+        print(f"\nResumption refused for {username}: {e}")
+        metrics.count('handshakes:kind', 'resume_refused')
+        return None, wire_codec.dumps(SERVER_RESUME, {'resumed': False}, wire_format, version)
+
+    nonce_s = generate_nonce()
+    master_secret = compute_resumed_master_secret(old_master_secret, nonce_c, nonce_s)
+    reply = wire_codec.dumps(SERVER_RESUME, {
+        'resumed': True,
+        'nonce_s': nonce_s,
+        'suite': suite,
+        'proof': compute_resume_proof(master_secret, client_hello + suite.encode()),
+        'ticket': issue_ticket(username, master_secret),   # tickets are single use
+        'lifetime': TICKET_LIFETIME
+    }, wire_format, version)
+    metrics.count('handshakes:kind', 'resumed')
+    return master_secret, reply
+
+
+def receive_handshake_frame(reader):
+    """
+    Reads the next handshake message; a closed connection aborts the handshake.
+    """
+    raw = reader.recv_frame()
+    if raw is None:
+        raise ConnectionError("Client closed the connection during the handshake")
+    return raw
+
+
+def authenticate_and_generate_master_secret(conn, reader=None):
     """
     Authenticates the client and securely establishes a shared Master Secret (MS)
     between the client and the server using a nonce-based challenge-response protocol.
 
     Parameters:
         conn: The socket connection to the client.
+        reader (FrameReader): The connection's frame reader; pass the one the
+                              session keeps using so no buffered bytes are lost.
 
     Returns:
         tuple: A tuple containing:
                - username (str): The authenticated username.
                - master_secret (bytes): The derived Master Secret (MS).
+               - suite (str): The negotiated record protection suite.
+               - wire_format (str): The connection's encoding ('json' or 'binary').
     """
 
-    
+
     # Step 1: Receive ClientHello {username, nonce_c}
     # The client sends their username and a randomly generated nonce (nonce_c).
-    raw = conn.recv(4096)  
-    client_hello = json.loads(raw.decode())  
-    username = client_hello['username']   ##########################check passsord first here
-    nonce_c = bytes.fromhex(client_hello['nonce'])
-    #password = client_hello['password']  # Extract the password from the ClientHello message
-    # Check if the password is correct for the given username
-    # This is a placeholder for the actual password verification logic.
-    # In a real implementation, you would check the password against a secure database or hash.
+    if reader is None:
+        reader = FrameReader(conn, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+    raw = receive_handshake_frame(reader)
+    username, nonce_c, options = parse_client_hello(raw)
+
+    # Stateless cookie step (if on): until the client echoes a cookie bound to
+    # its address, nothing is looked up, encrypted or kept for it
+    if hello_cookie.COOKIES_ENABLED:
+        address = hello_cookie.peer_address(conn.getpeername())
+        cookie_reply = hello_cookie.challenge(address, username, options['cookie'])
+        if cookie_reply is not None:
+            send_frame(conn, cookie_reply)
+            raw = receive_handshake_frame(reader)
+            username, nonce_c, options = parse_client_hello(raw)
+            hello_cookie.require(address, username, options['cookie'])
+
+    # Resumption: a valid ticket completes the handshake in this one round trip
+    if options['ticket'] is not None:
+        suite = negotiate_suite(options['suites'])
+        master_secret, reply = resume_session(username, nonce_c, options['ticket'], suite, raw,
+                                              options['wire_format'], options['version'])
+        send_frame(conn, reply)
+        if master_secret is not None:
+            return username, master_secret, suite, options['wire_format']
+        raw = receive_handshake_frame(reader)
+        username, nonce_c, options = parse_client_hello(raw)
+    suite = negotiate_suite(options['suites'])
 
     # Load pre-shared key for this user
     # The server retrieves the pre-shared key (K_ATM) associated with the username.
+    t = metrics.now()
     K_ATM = load_user_key(username)
+    metrics.observe('key_lookup', t)
 
 
     # Step 2: ServerHello = ENC_K_ATM({nonce_c, nonce_s})
     # The server generates its own nonce (nonce_s) and sends both nonces back to the client,
     # encrypted with the pre-shared key (K_ATM).
-    nonce_s = generate_nonce()  # Generate a random server nonce
-    server_hello_data = json.dumps({
-        'nonce_c': nonce_c.hex(),  # Include the client's nonce (nonce_c) in hex format
-        'nonce_s': nonce_s.hex()   # Include the server's nonce (nonce_s) in hex format
-    }).encode()
-    encrypted_response = encrypt(K_ATM, server_hello_data)  # Encrypt the response using K_ATM
-    conn.sendall(encrypted_response)  # Send the encrypted ServerHello message to the client
+    nonce_s, encrypted_response = build_server_hello(K_ATM, nonce_c, suite if options['suites'] else None,
+                                                     options['wire_format'], options['version'])
+    send_frame(conn, encrypted_response)  # Send the encrypted ServerHello message to the client
 
 
     # Step 3: ClientResponse = ENC_K_ATM({nonce_s})
     # The client responds by encrypting the server's nonce (nonce_s) with the pre-shared key (K_ATM).
-    raw = conn.recv(4096)  
-    decrypted_response = decrypt(K_ATM, raw)  
-    response_data = json.loads(decrypted_response.decode())  
-    received_nonce_s = bytes.fromhex(response_data['nonce_s'])  
-
-    # Verify the received nonce_s matches the one sent by the server
-    # This ensures the client knows the pre-shared key (K_ATM) and proves its identity.
-    if received_nonce_s != nonce_s:
-        raise Exception("Authentication failed: Nonce mismatch")  # Raise an error if the nonces don't match
+    raw = receive_handshake_frame(reader)
+    verify_client_response(K_ATM, nonce_s, raw, options['suites'], options['wire_format'])
 
 
     # Step 4: Generate Master Secret: MS = HMAC(K_ATM, nonce_c || nonce_s)
     # The server derives the Master Secret (MS) by concatenating nonce_c and nonce_s
     # and applying HMAC with the pre-shared key (K_ATM).
-    ms_input = nonce_c + nonce_s  # Concatenate the client and server nonces
-    master_secret = hmac.new(K_ATM, ms_input, hashlib.sha256).digest()  # Derive the Master Secret (MS)
+    master_secret = compute_master_secret(K_ATM, nonce_c, nonce_s)
+
+
+    # Step 5: NewSessionTicket, so the next connection can resume
+    if options['tickets']:
+        send_frame(conn, build_new_session_ticket(username, master_secret,
+                                                  options['wire_format'], options['version']))
+    metrics.count('handshakes:kind', 'full')
+
+
+    # Return the authenticated username, the derived Master Secret, the record suite and the encoding
+    return username, master_secret, suite, options['wire_format']
+
+
+async def authenticate_and_generate_master_secret_async(reader, writer):
+    """
+    Coroutine version of authenticate_and_generate_master_secret for the
+    asyncio server. Runs the same messages (including resumption) over
+    asyncio streams; the key store lookup (file I/O) is done in the default executor.
+
+    Parameters:
+        reader (asyncio.StreamReader): Incoming side of the client connection.
+        writer (asyncio.StreamWriter): Outgoing side of the client connection.
+
+    Returns:
+        tuple: (username (str), master_secret (bytes), suite (str), wire_format (str))
+    """
+    loop = asyncio.get_running_loop()
+
+    # Step 1: Receive ClientHello and load K_ATM off the event loop
+    raw = await read_frame_async(reader, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+    if raw is None:
+        raise ConnectionError("Client closed the connection during the handshake")
+    username, nonce_c, options = parse_client_hello(raw)
+
+    # Stateless cookie step (if on), before anything else is done for the client
+    if hello_cookie.COOKIES_ENABLED:
+        address = hello_cookie.peer_address(writer.get_extra_info('peername'))
+        cookie_reply = hello_cookie.challenge(address, username, options['cookie'])
+        if cookie_reply is not None:
+            await write_frame_async(writer, cookie_reply)
+            raw = await read_frame_async(reader, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+            if raw is None:
+                raise ConnectionError("Client closed the connection during the handshake")
+            username, nonce_c, options = parse_client_hello(raw)
+            hello_cookie.require(address, username, options['cookie'])
+
+    # Resumption: one round trip, no key store lookup
+    if options['ticket'] is not None:
+        suite = negotiate_suite(options['suites'])
+        master_secret, reply = resume_session(username, nonce_c, options['ticket'], suite, raw,
+                                              options['wire_format'], options['version'])
+        await write_frame_async(writer, reply)
+        if master_secret is not None:
+            return username, master_secret, suite, options['wire_format']
+        raw = await read_frame_async(reader, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+        if raw is None:
+            raise ConnectionError("Client closed the connection during the handshake")
+        username, nonce_c, options = parse_client_hello(raw)
+    suite = negotiate_suite(options['suites'])
+
+    t = metrics.now()
+    K_ATM = await loop.run_in_executor(None, load_user_key, username)
+    metrics.observe('key_lookup', t)
+
+    # Step 2: Send ServerHello
+    nonce_s, encrypted_response = build_server_hello(K_ATM, nonce_c, suite if options['suites'] else None,
+                                                     options['wire_format'], options['version'])
+    await write_frame_async(writer, encrypted_response)
 
+    # Step 3: Check ClientResponse
+    raw = await read_frame_async(reader, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+    if raw is None:
+        raise ConnectionError("Client closed the connection during the handshake")
+    verify_client_response(K_ATM, nonce_s, raw, options['suites'], options['wire_format'])
 
-    # Return the authenticated username and the derived Master Secret
-    return username, master_secret
\ No newline at end of file
+    # Step 4: Generate Master Secret and hand out a resumption ticket
+    master_secret = compute_master_secret(K_ATM, nonce_c, nonce_s)
+    if options['tickets']:
+        await write_frame_async(writer, build_new_session_ticket(username, master_secret,
+                                                                options['wire_format'], options['version']))
+    metrics.count('handshakes:kind', 'full')
+    return username, master_secret, suite, options['wire_format']
\ No newline at end of file
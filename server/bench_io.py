@@ -0,0 +1,127 @@
+import os
+import time
+import socket
+import argparse
+import tracemalloc
+from framing import FrameReader, send_frame, encode_frame, HEADER, HEADER_SIZE, RECV_CHUNK
+from record_layer import SUPPORTED_SUITES, SUITE_CBC_HMAC, new_record_layer
+
+
+# =============================
+# Request I/O Path Benchmark
+# Request/reply round trips over a local socket pair, each side doing what a
+# session does per message: receive a frame, open the record, seal the next
+# one and send it. Compares the copying path (recv() into new bytes, frames
+# copied out of a growing buffer, records joined, header + record concatenated
+# before sendall) with the zero-copy one (recv_into a preallocated buffer,
+# records opened from memoryview slices of it, seal_parts sent with
+# scatter/gather sendmsg). Reports latency and the peak Python memory
+# allocated (tracemalloc) per round trip.
+# Usage: python server/bench_io.py --sizes 64 256 4096 65536
+# =============================
+
+
+class CopyingFrameReader:
+    """
+    The receive path as it was before frames were read in place.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def recv_frame(self):
+        while True:
+            if len(self.buffer) >= HEADER_SIZE:
+                (length,) = HEADER.unpack_from(self.buffer)
+                end = HEADER_SIZE + length
+                if len(self.buffer) >= end:
+                    payload = bytes(self.buffer[HEADER_SIZE:end])
+                    del self.buffer[:end]
+                    return payload
+            self.buffer += self.sock.recv(RECV_CHUNK)
+
+
+class Endpoint:
+    """
+    One side of a session, sending and receiving protected frames.
+    """
+
+    def __init__(self, sock, record, zero_copy):
+        self.sock = sock
+        self.record = record
+        self.zero_copy = zero_copy
+        self.reader = FrameReader(sock) if zero_copy else CopyingFrameReader(sock)
+
+    def send(self, payload):
+        if self.zero_copy:
+            send_frame(self.sock, *self.record.seal_parts(payload))
+        else:
+            self.sock.sendall(encode_frame(self.record.seal(payload)))
+
+    def recv(self):
+        if self.zero_copy:
+            return self.record.open(self.reader.recv_frame_view())
+        return self.record.open(self.reader.recv_frame())
+
+
+def bench_path(suite, size, zero_copy, round_trips, traced):
+    """
+    Returns:
+        tuple: (microseconds per round trip, peak bytes allocated per round trip)
+    """
+    client_sock, server_sock = socket.socketpair()
+    master_secret = os.urandom(32)
+    client = Endpoint(client_sock, new_record_layer(suite, master_secret, is_server=False), zero_copy)
+    server = Endpoint(server_sock, new_record_layer(suite, master_secret, is_server=True), zero_copy)
+    payload = os.urandom(size)
+
+    def round_trip():
+        client.send(payload)
+        server.recv()
+        server.send(payload)
+        client.recv()
+
+    try:
+        for _ in range(100):
+            round_trip()   # warm up (and let the buffers reach their working size)
+        start = time.perf_counter()
+        for _ in range(round_trips):
+            round_trip()
+        latency = (time.perf_counter() - start) / round_trips * 1e6
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(traced):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            round_trip()
+            peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    finally:
+        client_sock.close()
+        server_sock.close()
+    return latency, peak / traced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copying vs. zero-copy request I/O path")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256, 4096, 65536])
+    parser.add_argument('--suites', nargs='+', default=[SUITE_CBC_HMAC, SUPPORTED_SUITES[0]])
+    parser.add_argument('--round-trips', type=int, default=20000)
+    parser.add_argument('--traced', type=int, default=1000, help="round trips measured with tracemalloc")
+    args = parser.parse_args()
+
+    print(f"{'suite':<26}{'size':>8}{'copying':>24}{'zero-copy':>24}")
+    for suite in args.suites:
+        for size in args.sizes:
+            round_trips = max(500, args.round_trips * 256 // max(size, 256))
+            cells = []
+            for zero_copy in (False, True):
+                latency, allocated = bench_path(suite, size, zero_copy, round_trips, args.traced)
+                cells.append(f"{latency:>8.1f}us {allocated / 1024:>8.1f}KiB")
+            print(f"{suite:<26}{size:>7}B" + "".join(f"{cell:>24}" for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
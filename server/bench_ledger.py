@@ -0,0 +1,122 @@
+import time
+import random
+import argparse
+import tempfile
+import threading
+from ledger import WALLedger
+
+
+# =============================
+# Ledger Benchmark
+# Measures group-commit throughput and crash-recovery time of WALLedger,
+# and snapshot-read (balance query) throughput alone and during the commits.
+# Usage: python server/bench_ledger.py --accounts 10000000 --threads 64 --readers 4
+# =============================
+
+
+def run_commits(ledger, accounts, thread_id, threads, commits, rng_seed):
+    """
+    Deposits $1 into random accounts owned by this thread (accounts are split
+    between threads so the expected totals stay exact) and waits for each
+    deposit to be durable, like a request handler does before replying.
+    """
+    rng = random.Random(rng_seed)
+    mine = range(thread_id, accounts, threads)
+    for _ in range(commits):
+        name = f"acct{rng.choice(mine):09d}"
+        ledger[name] = ledger[name] + 1
+        ledger.wait_durable()
+
+
+def run_reads(ledger, accounts, stop, counts, slot, rng_seed):
+    """
+    Snapshot-reads random accounts (as balance queries do) until `stop` is set.
+    """
+    rng = random.Random(rng_seed)
+    reads = 0
+    while not stop.is_set():
+        for _ in range(100):
+            ledger.read(f"acct{rng.randrange(accounts):09d}")
+        reads += 100
+        time.sleep(0)  # let the committers run, as a request handler waiting on its socket would
+    counts[slot] = reads
+
+
+def start_readers(ledger, accounts, readers):
+    stop = threading.Event()
+    counts = [0] * readers
+    threads = [threading.Thread(target=run_reads, args=(ledger, accounts, stop, counts, r, 1000 + r))
+               for r in range(readers)]
+    for t in threads:
+        t.start()
+    return stop, counts, threads, time.perf_counter()
+
+
+def stop_readers(stop, counts, threads, started):
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WAL ledger benchmark")
+    parser.add_argument('--accounts', type=int, default=10_000_000)
+    parser.add_argument('--threads', type=int, default=64, help="concurrent committers")
+    parser.add_argument('--commits', type=int, default=500, help="commits per thread")
+    parser.add_argument('--readers', type=int, default=4, help="concurrent snapshot readers (0 = none)")
+    parser.add_argument('--snapshot-every', type=int, default=100000)
+    parser.add_argument('--dir', default=None, help="data directory (default: a temp dir)")
+    args = parser.parse_args()
+
+    data_dir = args.dir or tempfile.mkdtemp(prefix='ledger-bench-')
+    print(f"Data directory: {data_dir}")
+
+
+    # Step 1: Seed a fresh store (written as snapshot 0)
+    start = time.perf_counter()
+    initial = {f"acct{i:09d}": 1000 for i in range(args.accounts)}
+    ledger = WALLedger(data_dir, initial=initial, snapshot_every=args.snapshot_every)
+    del initial
+    print(f"Seeded {args.accounts:,} accounts in {time.perf_counter() - start:.2f}s")
+
+
+    # Step 2: Snapshot reads on their own, as a baseline
+    if args.readers:
+        readers = start_readers(ledger, args.accounts, args.readers)
+        time.sleep(1.0)
+        print(f"Reads alone: {stop_readers(*readers):,.0f} reads/sec ({args.readers} readers)")
+
+
+    # Step 3: Concurrent durable commits sharing fsyncs, with the readers running alongside
+    workers = [threading.Thread(target=run_commits,
+                                args=(ledger, args.accounts, t, args.threads, args.commits, t))
+               for t in range(args.threads)]
+    readers = start_readers(ledger, args.accounts, args.readers) if args.readers else None
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    total = args.threads * args.commits
+    print(f"Commits: {total:,} in {elapsed:.2f}s -> {total / elapsed:,.0f} commits/sec")
+    print(f"fsyncs: {ledger.fsync_count:,} ({total / max(ledger.fsync_count, 1):.1f} commits per fsync)")
+    if readers:
+        print(f"Reads during commits: {stop_readers(*readers):,.0f} reads/sec")
+
+
+    # Step 4: "Crash" (no final snapshot) and time recovery
+    expected_total = 1000 * args.accounts + total
+    ledger.close(snapshot=False)
+    start = time.perf_counter()
+    recovered = WALLedger(data_dir, snapshot_every=args.snapshot_every)
+    recovery = time.perf_counter() - start
+    actual_total = sum(balance for _, balance in recovered.items())
+    print(f"Recovery: {len(recovered):,} accounts in {recovery:.2f}s "
+          f"({'balances exact' if actual_total == expected_total else 'BALANCE MISMATCH'})")
+    recovered.close(snapshot=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import hmac
+import time
+import struct
+import metrics
+import wire_codec
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import hmac as crypto_hmac
+
+
+# =============================
+# Stateless Handshake Cookies
+# With cookies on (--hello-cookies), a ClientHello without a valid cookie is
+# answered with a HELLO_COOKIE message instead of a ServerHello:
+#   cookie = issued || HMAC_K_COOKIE(issued || client IP || username)[:COOKIE_MAC_SIZE]
+# and the server keeps nothing for it. Only a ClientHello that echoes a valid
+# cookie goes on to the key store lookup and the encrypted ServerHello, so a
+# flood of hellos for made-up users costs one HMAC and one small frame each.
+# Cookies are bound to the client's IP (not its port) and the username and
+# are accepted for COOKIE_LIFETIME seconds. Clients keep them for their next
+# connections, so only the first one (or the first after expiry) pays the
+# extra round trip.
+# =============================
+
+
+COOKIES_ENABLED = False     # Ask for a cookie before any key lookup or crypto
+COOKIE_LIFETIME = 300       # Seconds a cookie is accepted after it was issued
+COOKIE_MAC_SIZE = 16        # Truncated HMAC-SHA256 tag
+
+# Like the ticket keys: in this process's memory only, generated at import so
+# pre-forked workers share it; after a restart clients are just asked again.
+COOKIE_KEY = os.urandom(32)
+_cookie_hmac = crypto_hmac.HMAC(COOKIE_KEY, hashes.SHA256())   # keyed once, copied per cookie
+
+ISSUED = struct.Struct('>I')   # Issue time, whole seconds since the epoch
+COOKIE_SIZE = ISSUED.size + COOKIE_MAC_SIZE
+
+
+class CookieError(Exception):
+    """
+    The ClientHello sent after a HELLO_COOKIE still has no valid cookie.
+    """
+
+
+def peer_address(peername):
+    """
+    The part of a socket's peer name a cookie is bound to (the IP for TCP).
+    """
+    return str(peername[0]) if isinstance(peername, tuple) else str(peername)
+
+
+def _cookie_mac(issued, address, username):
+    mac = _cookie_hmac.copy()
+    mac.update(ISSUED.pack(issued) + f"{address}\0{username}".encode())
+    return mac.finalize()[:COOKIE_MAC_SIZE]
+
+
+def make_cookie(address, username, now=None):
+    """
+    Returns:
+        bytes: A cookie for this client address and username.
+    """
+    issued = int(time.time() if now is None else now)
+    return ISSUED.pack(issued) + _cookie_mac(issued, address, username)
+
+
+def check_cookie(cookie, address, username, now=None):
+    """
+    Returns:
+        bool: True if `cookie` was issued by this server, for this address and
+              username, no more than COOKIE_LIFETIME seconds ago.
+    """
+    if not cookie or len(cookie) != COOKIE_SIZE:
+        return False
+    (issued,) = ISSUED.unpack_from(cookie)
+    now = time.time() if now is None else now
+    if not issued <= now <= issued + COOKIE_LIFETIME:
+        return False
+    return hmac.compare_digest(cookie[ISSUED.size:], _cookie_mac(issued, address, username))
+
+
+def challenge(address, username, cookie):
+    """
+    Checks the cookie of a connection's first ClientHello (with cookies on).
+
+    Parameters:
+        address (str): The client's address (peer_address).
+        username (str): The user named in the ClientHello.
+        cookie (bytes): The ClientHello's cookie, or None.
+
+    Returns:
+        bytes or None: The HELLO_COOKIE frame to answer with (always binary),
+                       or None if the handshake may go on.
+    """
+    if check_cookie(cookie, address, username):
+        metrics.count('hello_cookies:result', 'accepted')
+        return None
+    metrics.count('hello_cookies:result', 'issued')
+    return wire_codec.encode(wire_codec.HELLO_COOKIE, {'cookie': make_cookie(address, username)})
+
+
+def require(address, username, cookie):
+    """
+    Checks the ClientHello sent in answer to a HELLO_COOKIE; raises CookieError if it is still invalid.
+    """
+    if not check_cookie(cookie, address, username):
+        metrics.count('hello_cookies:result', 'rejected')
+        raise CookieError("Authentication failed: missing or invalid handshake cookie")
+    metrics.count('hello_cookies:result', 'accepted')
+
+
+def configure(enabled=COOKIES_ENABLED, lifetime=COOKIE_LIFETIME):
+    """
+    Turns the cookie step on or off (call before serving).
+    """
+    global COOKIES_ENABLED, COOKIE_LIFETIME
+    COOKIES_ENABLED, COOKIE_LIFETIME = enabled, lifetime
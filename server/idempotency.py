@@ -0,0 +1,92 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# =============================
+# Idempotency Keys
+# Deposits, withdrawals and batches may carry a client-generated 'request_id'.
+# The ledger remembers, per account, the result each recent request ID got
+# (written in the same WAL record as the balance change, and kept in snapshots),
+# so a client that lost a reply can send the request again and get the
+# original result back instead of having it applied twice.
+# =============================
+
+
+IDEMPOTENCY_TTL = 3600.0            # Seconds a request ID is remembered
+IDEMPOTENCY_MAX_PER_ACCOUNT = 1024  # Most recent request IDs kept per account
+MAX_REQUEST_ID_LENGTH = 64
+
+
+def request_fingerprint(request):
+    """
+    Digest of what a request asks for, so a request ID reused for a
+    different request is refused instead of answered with the wrong result.
+    """
+    body = {key: request.get(key) for key in ('action', 'amount', 'operations')}
+    body['atomic'] = bool(request.get('atomic'))   # the binary encoding leaves False out
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:32]
+
+
+class IdempotencyCache:
+    """
+    Recent request IDs per account with the fingerprint and result of each.
+    Entries expire after `ttl` seconds; past `max_per_account` the oldest of
+    that account is dropped first.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_per_account=IDEMPOTENCY_MAX_PER_ACCOUNT):
+        self.ttl = ttl
+        self.max_per_account = max_per_account
+        self._accounts = {}     # account -> OrderedDict(request_id -> (expires, fingerprint, result, seq))
+        self._lock = threading.Lock()
+
+    def recall(self, account, request_id, now=None):
+        """
+        Returns:
+            tuple: (fingerprint, result, seq) stored for the request ID, or None.
+                   seq is the ledger write that stored the result (0: restored, already durable).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._accounts.get(account, {}).get(request_id)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1], entry[2], entry[3]
+
+    def remember(self, account, request_id, fingerprint, result, expires=None, now=None, seq=0):
+        """
+        Stores a request's result, written to the ledger as write `seq`.
+        `expires` is given when restoring from the WAL or a snapshot; already
+        expired entries are skipped.
+        """
+        now = time.time() if now is None else now
+        expires = now + self.ttl if expires is None else expires
+        if expires <= now:
+            return
+        with self._lock:
+            recent = self._accounts.setdefault(account, OrderedDict())
+            recent[request_id] = (expires, fingerprint, result, seq)
+            recent.move_to_end(request_id)
+            # Oldest first: drop what has expired, then whatever exceeds the cap
+            while recent:
+                oldest_id, (oldest_expires, *_) = next(iter(recent.items()))
+                if oldest_expires > now and len(recent) <= self.max_per_account:
+                    break
+                del recent[oldest_id]
+
+    def entries(self, now=None):
+        """
+        Every live entry as [account, request_id, expires, fingerprint, result] (for snapshots).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return [[account, request_id, expires, fingerprint, result]
+                    for account, recent in self._accounts.items()
+                    for request_id, (expires, fingerprint, result, _) in recent.items() if expires > now]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(recent) for recent in self._accounts.values())
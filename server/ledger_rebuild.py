@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from audit_store import AuditLogReader, data_path, is_segment, read_checkpoint
+from audit_tool import AUDIT_LOG_DIR, discover_users
+
+
+# =============================
+# Ledger Rebuild from the Audit Events
+# Recomputes every account's balance from the typed events of its audit log
+# (see audit_log.py), one account per task on a pool of worker processes.
+# Each replay starts at the account's latest balance checkpoint
+# (<customer_id>.ckpt, written by the audit writer), so only the entries
+# logged since then are decrypted; --full ignores the checkpoints and
+# replays every entry. Events are applied in ledger-write (seq) order, and
+# each one is checked: the previous balance plus its delta must give the
+# balance it recorded.
+# Usage: python server/ledger_rebuild.py --output balances.json
+#        python server/ledger_rebuild.py --compare server/ledger_data   (with the server stopped)
+# Progress and problems go to stderr. Exits with status 1 when any event
+# does not add up or a balance differs from the ledger.
+# Seqs of the in-memory ledger engine restart with the server, so a log
+# spanning several runs of it cannot be replayed in order; use the WAL engine.
+# =============================
+
+
+def replay_account(task):
+    """
+    Runs in a worker process: replays one account's balance changes.
+
+    Parameters:
+        task (tuple): (log_dir, customer_id, use_checkpoint)
+
+    Returns:
+        dict: {'customer_id', 'balance' (None if no balance change was logged),
+               'seq', 'from_entry', 'entries', 'events', 'problems'}
+    """
+    log_dir, customer_id, use_checkpoint = task
+    summary = {'customer_id': customer_id, 'balance': None, 'seq': 0, 'from_entry': 0,
+               'entries': 0, 'events': 0, 'problems': []}
+    path = data_path(log_dir, customer_id)
+    if os.path.exists(path) and os.path.getsize(path) and not is_segment(path):
+        return summary  # a line-based log from before typed events: nothing to replay
+
+
+    with AuditLogReader(log_dir, customer_id) as reader:
+        # Step 1: Start from the checkpoint, if it describes entries that still exist
+        checkpoint = read_checkpoint(log_dir, customer_id) if use_checkpoint else None
+        if checkpoint is not None and checkpoint['entry'] <= reader.count:
+            summary.update(balance=checkpoint['balance'], seq=checkpoint['seq'], from_entry=checkpoint['entry'])
+
+
+        # Step 2: Collect the balance changes logged since then
+        events = []
+        for n in range(summary['from_entry'], reader.count):
+            try:
+                entry = reader.read(n)
+            except Exception as e:
+                summary['problems'].append(f"entry {n} does not decrypt ({type(e).__name__})")
+                continue
+            summary['entries'] += 1
+            if isinstance(entry.get('seq'), int) and entry['seq'] > summary['seq'] and not entry.get('replayed'):
+                events.append((entry['seq'], n, entry))
+
+
+    # Step 3: Apply them in ledger-write order (a batch's operations share one seq and keep log order)
+    events.sort(key=lambda item: (item[0], item[1]))
+    balance = summary['balance']
+    for seq, n, event in events:
+        if balance is None:
+            balance = event['balance'] - event['delta']   # the balance before the first logged change
+        if balance + event['delta'] != event['balance']:
+            summary['problems'].append(f"entry {n} (seq {seq}): {balance} {event['delta']:+d} "
+                                       f"does not give the logged balance {event['balance']}")
+        balance = event['balance']   # resync, so one bad event is reported once
+        summary['seq'] = seq
+    summary.update(balance=balance, events=len(events))
+    return summary
+
+
+def rebuild(log_dir, processes=None, use_checkpoints=True, quiet=False):
+    """
+    Replays every account with an audit log in `log_dir`.
+
+    Returns:
+        tuple: (balances {customer_id: balance}, problems found)
+    """
+    processes = processes or os.cpu_count() or 1
+    started = time.monotonic()
+    balances = {}
+    entries = events = found = 0
+    tasks = [(log_dir, customer_id, use_checkpoints) for customer_id in discover_users(log_dir)]
+    with multiprocessing.Pool(processes) as pool:
+        for summary in pool.imap_unordered(replay_account, tasks):
+            entries += summary['entries']
+            events += summary['events']
+            found += len(summary['problems'])
+            for problem in summary['problems']:
+                print(f"[REBUILD] {summary['customer_id']} {problem}", file=sys.stderr)
+            if summary['balance'] is not None:
+                balances[summary['customer_id']] = summary['balance']
+            if not quiet:
+                print(f"[REBUILD] {summary['customer_id']}: balance {summary['balance']} after seq {summary['seq']} "
+                      f"({summary['events']} events from entry {summary['from_entry']})", file=sys.stderr)
+
+    elapsed = time.monotonic() - started
+    print(f"[REBUILD] {len(balances)} balances from {events} events ({entries} entries read) "
+          f"in {elapsed:.1f}s, {found} problems", file=sys.stderr)
+    return balances, found
+
+
+def compare(balances, ledger_dir):
+    """
+    Checks rebuilt balances against a WAL ledger directory (the server must be stopped).
+
+    Returns:
+        int: Accounts whose balances differ.
+    """
+    from ledger import WALLedger
+    ledger = WALLedger(ledger_dir)
+    try:
+        differ = 0
+        for customer_id, balance in sorted(balances.items()):
+            stored = ledger.get(customer_id)
+            if stored != balance:
+                differ += 1
+                print(f"[REBUILD] {customer_id}: ledger has {stored}, the events give {balance}", file=sys.stderr)
+    finally:
+        ledger.close(snapshot=False)
+    print(f"[REBUILD] {len(balances) - differ} of {len(balances)} balances match the ledger", file=sys.stderr)
+    return differ
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild account balances from the audit events")
+    parser.add_argument('--log-dir', default=AUDIT_LOG_DIR, help="audit log directory (default: %(default)s)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--full', action='store_true', help="ignore checkpoints and replay every entry")
+    parser.add_argument('--output', default=None, help="write the balances as JSON to this file ('-' = stdout)")
+    parser.add_argument('--compare', default=None, metavar='LEDGER_DIR',
+                        help="check the balances against this WAL ledger directory (server stopped)")
+    parser.add_argument('--quiet', action='store_true', help="print only problems and the summary")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.log_dir):
+        print(f"No audit log directory at {args.log_dir}")
+        return 0
+    balances, found = rebuild(args.log_dir, args.processes, not args.full, args.quiet)
+    if args.output == '-':
+        json.dump(balances, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(balances, f, indent=2, sort_keys=True)
+    if args.compare:
+        found += compare(balances, args.compare)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import os
+import time
+import zlib
+import errno
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+# =============================
+# Account Lock Manager
+# Striped locks: each account maps to one of a fixed number of locks, so a
+# read-check-write on one account is atomic while unrelated accounts proceed
+# in parallel. Multi-account operations take their stripes in ascending
+# index order, which rules out deadlocks between them.
+# With a lock file the stripes also exclude other processes (pre-forked
+# workers): stripe i is byte i of the file, locked with fcntl, and the
+# kernel drops those locks if a worker dies while holding one.
+# fcntl locks belong to a process, not a thread, so the kernel's deadlock
+# check can see a cycle between two workers whose threads each hold one
+# stripe and wait for another; stripes are always taken in order, so such
+# a cycle is never real and the lock is simply tried again.
+# =============================
+
+
+DEADLOCK_RETRY_DELAY = 0.0005   # Seconds before retrying a lock the kernel refused with EDEADLK
+
+
+class ProcessStripeLock:
+    """
+    One stripe shared between processes: a thread lock for the threads of
+    this process plus an fcntl record lock on one byte of the lock file.
+    """
+
+    def __init__(self, fd, index):
+        self._fd = fd
+        self._index = index
+        self._local = threading.Lock()
+
+    def acquire(self):
+        self._local.acquire()
+        try:
+            while True:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._index)
+                    break
+                except OSError as e:
+                    if e.errno != errno.EDEADLK:
+                        raise
+                    time.sleep(DEADLOCK_RETRY_DELAY)   # a thread of the other worker will release it
+        except BaseException:
+            self._local.release()
+            raise
+        return True
+
+    def release(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._index)
+        self._local.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LockManager:
+    """
+    A fixed pool of locks shared by all accounts.
+    """
+
+    def __init__(self, stripes=1024, lock_path=None):
+        """
+        Parameters:
+            stripes (int): Number of locks; more stripes = fewer unrelated accounts sharing one.
+            lock_path (str): Lock file shared by every process that must exclude the
+                             others (None = locks only cover threads of this process).
+        """
+        if lock_path is None:
+            self._locks = [threading.Lock() for _ in range(stripes)]
+        else:
+            # Opened per process: fcntl locks belong to the process, not the descriptor
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._locks = [ProcessStripeLock(fd, i) for i in range(stripes)]
+
+    def _index(self, account):
+        # crc32 rather than hash(): stable across processes and restarts
+        return zlib.crc32(account.encode()) % len(self._locks)
+
+    def lock(self, account):
+        """
+        Returns the lock guarding `account` (use as `with locks.lock(name):`).
+        """
+        return self._locks[self._index(account)]
+
+    @contextmanager
+    def lock_many(self, accounts):
+        """
+        Holds the locks of several accounts at once, acquired in a fixed
+        global order (stripe index) and released in reverse.
+
+        Parameters:
+            accounts (iterable): Account names; duplicates and accounts sharing a stripe are fine.
+        """
+        indexes = sorted({self._index(account) for account in accounts})
+        acquired = []
+        try:
+            for i in indexes:
+                self._locks[i].acquire()
+                acquired.append(i)
+            yield
+        finally:
+            for i in reversed(acquired):
+                self._locks[i].release()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import time
+import bisect
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# =============================
+# Server Metrics
+# Per-stage timing histograms, counters per action / error type and gauges
+# for sessions and threads, served as plain text (Prometheus exposition
+# format) on a local-only HTTP endpoint:
+#   curl http://127.0.0.1:9465/metrics
+# With METRICS_ENABLED off every hook returns straight away, so the
+# instrumented hot path costs one function call per stage.
+# =============================
+
+
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'     # never exposed beyond this machine
+METRICS_PORT = 9465
+
+# Histogram bucket upper bounds in seconds (10us .. 10s)
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram (counts per bucket plus sum and count).
+    """
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot = above the largest bound
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total
+
+
+class Registry:
+    """
+    All metrics of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}                        # stage name -> Histogram
+        self.counters = defaultdict(int)        # (metric, label) -> count
+        self.gauges = defaultdict(int)          # metric -> value
+
+    def histogram(self, stage):
+        hist = self.stages.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self.stages.setdefault(stage, Histogram())
+        return hist
+
+    def add(self, table, key, delta):
+        with self._lock:
+            table[key] += delta
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = ['# TYPE bank_stage_seconds histogram']
+        for stage, hist in sorted(self.stages.items()):
+            counts, total = hist.snapshot()
+            cumulative = 0
+            for bound, n in zip(hist.bounds, counts):
+                cumulative += n
+                lines.append(f'bank_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'bank_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'bank_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'bank_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = dict(self.gauges)
+        typed = set()
+        for (metric, label), value in counters:
+            name, _, key = metric.partition(':')
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE bank_{name}_total counter')
+            lines.append(f'bank_{name}_total{{{key}="{label}"}} {value}')
+        gauges['threads'] = threading.active_count()
+        for metric, value in sorted(gauges.items()):
+            lines.append(f'# TYPE bank_{metric} gauge')
+            lines.append(f'bank_{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry used by the hooks below
+registry = Registry()
+
+
+def now():
+    """
+    Start time for observe(); 0.0 when metrics are off.
+    """
+    return time.perf_counter() if METRICS_ENABLED else 0.0
+
+
+def observe(stage, start):
+    """
+    Records the time since `start` (from now()) under `stage`.
+    """
+    if METRICS_ENABLED:
+        registry.histogram(stage).observe(time.perf_counter() - start)
+
+
+def count(metric, label):
+    """
+    Increments a labelled counter; `metric` is 'name:label_key' (e.g. 'requests:action').
+    """
+    if METRICS_ENABLED:
+        registry.add(registry.counters, (metric, label), 1)
+
+
+def gauge_add(metric, delta):
+    if METRICS_ENABLED:
+        registry.add(registry.gauges, metric, delta)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the server console
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Serves /metrics on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,182 @@
+import math
+import socket
+import threading
+import time
+import metrics
+
+
+# =============================
+# Connection Deadlines
+# Every session carries one deadline, which it moves as it goes:
+#   handshake : HANDSHAKE_TIMEOUT from accept until the handshake completes
+#   idle      : IDLE_TIMEOUT waiting for the next request to start arriving
+#   request   : REQUEST_TIMEOUT for the rest of a request once it has started
+#               (a client trickling in a frame byte by byte cannot hold the session)
+#   send      : REQUEST_TIMEOUT for each reply frame a slow reader leaves unsent
+# While the server itself works on a request there is no deadline.
+# One reaper thread closes sessions whose deadline has passed: it turns a
+# hashed timer wheel of REAPER_TICK slots and shuts the connection down, which
+# wakes the session's blocked receive or send so it cleans up on its own thread.
+# A session only writes its new deadline; the wheel looks at each entry at
+# least every REAPER_RESCAN seconds and re-files it then, so moving a deadline
+# later takes no lock (only moving it earlier than that does).
+# Reaped sessions are counted in the 'reaped' metric, by reason.
+# =============================
+
+
+HANDSHAKE_TIMEOUT = 10.0    # Seconds from accept to a completed handshake (0 = none)
+REQUEST_TIMEOUT = 30.0      # Seconds to finish receiving a started request, or sending one reply frame (0 = none)
+IDLE_TIMEOUT = 300.0        # Seconds a session may wait between requests (0 = none)
+REAPER_TICK = 0.5           # Timer wheel resolution in seconds
+REAPER_RESCAN = 5.0         # Longest time an entry waits in the wheel before being looked at again
+
+NEVER = math.inf
+
+
+class SessionTimeout(ConnectionError):
+    """Raised in a session whose connection was reaped; the message is the reason."""
+
+
+class Deadline:
+    """
+    One connection's current deadline (see Reaper.watch).
+    """
+
+    __slots__ = ('reaper', 'close', 'reason', 'expires', 'scheduled', 'tick', 'reaped', 'cancelled')
+
+    def __init__(self, reaper, close):
+        self.reaper = reaper
+        self.close = close
+        self.reason = None
+        self.expires = NEVER
+        self.scheduled = NEVER   # when the wheel will next look at this entry
+        self.tick = None
+        self.reaped = False
+        self.cancelled = False
+
+    def set(self, reason, timeout):
+        """
+        Starts a new deadline `timeout` seconds from now (0 or None = no deadline).
+        """
+        self.reason = reason
+        self.expires = time.monotonic() + timeout if timeout else NEVER
+        if self.expires < self.scheduled:
+            self.reaper._schedule(self, self.expires)
+
+    def clear(self):
+        """
+        No deadline until the next set() (the server is working on a request).
+        """
+        self.expires = NEVER
+
+    def cancel(self):
+        """
+        Stops watching the connection (call when the session ends).
+        """
+        self.cancelled = True
+
+
+class Reaper:
+    """
+    Hashed timer wheel of connection deadlines, turned by one background thread.
+    Slots hold plain lists; an entry moved to another slot is skipped in its
+    old one (its tick no longer matches), so nothing is ever searched for.
+    """
+
+    def __init__(self, tick=REAPER_TICK, rescan=REAPER_RESCAN):
+        self.tick = tick
+        self.rescan = rescan
+        self._slots = [[] for _ in range(int(math.ceil(rescan / tick)) + 2)]
+        self._current = int(time.monotonic() / tick)   # tick being (or next to be) processed
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, close, reason, timeout):
+        """
+        Starts watching a connection.
+
+        Parameters:
+            close (callable): Shuts the connection down; called on the reaper thread.
+            reason (str): The first deadline's reason (e.g. 'handshake').
+            timeout (float): Seconds until it expires (0 or None = no deadline).
+
+        Returns:
+            Deadline: The handle the session moves its deadline with.
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='reaper', daemon=True)
+                    self._thread.start()
+        deadline = Deadline(self, close)
+        deadline.set(reason, timeout)
+        if deadline.tick is None:
+            self._schedule(deadline, NEVER)
+        return deadline
+
+    def _schedule(self, deadline, at):
+        """
+        Files the entry in the slot of `at`, but never further out than
+        REAPER_RESCAN and never in the tick being processed.
+        """
+        with self._lock:
+            tick = math.ceil(min(at, time.monotonic() + self.rescan) / self.tick)
+            tick = min(max(tick, self._current + 1), self._current + len(self._slots) - 1)
+            deadline.tick = tick
+            deadline.scheduled = tick * self.tick
+            self._slots[tick % len(self._slots)].append(deadline)
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            while self._current <= now / self.tick:
+                with self._lock:
+                    tick = self._current
+                    slot = tick % len(self._slots)
+                    due, self._slots[slot] = self._slots[slot], []
+                for deadline in due:
+                    if deadline.cancelled or deadline.reaped or deadline.tick != tick:
+                        continue   # ended, or filed again in a later slot
+                    if deadline.expires <= now:
+                        self._reap(deadline)
+                    else:
+                        self._schedule(deadline, deadline.expires)
+                with self._lock:
+                    self._current += 1
+
+    def _reap(self, deadline):
+        deadline.reaped = True
+        metrics.count('reaped:reason', deadline.reason)
+        try:
+            deadline.close()
+        except (OSError, RuntimeError):
+            pass   # already closed, or its event loop has stopped
+
+
+# Process-wide reaper (its thread starts with the first watched connection)
+reaper = Reaper()
+
+
+def configure(handshake_timeout=HANDSHAKE_TIMEOUT, request_timeout=REQUEST_TIMEOUT, idle_timeout=IDLE_TIMEOUT):
+    """
+    Replaces the deadlines (call before serving).
+    """
+    global HANDSHAKE_TIMEOUT, REQUEST_TIMEOUT, IDLE_TIMEOUT
+    HANDSHAKE_TIMEOUT, REQUEST_TIMEOUT, IDLE_TIMEOUT = handshake_timeout, request_timeout, idle_timeout
+
+
+def watch_socket(conn):
+    """
+    Watches a blocking socket from accept on (handshake deadline). Reaping
+    shuts it down, so the session's blocked recv/send returns at once; the
+    session still closes the socket itself.
+    """
+    return reaper.watch(lambda: conn.shutdown(socket.SHUT_RDWR), 'handshake', HANDSHAKE_TIMEOUT)
+
+
+def watch_transport(loop, transport):
+    """
+    asyncio counterpart of watch_socket: reaping aborts the transport on its event loop.
+    """
+    return reaper.watch(lambda: loop.call_soon_threadsafe(transport.abort), 'handshake', HANDSHAKE_TIMEOUT)
@@ -0,0 +1,243 @@
+import os
+import threading
+from cryptography.exceptions import InvalidSignature, InvalidTag, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes, hmac
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from key_derivation import derive_keys, derive_record_keys
+
+
+# =============================
+# Record Protection Layer
+# Protects each transaction frame with the cipher suite negotiated in the
+# handshake:
+#   aes-256-gcm / chacha20-poly1305 : single-pass AEAD, record = ciphertext || 16-byte tag.
+#                                     The nonce is never sent: it is the direction's IV
+#                                     XOR a per-direction record counter (frames arrive
+#                                     in order over TCP, so both sides know it).
+#   aes-256-cbc-hmac-sha256         : the original scheme, record = IV || AES-CBC || HMAC-SHA256,
+#                                     used for clients that do not negotiate. Byte-for-byte what
+#                                     utils.encrypt + generate_mac produce, but the key setup
+#                                     is done once per session (see CbcHmacContext).
+# Every layer opens records given as bytes or as memoryview slices of a
+# receive buffer, and seal_parts() returns a record as a list of buffers for
+# a scatter/gather send (framing.send_frame) instead of one joined copy.
+# Mirrored in client/record_layer.py
+# =============================
+
+
+SUITE_AES_GCM = 'aes-256-gcm'
+SUITE_CHACHA20 = 'chacha20-poly1305'
+SUITE_CBC_HMAC = 'aes-256-cbc-hmac-sha256'
+
+# What a peer that offers no suites gets
+LEGACY_SUITE = SUITE_CBC_HMAC
+
+AEAD_CIPHERS = {
+    SUITE_AES_GCM: AESGCM,
+    SUITE_CHACHA20: ChaCha20Poly1305,
+}
+
+MAC_SIZE = 32
+IV_SIZE = 16
+MAX_RECORDS = 2 ** 64 - 1   # per direction; the counter must never wrap
+
+
+def _supported(suite):
+    # Some OpenSSL builds (e.g. FIPS mode) lack ChaCha20-Poly1305
+    try:
+        AEAD_CIPHERS[suite](bytes(32))
+        return True
+    except UnsupportedAlgorithm:
+        return False
+
+
+# Suites this side can speak, most preferred first
+SUPPORTED_SUITES = [s for s in (SUITE_AES_GCM, SUITE_CHACHA20) if _supported(s)] + [SUITE_CBC_HMAC]
+
+
+class RecordError(Exception):
+    """
+    A record failed authentication (tampered, replayed, reordered or wrong keys).
+    """
+
+
+def negotiate_suite(offered):
+    """
+    Picks the suite for a session (server side).
+
+    Parameters:
+        offered (list or None): Suites listed in the ClientHello, None for old clients.
+
+    Returns:
+        str: Our most preferred suite the client also offered, else LEGACY_SUITE.
+    """
+    if not offered:
+        return LEGACY_SUITE
+    for suite in SUPPORTED_SUITES:
+        if suite in offered:
+            return suite
+    return LEGACY_SUITE
+
+
+def _xor_block(a, b, c):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big') ^ int.from_bytes(c, 'big')).to_bytes(IV_SIZE, 'big')
+
+
+class CbcHmacContext:
+    """
+    Encrypt-then-MAC (AES-256-CBC, HMAC-SHA256) under one fixed key pair,
+    with the per-key setup done once instead of per message:
+      - the HMAC state with the key already absorbed into its inner and outer
+        pads is copied for each message instead of re-keyed
+      - one CBC context per direction lives as long as the keys. A context
+        chains from the last ciphertext block it handled, so each message's
+        first block is XORed with that block and the message's own random IV:
+        the output is exactly AES-CBC under that IV, without building a cipher
+        context around every IV
+    Safe to share between threads.
+    """
+
+    def __init__(self, k_enc, k_mac):
+        aes = algorithms.AES(k_enc)
+        self._mac = hmac.HMAC(k_mac, hashes.SHA256())
+        self._encryptor = Cipher(aes, modes.CBC(bytes(IV_SIZE))).encryptor()
+        self._decryptor = Cipher(aes, modes.CBC(bytes(IV_SIZE))).decryptor()
+        self._enc_chain = self._dec_chain = bytes(IV_SIZE)   # last ciphertext block each context saw
+        self._lock = threading.Lock()
+
+    def seal_parts(self, plaintext):
+        """
+        Returns:
+            list: [IV, AES-CBC(PKCS7(plaintext)) in one or more pieces, HMAC-SHA256(IV || ciphertext)].
+                  The plaintext is encrypted in place; only its last block is copied, to pad it.
+        """
+        iv = os.urandom(IV_SIZE)
+        view = memoryview(plaintext)
+        full = len(view) - len(view) % IV_SIZE
+        pad = IV_SIZE - len(view) % IV_SIZE
+        last = bytes(view[full:]) + bytes((pad,)) * pad
+        pieces = [view[:IV_SIZE], view[IV_SIZE:full], last] if full else [last]
+        with self._lock:
+            pieces[0] = _xor_block(pieces[0], iv, self._enc_chain)
+            parts = [iv] + [self._encryptor.update(piece) for piece in pieces if len(piece)]
+            self._enc_chain = parts[-1][-IV_SIZE:]
+        mac = self._mac.copy()
+        for part in parts:
+            mac.update(part)
+        parts.append(mac.finalize())
+        return parts
+
+    def seal(self, plaintext):
+        """
+        Returns:
+            bytes: IV || AES-CBC(PKCS7(plaintext)) || HMAC-SHA256(IV || ciphertext)
+        """
+        return b''.join(self.seal_parts(plaintext))
+
+    def open(self, record):
+        """
+        Verifies the MAC (in constant time), then decrypts into one new buffer.
+
+        Returns:
+            bytearray: The plaintext.
+
+        Raises:
+            RecordError: If the MAC does not match or the record is malformed.
+        """
+        record = memoryview(record)
+        ciphertext, tag = record[:-MAC_SIZE], record[-MAC_SIZE:]
+        mac = self._mac.copy()
+        mac.update(ciphertext)
+        try:
+            mac.verify(bytes(tag))
+        except InvalidSignature:
+            raise RecordError("MAC verification failed")
+        if len(ciphertext) < 2 * IV_SIZE or len(ciphertext) % IV_SIZE:
+            raise RecordError("Malformed record")
+        padded = bytearray(len(ciphertext) - 1)   # update_into wants a block - 1 bytes of slack
+        with self._lock:
+            length = self._decryptor.update_into(ciphertext[IV_SIZE:], padded)
+            padded[:IV_SIZE] = _xor_block(padded[:IV_SIZE], self._dec_chain, ciphertext[:IV_SIZE])
+            self._dec_chain = bytes(ciphertext[-IV_SIZE:])
+        # The MAC already proved the sender holds the key, so checking the padding leaks nothing
+        pad = padded[length - 1]
+        if not 1 <= pad <= IV_SIZE or padded[length - pad:length] != bytes((pad,)) * pad:
+            raise RecordError("Bad padding")
+        del padded[length - pad:]
+        return padded
+
+
+class CbcHmacRecordLayer(CbcHmacContext):
+    """
+    Encrypt-then-MAC records with k_enc/k_mac from derive_keys.
+    """
+
+    suite = SUITE_CBC_HMAC
+
+    def __init__(self, master_secret, is_server):
+        super().__init__(*derive_keys(master_secret))
+
+
+class AeadRecordLayer:
+    """
+    AEAD records with counter nonces. One cipher object per direction is
+    created when the session starts and reused for every record.
+    """
+
+    def __init__(self, suite, master_secret, is_server):
+        self.suite = suite
+        client_key, client_iv, server_key, server_iv = derive_record_keys(master_secret, suite)
+        cipher = AEAD_CIPHERS[suite]
+        if is_server:
+            self._send, self._send_iv = cipher(server_key), server_iv
+            self._recv, self._recv_iv = cipher(client_key), client_iv
+        else:
+            self._send, self._send_iv = cipher(client_key), client_iv
+            self._recv, self._recv_iv = cipher(server_key), server_iv
+        self._send_seq = 0
+        self._recv_seq = 0
+
+    @staticmethod
+    def _nonce(iv, seq):
+        if seq >= MAX_RECORDS:
+            raise RecordError("Record counter exhausted; start a new session")
+        return (int.from_bytes(iv, 'big') ^ seq).to_bytes(12, 'big')
+
+    def seal(self, plaintext):
+        record = self._send.encrypt(self._nonce(self._send_iv, self._send_seq), plaintext, None)
+        self._send_seq += 1
+        return record
+
+    def seal_parts(self, plaintext):
+        return [self.seal(plaintext)]   # ciphertext and tag already come out as one buffer
+
+    def open(self, record):
+        # The counter only advances on success: a forged record does not
+        # desynchronise the session
+        try:
+            plaintext = self._recv.decrypt(self._nonce(self._recv_iv, self._recv_seq), record, None)
+        except InvalidTag:
+            raise RecordError("Record authentication failed")
+        self._recv_seq += 1
+        return plaintext
+
+
+def new_record_layer(suite, master_secret, is_server):
+    """
+    Creates the per-session record protection object for a negotiated suite.
+
+    Parameters:
+        suite (str): One of SUPPORTED_SUITES.
+        master_secret (bytes): The session's Master Secret (MS).
+        is_server (bool): Which side of the connection we are (selects the send/receive keys).
+
+    Returns:
+        object: With seal(plaintext) -> record, seal_parts(plaintext) -> [buffers of the record]
+                and open(record) -> plaintext (raises RecordError).
+    """
+    if suite == SUITE_CBC_HMAC:
+        return CbcHmacRecordLayer(master_secret, is_server)
+    if suite in AEAD_CIPHERS:
+        return AeadRecordLayer(suite, master_secret, is_server)
+    raise ValueError(f"Unsupported cipher suite: {suite}")
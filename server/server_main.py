@@ -1,33 +1,53 @@
+import sys
+import time
 import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
 import threading
-from transaction_handler import handle_client
+import multiprocessing
+from multiprocessing.connection import wait
+import transaction_handler
+import audit_log
+import session_ticket
+import metrics
+import audit_tool
+import admission
+import reaper
+import hello_cookie
+from transaction_handler import handle_client, handle_client_async, db
+from audit_log import audit_writer
+from audit_store import user_files, migrate_legacy_logs
+from lock_manager import LockManager
+from state_service import StateService, StateClient, RemoteLedger, RemoteAuditWriter, RemoteReplayCache
 import os
-import json
-import time
-from utils import encrypt, decrypt, generate_mac, verify_mac
-from audit_log import log_encrypted_action
-from auth_protocol import authenticate_and_generate_master_secret
-from key_derivation import derive_keys
-from utils import get_audit_key
 
 
 # =============================
 # Point 1: Multithreaded Bank Server
 # This server listens for incoming ATM client connections,
 # and for each client, it spawns a new thread to handle their session securely.
+# With --mode asyncio all sessions run as coroutines on one event loop instead.
+# With --mode prefork a supervisor forks --workers processes that each run one
+# of those engines on the same port, so sessions are spread over all cores.
+# Admission control (admission.py) caps sessions per process and answers
+# connections over the cap with an immediate "server busy" message.
+# Connections that stall in the handshake, sit idle or trickle a request in
+# are closed by the reaper (reaper.py) once their deadline passes.
+# With --hello-cookies a ClientHello must echo a stateless cookie (hello_cookie.py)
+# before the server looks up any key or encrypts anything for it.
 # =============================
 
 
 HOST = '127.0.0.1'  
 PORT = 65432        
-
-
-# Simulated in-memory account storage
-db = {
-    'alice': 1000,
-    'bob': 500,
-    'charlie': 750
-}
+SERVER_MODE = 'thread'  # 'thread' = one thread per connection, 'asyncio' = single event loop,
+                        # 'prefork' = worker processes (each running WORKER_ENGINE)
+WORKER_ENGINE = 'thread'
+WORKER_RESTART_DELAY = 1.0  # seconds before restarting a worker that died right after starting
+AUDIT_CHECK_PROCESSES = max(1, (os.cpu_count() or 2) // 2)  # leave half the cores to serving
 
 
 def client_thread(conn, addr): #when the server accepts a connection, it creates a new thread to handle the client
@@ -35,160 +55,65 @@ def client_thread(conn, addr): #when the server accepts a connection, it creates
     try:
         handle_client(conn)
     except Exception as e:
+        metrics.count('session_errors:type', type(e).__name__)
         print(f"\nError handling client {addr}: {e}")
     finally:
         conn.close()
+        admission.sessions.leave()
         print(f"\nDisconnected {addr}")
 
 
-def handle_client(conn): #this is where the server handles all incoming requests from the client
-    ##############passeorsd handler code need to added here
+def clear_logs(log_dir=audit_log.AUDIT_LOG_DIR):
     """
-    Handles a connected client by processing encrypted and integrity-protected
-    transactions such as deposit, withdraw, balance inquiry, and log viewing.
-
-    Parameters:
-        conn: The socket connection to the client.
-
-    Returns:
-        None
+    Deletes every user's audit log (--fresh-logs).
     """
+    users = audit_tool.discover_users(log_dir) if os.path.isdir(log_dir) else []
+    for user in users:
+        for path in user_files(log_dir, user):  # segment, index, sealed segments, manifest
+            os.remove(path)
+    print(f"Deleted the audit logs of {len(users)} users.\n")
 
 
-    # Step 1: Authenticate the client and establish a shared master secret
-    # This ensures the client is legitimate and establishes a secure session.
-    username, master_secret = authenticate_and_generate_master_secret(conn) #############will also recieve password here
-
-    # Step 2: Derive encryption and MAC keys from the master secret
-    # These keys are used for secure communication with the client.
-    k_enc, k_mac = derive_keys(master_secret)
-
-
-    while True:
-        # Step 3: Receive an encrypted packet from the client
-        # The packet contains the client's request and a MAC for integrity verification.
-        encrypted_packet = conn.recv(4096)
-        if not encrypted_packet:
-            break  # Exit the loop if the connection is closed
-
-
-        try:
-            # Step 4: Extract the payload and MAC from the packet
-            # The last 32 bytes of the packet are the MAC, and the rest is the payload.
-            payload_json, mac = encrypted_packet[:-32], encrypted_packet[-32:]
-
-
-            # Step 5: Verify the integrity of the payload using the MAC
-            # If the MAC does not match, the data may have been tampered with.
-            if not verify_mac(k_mac, payload_json, mac):
-                raise Exception("MAC verification failed")
-
-
-            # Step 6: Decrypt the payload to retrieve the client's request
-            # The payload is decrypted using the encryption key (k_enc).
-            decrypted_payload = decrypt(k_enc, payload_json)
-            request = json.loads(decrypted_payload.decode())  
-            action = request['action']  
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')  
-
-
-            # Step 7: Process the requested action
-            if action == 'deposit':
-                amount = request['amount']
-                db[username] += amount  # Update the user's balance
-                result = f"Deposited ${amount}. New balance: ${db[username]}"
-                log_encrypted_action(username, action, timestamp)  # Log the action securely
-
-            elif action == 'withdraw':
-                amount = request['amount']
-                if db[username] >= amount:
-                    db[username] -= amount  # Deduct the amount from the user's balance
-                    result = f"Withdrew ${amount}. New balance: ${db[username]}"
-                else:
-                    result = "Insufficient funds."
-                log_encrypted_action(username, action, timestamp)  # Log the action securely
-
-            elif action == 'balance':
-                result = f"Current balance: ${db[username]}"
-                log_encrypted_action(username, action, timestamp)  # Log the action securely
-
-            elif action == 'view_log':
-                user_log_file = f"server/audit_logs/{username}.enc"  # Path to the user's log file
-                result_lines = []
-                try:
-                    # Open the log file and decrypt each entry
-                    with open(user_log_file, 'rb') as f:
-                        for line in f:
-                            try:
-                                decrypted = decrypt(get_audit_key(), line.strip())  # Decrypt the log entry
-                                entry = json.loads(decrypted.decode())  # Parse the JSON log entry
-                                result_lines.append(f"{entry['timestamp']} - {entry['customer_id']} - {entry['action']}")
-                            except Exception:
-                                continue  # Skip invalid log entries
-                    result = "\n".join(result_lines) if result_lines else "No logs found."
-                except FileNotFoundError:
-                    result = "No log file found."
-
-
-            else:
-                # Handle invalid actions
-                result = "Invalid action."
-
-
-            # Step 8: Log the action (for audit purposes)
-            # This ensures all actions are recorded securely.
-            log_encrypted_action(username, action, timestamp)
-
-
-            # Step 9: Prepare the response to send back to the client
-            # The response is encrypted and includes a MAC for integrity.
-            response = json.dumps({"result": result}).encode()  # Serialize the result
-            encrypted_response = encrypt(k_enc, response)  # Encrypt the response
-            response_mac = generate_mac(k_mac, encrypted_response)  # Generate a MAC for the response
-            conn.sendall(encrypted_response + response_mac)  # Send the encrypted response with the MAC
-
-
-        except Exception as e:
-            # Step 10: Handle errors and send an error response to the client
-            # If an error occurs, send an encrypted error message with a MAC.
-            error_msg = json.dumps({"result": str(e)}).encode()  # Serialize the error message
-            encrypted_error = encrypt(k_enc, error_msg)  # Encrypt the error message
-            error_mac = generate_mac(k_mac, encrypted_error)  # Generate a MAC for the error message
-            conn.sendall(encrypted_error + error_mac)  # Send the encrypted error response with the MAC
-
+def start_audit_check(log_dir=audit_log.AUDIT_LOG_DIR):
+    """
+    Verifies every audit log in a separate process (see audit_tool.py) while
+    the server starts serving; problems are printed to the console.
 
-def check_and_clear_logs():
-    log_dir = "server/audit_logs"
-    users = ["alice", "bob", "charlie"] #this can be changed and can use db to get a list fo suers so we dont ahve to update the users list each time 
+    Returns:
+        subprocess.Popen, or None if there are no logs yet.
+    """
+    if not os.path.isdir(log_dir):
+        return None
+    tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_tool.py')
+    return subprocess.Popen([sys.executable, tool, '--log-dir', log_dir, '--quiet',
+                             '--processes', str(AUDIT_CHECK_PROCESSES)])
 
-    if not os.path.exists(log_dir):
-        return  # No logs to check
 
-    found_logs = []
-    for user in users:
-        log_path = os.path.join(log_dir, f"{user}.enc")
-        if os.path.exists(log_path):
-            found_logs.append(log_path)
-
-    if found_logs:
-        print("\nFound existing log files:")
-        for log in found_logs:
-            print(f"  - {log}")
-        choice = input("\nDo you want to delete all logs and start fresh? (y/n): ").strip().lower()
-        if choice == 'y':
-            for log in found_logs:
-                os.remove(log)
-            print("All logs deleted.\n")
-        else:
-            print("Logs preserved.\n")
+def listening_socket(reuse_port=False):
+    """
+    Binds and listens on HOST:PORT. With reuse_port every worker binds its own
+    socket and the kernel spreads incoming connections across them.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen(admission.ACCEPT_BACKLOG)
+    return server_socket
 
 
-def main():
-    check_and_clear_logs()  
+def serve_threaded(server_socket=None):
+    """
+    Thread-per-connection server: accepts in a loop and spawns client_thread for each socket,
+    up to admission.MAX_SESSIONS at once; connections over the cap are refused as busy.
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
+    Parameters:
+        server_socket: Listening socket to accept on (None = bind HOST:PORT).
+    """
+    if server_socket is None:
+        server_socket = listening_socket()
+    rejector = admission.Rejector()
+    with server_socket:
         server_socket.settimeout(1.0)  
 
         print(f"Bank Server listening on {HOST}:{PORT}")
@@ -200,6 +125,9 @@ def main():
                 except socket.timeout:
                     continue  # loop back and check for KeyboardInterrupt
 
+                if not admission.sessions.try_enter():
+                    rejector.reject(conn)  # answered on the rejector thread, never blocks accepting
+                    continue
                 thread = threading.Thread(target=client_thread, args=(conn, addr))
                 thread.start()
                 print(f"Active threads: {threading.active_count() - 1}")
@@ -209,5 +137,207 @@ def main():
         finally:
             server_socket.close()
 
+
+async def async_client_session(reader, writer):
+    """
+    asyncio counterpart of client_thread: runs one client session as a coroutine.
+    """
+    if not admission.sessions.try_enter():
+        try:
+            await admission.reject_async(reader, writer)
+        finally:
+            writer.close()
+        return
+    addr = writer.get_extra_info('peername')
+    print(f"\nConnected by {addr}")
+    try:
+        await handle_client_async(reader, writer)
+    except Exception as e:
+        metrics.count('session_errors:type', type(e).__name__)
+        print(f"\nError handling client {addr}: {e}")
+    finally:
+        writer.close()
+        admission.sessions.leave()
+        print(f"\nDisconnected {addr}")
+
+
+async def serve_asyncio(server_socket=None):
+    """
+    Event-loop server: every session is a coroutine on one thread.
+
+    Parameters:
+        server_socket: Listening socket to accept on (None = bind HOST:PORT).
+    """
+    if server_socket is None:
+        server = await asyncio.start_server(async_client_session, HOST, PORT, backlog=admission.ACCEPT_BACKLOG)
+    else:
+        server = await asyncio.start_server(async_client_session, sock=server_socket)
+    print(f"Bank Server (asyncio) listening on {HOST}:{PORT}")
+    async with server:
+        await server.serve_forever()
+
+
+def worker_main(engine, server_socket, state_address, authkey, metrics_port=0):
+    """
+    Entry point of one pre-forked worker: swaps the shared state for proxies
+    to the supervisor, then runs the chosen engine on the shared port.
+    """
+    # Ctrl-C reaches the whole process group; the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    client = StateClient(state_address, authkey)
+    transaction_handler.db = RemoteLedger(client)
+    transaction_handler.account_locks = LockManager(transaction_handler.LOCK_STRIPES,
+                                                    lock_path=transaction_handler.LOCK_FILE)
+    audit_log.audit_writer = RemoteAuditWriter(client)
+    session_ticket.replay_cache = RemoteReplayCache(client)
+
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+
+    if server_socket is None:
+        server_socket = listening_socket(reuse_port=True)
+    print(f"Worker {os.getpid()} serving ({engine})")
+    if engine == 'asyncio':
+        try:
+            asyncio.run(serve_asyncio(server_socket))
+        except KeyboardInterrupt:
+            pass  # SIGTERM from the supervisor (its handler is inherited)
+    else:
+        serve_threaded(server_socket)
+
+
+def serve_prefork(workers, engine, metrics_port=0):
+    """
+    Supervisor: owns the ledger, audit writer and replay cache (served to the
+    workers by a StateService), forks `workers` worker processes and restarts
+    any that exit until Ctrl-C. Worker N serves its metrics on metrics_port + N.
+    """
+    os.makedirs(os.path.dirname(transaction_handler.LOCK_FILE), exist_ok=True)
+    state_address = os.path.join(tempfile.mkdtemp(prefix='bank-state-'), 'state.sock')
+    authkey = os.urandom(32)
+    service = StateService(state_address, authkey, db, audit_writer, session_ticket.replay_cache)
+
+    # SO_REUSEPORT: one socket per worker, balanced by the kernel.
+    # Otherwise the workers inherit (and all accept on) one listening socket.
+    shared_socket = None if hasattr(socket, 'SO_REUSEPORT') else listening_socket()
+
+    ctx = multiprocessing.get_context('fork')
+    procs = {}
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop cleanly when terminated too
+
+    def start(slot):
+        proc = ctx.Process(target=worker_main,
+                           args=(engine, shared_socket, state_address, authkey, metrics_port and metrics_port + slot),
+                           name=f'bank-worker-{slot}', daemon=True)
+        proc.start()
+        proc.started_at = time.monotonic()
+        procs[slot] = proc
+
+    print(f"Bank Server (prefork, {workers} x {engine}) listening on {HOST}:{PORT}")
+    try:
+        for slot in range(workers):
+            start(slot)
+        while True:
+            wait([proc.sentinel for proc in procs.values()])
+            for slot, proc in list(procs.items()):
+                if proc.is_alive():
+                    continue
+                print(f"\nWorker {proc.pid} exited with code {proc.exitcode}, restarting")
+                if time.monotonic() - proc.started_at < WORKER_RESTART_DELAY:
+                    time.sleep(WORKER_RESTART_DELAY)  # don't spin on a worker that cannot start
+                start(slot)
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        # A second Ctrl-C or SIGTERM must not cut the shutdown short (and leave workers behind)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.join()
+        service.close()
+        os.rmdir(os.path.dirname(state_address))
+        if shared_socket is not None:
+            shared_socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure Bank Server")
+    parser.add_argument('--mode', choices=['thread', 'asyncio', 'prefork'], default=SERVER_MODE,
+                        help="serving engine (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes for --mode prefork (default: one per core)")
+    parser.add_argument('--worker-engine', choices=['thread', 'asyncio'], default=WORKER_ENGINE,
+                        help="engine each prefork worker runs (default: %(default)s)")
+    parser.add_argument('--metrics-port', type=int, default=metrics.METRICS_PORT,
+                        help="local metrics endpoint port, 0 = no endpoint (default: %(default)s)")
+    parser.add_argument('--no-metrics', action='store_true', help="turn instrumentation off")
+    parser.add_argument('--fresh-logs', action='store_true', help="delete all audit logs before starting")
+    parser.add_argument('--no-audit-check', action='store_true',
+                        help="skip verifying the audit logs in the background at start-up")
+    parser.add_argument('--max-sessions', type=int, default=admission.MAX_SESSIONS,
+                        help="concurrent sessions per process before refusing as busy (default: %(default)s)")
+    parser.add_argument('--pool-workers', type=int, default=admission.POOL_WORKERS,
+                        help="threads per process running batch and view_log requests (default: %(default)s)")
+    parser.add_argument('--user-rate', type=float, default=admission.USER_RATE,
+                        help="requests per second allowed per user, 0 = unlimited (default: %(default)s)")
+    parser.add_argument('--handshake-timeout', type=float, default=reaper.HANDSHAKE_TIMEOUT,
+                        help="seconds allowed to complete the handshake, 0 = none (default: %(default)s)")
+    parser.add_argument('--request-timeout', type=float, default=reaper.REQUEST_TIMEOUT,
+                        help="seconds allowed to finish sending a started request or to take one reply, "
+                             "0 = none (default: %(default)s)")
+    parser.add_argument('--idle-timeout', type=float, default=reaper.IDLE_TIMEOUT,
+                        help="seconds a session may sit idle between requests, 0 = none (default: %(default)s)")
+    parser.add_argument('--hello-cookies', action='store_true',
+                        help="answer a ClientHello with a stateless cookie before any key lookup or crypto; "
+                             "clients must echo it (one extra round trip per cookie lifetime)")
+    args = parser.parse_args()
+    admission.configure(max_sessions=args.max_sessions, pool_workers=args.pool_workers,
+                        user_rate=args.user_rate, user_burst=max(1, int(args.user_rate * 2)))
+    reaper.configure(handshake_timeout=args.handshake_timeout, request_timeout=args.request_timeout,
+                     idle_timeout=args.idle_timeout)
+    hello_cookie.configure(enabled=args.hello_cookies)
+
+    if args.fresh_logs:
+        clear_logs()
+    # Before any worker forks or request reads a log: readers never convert legacy logs themselves
+    converted = migrate_legacy_logs(audit_log.AUDIT_LOG_DIR)
+    if converted:
+        print(f"[AUDIT] Converted {converted} legacy logs to the segment format")
+    checker = None if args.no_audit_check else start_audit_check()
+
+    if args.no_metrics:
+        metrics.METRICS_ENABLED = False
+        args.metrics_port = 0
+    if args.metrics_port and args.mode != 'prefork':
+        metrics.start_metrics_server(args.metrics_port)
+
+    try:
+        if args.mode == 'prefork':
+            try:
+                serve_prefork(args.workers, args.worker_engine, args.metrics_port)
+            finally:
+                audit_writer.close()
+                db.close()
+        elif args.mode == 'asyncio':
+            try:
+                asyncio.run(serve_asyncio())
+            except KeyboardInterrupt:
+                print("\nShutting down server...")
+            finally:
+                audit_writer.close()  # write + fsync queued audit entries
+                db.close()  # flush the ledger and write a final snapshot
+        else:
+            try:
+                serve_threaded()
+            finally:
+                audit_writer.close()
+                db.close()
+    finally:
+        if checker is not None and checker.poll() is None:
+            checker.terminate()  # read-only, safe to stop part-way
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+from record_layer import CbcHmacContext, RecordError
+
+
+# =============================
+# Session Resumption Tickets
+# After a full handshake the server hands the client an opaque ticket
+#   ticket = ENC_K_TICKET({username, MS, issued, expires, id}) || MAC_K_TICKET(...)
+# A returning client sends it back with a fresh nonce and both sides derive
+#   MS' = HMAC(MS, "resume" || nonce_c || nonce_s)
+# in one round trip, without touching K_ATM or the key store.
+# Tickets are single use: every resumption consumes its ticket (replay cache)
+# and is answered with a new one.
+# =============================
+
+
+TICKET_LIFETIME = 600          # seconds a ticket can be used to resume
+REPLAY_CACHE_SIZE = 100000     # used ticket ids remembered until they expire
+
+# Ticket keys live only in this process's memory: a restart invalidates all
+# outstanding tickets and clients fall back to the full handshake.
+# (Generated at import so pre-forked workers share them.)
+TICKET_ENC_KEY = os.urandom(32)
+TICKET_MAC_KEY = os.urandom(32)
+MAC_SIZE = 32
+
+# Seals and opens tickets with the key setup done once for the process
+_ticket_crypto = CbcHmacContext(TICKET_ENC_KEY, TICKET_MAC_KEY)
+
+
+class TicketError(Exception):
+    """
+    The ticket is forged, expired, for another user or already used.
+    """
+
+
+class ReplayCache:
+    """
+    Bounded set of used ticket ids.
+
+    Entries are kept until their ticket expires (after that the expiry check
+    rejects it anyway). If the cache is full, the oldest entry is dropped
+    and every ticket issued no later than it is refused from then on, so
+    eviction can never reopen a replay window.
+    """
+
+    def __init__(self, max_entries=REPLAY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._used = OrderedDict()     # ticket id -> (issued, expires), in insertion order
+        self._issued_floor = 0.0       # tickets issued at or before this are refused
+        self._lock = threading.Lock()
+
+    def use(self, ticket_id, issued, expires, now=None):
+        """
+        Records a ticket as used.
+
+        Returns:
+            bool: True the first time a ticket is seen, False for a replay.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if ticket_id in self._used or issued <= self._issued_floor:
+                return False
+            # Forget tickets that have expired since they were used
+            while self._used:
+                oldest_id, (_, oldest_expires) = next(iter(self._used.items()))
+                if oldest_expires > now:
+                    break
+                del self._used[oldest_id]
+            if len(self._used) >= self.max_entries:
+                _, (oldest_issued, _) = self._used.popitem(last=False)
+                self._issued_floor = max(self._issued_floor, oldest_issued)
+                if issued <= self._issued_floor:
+                    return False
+            self._used[ticket_id] = (issued, expires)
+            return True
+
+    def __len__(self):
+        return len(self._used)
+
+
+# Process-wide replay cache
+replay_cache = ReplayCache()
+
+
+def issue_ticket(username, master_secret, lifetime=TICKET_LIFETIME):
+    """
+    Seals a session's master secret into a ticket only this server can open.
+
+    Parameters:
+        username (str): The authenticated user.
+        master_secret (bytes): The session's Master Secret (MS).
+        lifetime (int): Seconds the ticket stays valid.
+
+    Returns:
+        bytes: The ticket (opaque to the client).
+    """
+    now = time.time()
+    body = json.dumps({
+        'username': username,
+        'ms': master_secret.hex(),
+        'issued': now,
+        'expires': now + lifetime,
+        'id': os.urandom(16).hex()
+    }).encode()
+    return _ticket_crypto.seal(body)
+
+
+def redeem_ticket(ticket, username):
+    """
+    Opens a ticket and consumes it.
+
+    Parameters:
+        ticket (bytes): The ticket presented by the client.
+        username (str): The user the client claims to be.
+
+    Returns:
+        bytes: The master secret stored in the ticket.
+
+    Raises:
+        TicketError: If the ticket cannot be used to resume.
+    """
+    if len(ticket) <= MAC_SIZE:
+        raise TicketError("Invalid ticket")
+    try:
+        data = json.loads(_ticket_crypto.open(ticket).decode())
+    except RecordError:
+        raise TicketError("Invalid ticket")
+    if data['username'] != username:
+        raise TicketError("Ticket belongs to another user")
+    if time.time() >= data['expires']:
+        raise TicketError("Ticket expired")
+    if not replay_cache.use(data['id'], data['issued'], data['expires']):
+        raise TicketError("Ticket already used")
+    return bytes.fromhex(data['ms'])
+
+
+def compute_resumed_master_secret(master_secret, nonce_c, nonce_s):
+    """
+    Fresh Master Secret for a resumed session: MS' = HMAC(MS, "resume" || nonce_c || nonce_s)
+    """
+    return hmac.new(master_secret, b"resume" + nonce_c + nonce_s, hashlib.sha256).digest()
+
+
+def compute_resume_proof(resumed_master_secret, transcript):
+    """
+    Server's proof that it could open the ticket (so it knows MS'), bound to
+    the resumption transcript (ClientHello + chosen suite) so neither can be altered.
+    """
+    return hmac.new(resumed_master_secret, b"server resumed" + transcript, hashlib.sha256).digest()
@@ -0,0 +1,223 @@
+import os
+import queue
+import threading
+from multiprocessing.connection import Listener, Client
+
+
+# =============================
+# Shared State Service (pre-forked server)
+# The supervisor keeps the only copy of the state that must stay consistent
+# across worker processes - the ledger, the audit writer and the ticket
+# replay cache - and serves it over a local socket. Each worker swaps its
+# own copies for the Remote* proxies below, which keep the interfaces the
+# transaction code already uses (db[username], audit_writer.submit, ...).
+# Balance read-check-write sequences stay atomic across workers because
+# the workers share the account lock stripes through a lock file
+# (see LockManager(lock_path=...)).
+# =============================
+
+
+class StateService:
+    """
+    Runs in the supervisor: accepts worker connections and answers each
+    on its own thread, so a worker blocked in wait_durable() or an audit
+    fsync never holds up the others.
+    """
+
+    def __init__(self, address, authkey, ledger, audit_writer, replay_cache):
+        """
+        Parameters:
+            address (str): Path of the Unix socket to listen on.
+            authkey (bytes): Shared secret workers must prove (inherited at fork).
+            ledger: The ledger engine (see ledger.open_ledger).
+            audit_writer (AuditWriter): The process-wide audit writer.
+            replay_cache (ReplayCache): The ticket replay cache.
+        """
+        self.ledger = ledger
+        self.audit_writer = audit_writer
+        self.replay_cache = replay_cache
+        if os.path.exists(address):
+            os.remove(address)  # stale socket from an earlier run
+        self._listener = Listener(address, family='AF_UNIX', authkey=authkey)
+        self._thread = threading.Thread(target=self._accept_loop, name='state-service', daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return  # listener closed
+            except Exception:
+                continue  # failed authentication, keep serving the others
+            threading.Thread(target=self._serve, args=(conn,), name='state-conn', daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return  # worker closed the connection or died
+                try:
+                    result = self._dispatch(op, args)
+                except Exception as e:
+                    conn.send(('error', e))
+                    continue
+                if op != 'audit' or args[1]:
+                    conn.send(('ok', result))  # fire-and-forget audit entries get no reply
+
+    def _dispatch(self, op, args):
+        if op == 'get':
+            return self.ledger[args[0]]
+        if op == 'read':
+            return self.ledger.read(args[0])
+        if op == 'set':
+            self.ledger[args[0]] = args[1]
+            return self.ledger.last_seq  # covers this write; may include a few newer ones
+        if op == 'commit':
+            return self.ledger.commit(*args)
+        if op == 'recall':
+            return self.ledger.recall(*args)
+        if op == 'wait_durable':
+            self.ledger.wait_durable(args[0])
+            return None
+        if op == 'is_durable':
+            return self.ledger.is_durable(args[0])
+        if op == 'audit':
+            self.audit_writer.submit_many(args[0], wait=args[1])
+            return None
+        if op == 'audit_flush':
+            self.audit_writer.flush(args[0])
+            return None
+        if op == 'use_ticket':
+            return self.replay_cache.use(*args)
+        raise ValueError(f"Unknown state operation: {op}")
+
+    def close(self):
+        self._listener.close()
+
+
+class StateClient:
+    """
+    Runs in a worker: a pool of connections to the supervisor so concurrent
+    sessions do not queue behind one another's round trips.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._idle = queue.LifoQueue()
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return Client(self.address, family='AF_UNIX', authkey=self.authkey)
+
+    def call(self, op, *args, reply=True):
+        """
+        Sends one operation and returns its result (re-raising errors from the supervisor).
+        """
+        conn = self._checkout()
+        try:
+            conn.send((op, args))
+            if reply:
+                status, result = conn.recv()
+        except BaseException:
+            conn.close()  # the reply may still be in flight; never reuse this connection
+            raise
+        self._idle.put(conn)
+        if reply and status == 'error':
+            raise result
+        return result if reply else None
+
+
+class RemoteLedger:
+    """
+    Ledger proxy with the dict-style interface of ledger.WALLedger.
+    last_seq and wait_durable() without a seq only track writes made by this
+    worker; wait_durable(seq) waits on the supervisor for any seq, such as
+    that of a memo another worker wrote (see recall).
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self._last_seq = 0
+        self._durable_seq = 0
+
+    def __getitem__(self, account):
+        return self._client.call('get', account)
+
+    def read(self, account):
+        return self._client.call('read', account)
+
+    def __setitem__(self, account, balance):
+        seq = self._client.call('set', account, balance)
+        with self._lock:
+            self._last_seq = max(self._last_seq, seq)
+
+    def commit(self, account, balance, request_id=None, fingerprint=None, result=None):
+        seq = self._client.call('commit', account, balance, request_id, fingerprint, result)
+        with self._lock:
+            self._last_seq = max(self._last_seq, seq)
+        return seq
+
+    def recall(self, account, request_id):
+        return self._client.call('recall', account, request_id)
+
+    @property
+    def last_seq(self):
+        return self._last_seq
+
+    def is_durable(self, seq):
+        if seq <= self._durable_seq:
+            return True
+        return self._client.call('is_durable', seq)
+
+    def wait_durable(self, seq=None):
+        if seq is None:
+            seq = self._last_seq
+        if seq <= self._durable_seq:
+            return
+        self._client.call('wait_durable', seq)
+        with self._lock:
+            self._durable_seq = max(self._durable_seq, seq)
+
+    def close(self):
+        pass  # the supervisor owns (and closes) the real ledger
+
+
+class RemoteAuditWriter:
+    """
+    Audit writer proxy: entries go to the supervisor's single writer, which
+    keeps per-user segments and indexes consistent.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def submit(self, audit_data, wait=False):
+        self.submit_many([audit_data], wait)
+
+    def submit_many(self, entries, wait=False):
+        self._client.call('audit', entries, wait, reply=wait)  # one message: the entries stay together
+
+    def flush(self, durable=False):
+        self._client.call('audit_flush', durable)
+
+    def close(self):
+        pass
+
+
+class RemoteReplayCache:
+    """
+    Replay cache proxy: a ticket consumed on any worker is refused on all of them.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def use(self, ticket_id, issued, expires, now=None):
+        return self._client.call('use_ticket', ticket_id, issued, expires, now)
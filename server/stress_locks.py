@@ -0,0 +1,123 @@
+import os
+import sys
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from wire_codec import DEPOSITED, WITHDREW, BATCH, ROLLED_BACK
+
+
+# =============================
+# Lock Manager Stress Test
+# Hammers a few hot accounts from many threads through execute_action and
+# checks that every final balance is exact. Runs inside a temporary working
+# directory so the real ledger and audit logs are never touched.
+# Usage: python server/stress_locks.py --threads 32 --ops 2000
+# =============================
+
+
+def parse_applied(result):
+    """
+    Turns one typed result into the balance change it reports (0 if nothing was applied).
+    """
+    if result['status'] == DEPOSITED:
+        return result['amount']
+    if result['status'] == WITHDREW:
+        return -result['amount']
+    return 0
+
+
+def session_worker(th, accounts, ops, seed, deltas, errors):
+    """
+    One simulated ATM session per thread, mixing deposits, withdrawals and batches.
+    """
+    rng = random.Random(seed)
+    no_audit = lambda *args: None
+    for _ in range(ops):
+        username = rng.choice(accounts)
+        kind = rng.random()
+        if kind < 0.4:
+            request = {'action': 'deposit', 'amount': rng.randint(1, 50)}
+        elif kind < 0.8:
+            request = {'action': 'withdraw', 'amount': rng.randint(1, 60)}
+        else:
+            request = {'action': 'batch', 'atomic': rng.random() < 0.5, 'operations': [
+                {'action': rng.choice(['deposit', 'withdraw']), 'amount': rng.randint(1, 80)}
+                for _ in range(rng.randint(2, 6))]}
+        result = th.execute_action(username, request, no_audit)
+        if result['status'] == ROLLED_BACK:
+            continue
+        for op_result in (result['results'] if result['status'] == BATCH else [result]):
+            deltas[username] += parse_applied(op_result)
+            if op_result.get('balance', 0) < 0:
+                errors.append(f"Negative balance reported: {op_result}")
+
+
+def transfer_worker(th, accounts, ops, seed, deltas):
+    """
+    Moves money between two accounts while holding both locks (lock_many).
+    """
+    rng = random.Random(seed)
+    for _ in range(ops):
+        src, dst = rng.sample(accounts, 2)
+        amount = rng.randint(1, 30)
+        with th.account_locks.lock_many([src, dst]):
+            if th.db[src] >= amount:
+                th.db[src] -= amount
+                th.db[dst] += amount
+                deltas[src] -= amount
+                deltas[dst] += amount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Striped account lock stress test")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--ops', type=int, default=2000, help="operations per thread")
+    args = parser.parse_args()
+
+    # Work in a scratch directory: the ledger and audit paths are relative
+    scratch = tempfile.mkdtemp(prefix='lock-stress-')
+    os.chdir(scratch)
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible to provoke races
+    import transaction_handler as th
+
+    accounts = list(th.INITIAL_ACCOUNTS)
+    initial = {name: th.db[name] for name in accounts}
+    transfer_threads = max(1, args.threads // 4)
+    deltas_per_thread = [{name: 0 for name in accounts} for _ in range(args.threads + transfer_threads)]
+    errors = []
+
+    workers = [threading.Thread(target=session_worker,
+                                args=(th, accounts, args.ops, t, deltas_per_thread[t], errors))
+               for t in range(args.threads)]
+    workers += [threading.Thread(target=transfer_worker,
+                                 args=(th, accounts, args.ops, 1000 + t, deltas_per_thread[args.threads + t]))
+                for t in range(transfer_threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    th.db.wait_durable()
+
+    # Every account must equal its opening balance plus every change that was reported applied
+    for name in accounts:
+        expected = initial[name] + sum(d[name] for d in deltas_per_thread)
+        if th.db[name] != expected:
+            errors.append(f"{name}: expected {expected}, got {th.db[name]}")
+        if th.db[name] < 0:
+            errors.append(f"{name} is negative: {th.db[name]}")
+    th.db.close()
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"{len(workers)} threads, final balances: {[(n, th.db[n]) for n in accounts]}")
+    if errors:
+        print("FAILED")
+        for e in errors[:20]:
+            print("  " + e)
+        sys.exit(1)
+    print("OK: balances exact")
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -1,10 +1,24 @@
+import os
 import json
 import time
-from utils import encrypt, decrypt, generate_mac, verify_mac
-from audit_log import log_encrypted_action
-from auth_protocol import authenticate_and_generate_master_secret
-from key_derivation import derive_keys
-from utils import get_audit_key
+import asyncio
+import threading
+import audit_log
+import metrics
+import admission
+import reaper
+from audit_log import log_encrypted_action, query_audit_log, stream_audit_log
+from auth_protocol import authenticate_and_generate_master_secret, authenticate_and_generate_master_secret_async
+from record_layer import new_record_layer
+from ledger import open_ledger
+from lock_manager import LockManager
+from idempotency import MAX_REQUEST_ID_LENGTH, request_fingerprint
+from framing import (FrameReader, send_frame, read_frame_async, write_frame_async, MAX_FRAME_SIZE,
+                     HANDSHAKE_MAX_FRAME_SIZE)
+import wire_codec
+from wire_codec import (FORMAT_JSON, REQUEST, RESPONSE, DEPOSITED, WITHDREW, BALANCE, INSUFFICIENT_FUNDS,
+                        INVALID_ACTION, INVALID_BATCH_ACTION, LOG_PAGE, NO_LOG_FILE, BATCH, ROLLED_BACK, ERROR,
+                        LOG_CHUNK)
 
 
 # =============================
@@ -13,120 +27,590 @@ from utils import get_audit_key
 # =============================
 
 
-# Simulated in-memory account storage
-db = {
+# Account storage: 'wal' keeps balances across restarts (write-ahead log +
+# snapshots under LEDGER_DIR), 'memory' is the old throwaway dict
+LEDGER_ENGINE = 'wal'
+LEDGER_DIR = 'server/ledger_data'
+
+# Opening balances for a brand-new ledger
+INITIAL_ACCOUNTS = {
     'alice': 1000,
     'bob': 500,
     'charlie': 750
 }
 
+db = open_ledger(LEDGER_ENGINE, LEDGER_DIR, initial=INITIAL_ACCOUNTS)
 
-def handle_client(conn):
+# Striped per-account locks around every balance read-check-write
+LOCK_STRIPES = 1024
+account_locks = LockManager(LOCK_STRIPES)
+# Lock file pre-forked workers share their stripes through
+LOCK_FILE = os.path.join(LEDGER_DIR, 'account.locks')
+
+
+# Ledger seq the request running on this thread has to wait for before its reply:
+# its own write, or the original write of a replayed request (see tracked_action)
+_commit = threading.local()
+
+# Upper bound on operations carried by one 'batch' request
+MAX_BATCH_SIZE = 10000
+
+# Largest amount a deposit or withdrawal may carry (balances are stored as int64)
+MAX_AMOUNT = 2 ** 63 - 1
+
+# view_log page size (entries) when the request gives no 'limit', and its cap
+VIEW_LOG_PAGE_SIZE = 100
+VIEW_LOG_MAX_PAGE_SIZE = 1000
+
+
+def open_request(record, encrypted_packet, wire_format=FORMAT_JSON):
     """
-    Handles a connected client by processing encrypted and integrity-protected
-    transactions such as deposit, withdraw, balance inquiry, and log viewing.
+    Verifies and decrypts one request packet with the session's record layer
+    (ciphertext || MAC for CBC+HMAC, ciphertext || tag for AEAD suites).
 
     Parameters:
-        conn: The socket connection to the client.
+        record: The session's record layer (see record_layer.new_record_layer).
+        encrypted_packet (bytes or memoryview): The packet received from the client.
+        wire_format (str): The session's encoding (see wire_codec).
 
     Returns:
-        None
+        dict: The decoded request.
+    """
+    # Verify the integrity of the payload and decrypt it (raises RecordError if tampered)
+    t = metrics.now()
+    decrypted_payload = record.open(encrypted_packet)
+    metrics.observe('record_open', t)
+    t = metrics.now()
+    if wire_format == FORMAT_JSON:
+        request = json.loads(decrypted_payload.decode())
+    else:
+        request = wire_codec.decode(REQUEST, decrypted_payload)[0]
+    metrics.observe('decode', t)
+    return request
+
+
+def seal_response(record, result, username, wire_format=FORMAT_JSON):
+    """
+    Encrypts and authenticates a result for the client.
+
+    Parameters:
+        record: The session's record layer.
+        result (dict): The typed result (status code + fields, see wire_codec).
+        username (str): The session's user (JSON log pages name it on every line).
+        wire_format (str): The session's encoding; JSON clients get the result as text.
+
+    Returns:
+        list: The protected response record as buffers for framing.send_frame (see seal_parts).
+    """
+    t = metrics.now()
+    if wire_format == FORMAT_JSON:
+        response = json.dumps(wire_codec.json_response(result, username)).encode()  # Serialize the result
+    else:
+        response = wire_codec.encode(RESPONSE, result)
+    sealed = record.seal_parts(response)
+    metrics.observe('seal', t)
+    return sealed
+
+
+def log_entries(entries):
+    return [{'timestamp': entry['timestamp'], 'action': entry['action']} for entry in entries]
+
+
+def seal_responses(record, result, username, wire_format=FORMAT_JSON):
     """
+    Yields the protected frames answering one request: a single frame, or for
+    a streamed view_log one independently sealed LOG_CHUNK frame per chunk,
+    decrypted from the log only as each frame is about to be sent.
+    """
+    if result['status'] != LOG_CHUNK:
+        yield seal_response(record, result, username, wire_format)
+        return
+    pending = None
+    for chunk in result['chunks']:
+        if pending is not None:
+            yield seal_response(record, {'status': LOG_CHUNK, 'entries': log_entries(pending), 'more': True},
+                                username, wire_format)
+        pending = chunk
+    yield seal_response(record, {'status': LOG_CHUNK, 'entries': log_entries(pending)}, username, wire_format)
+
+
+def replayed_result(username, request):
+    """
+    The result an earlier request with the same request_id got, marked as
+    replayed, or None for a new request (or one without an ID).
+    Call with the account lock held.
+    """
+    request_id = request.get('request_id')
+    if not request_id:
+        return None
+    memo = db.recall(username, request_id)
+    if memo is None:
+        return None
+    fingerprint, result, seq = memo
+    if fingerprint != request_fingerprint(request):
+        raise Exception("Request ID already used for a different request")
+    metrics.count('replayed:action', request['action'])
+    _commit.seq = seq  # the original write may still be in flight: the reply waits for it
+    return dict(result, replayed=True)
+
+
+def valid_amount(amount):
+    """
+    Returns:
+        bool: True for an amount the ledger can take: an int (not a bool),
+              not negative and no larger than MAX_AMOUNT.
+    """
+    return type(amount) is int and 0 <= amount <= MAX_AMOUNT
 
 
-    # Step 1: Authenticate the client and establish a shared master secret
-    username, master_secret = authenticate_and_generate_master_secret(conn)
+def commit_balance(username, balance, request, result):
+    """
+    Writes a new balance (call with the account lock held). With a request_id
+    the result is stored in the same ledger write, so a retry of the request
+    gets this result back instead of running again.
+
+    Returns:
+        int: The ledger seq of the write, recorded in the audit event.
+    """
+    request_id = request.get('request_id')
+    if request_id:
+        seq = db.commit(username, balance, request_id, request_fingerprint(request), result)
+    else:
+        seq = db.commit(username, balance)
+    _commit.seq = seq
+    return seq
 
 
-    # Step 2: Derive encryption and MAC keys from the master secret
-    k_enc, k_mac = derive_keys(master_secret)
+def execute_batch(username, request, event):
+    """
+    Runs an ordered list of deposit/withdraw/balance operations from one
+    authenticated frame. Operations are applied to a staged balance that is
+    written back once at the end; with 'atomic' set, a single failed
+    operation (insufficient funds or an unknown action) rolls back the whole batch.
 
+    Parameters:
+        username (str): The authenticated user.
+        request (dict): {'action': 'batch', 'operations': [...], 'atomic': bool}
+        event (dict): The request's audit event; the operations that took effect are added
+                      to it as 'ops', so they reach the audit log in one submission.
 
-    while True:
-        # Step 3: Receive an encrypted packet from the client
-        encrypted_packet = conn.recv(4096)
-        if not encrypted_packet:
-            break  
+    Returns:
+        dict: BATCH (or ROLLED_BACK) with one typed result per operation, in order.
+    """
+    operations = request['operations']
+    atomic = request.get('atomic', False)
+    if len(operations) > MAX_BATCH_SIZE:
+        raise Exception(f"Batch too large (max {MAX_BATCH_SIZE} operations)")
+    # Amounts are checked before anything is applied, so a bad one rejects the whole batch
+    for op in operations:
+        if op.get('action') in ('deposit', 'withdraw') and not valid_amount(op.get('amount')):
+            return {'status': ERROR, 'message': "Invalid amount in batch"}
+
+
+    # The account lock spans the read of the balance through the write-back
+    with account_locks.lock(username):
+        # A retried batch gets its original results; nothing is applied again
+        replay = replayed_result(username, request)
+        if replay is not None:
+            return replay
+
+
+        # Step 1: Apply every operation to a staged copy of the balance
+        balance = db[username]
+        results = []
+        applied = []  # events of the operations that took effect, for the audit log
+        failed = False
+        for op in operations:
+            op_action = op.get('action')
+            if op_action == 'deposit':
+                balance += op['amount']
+                results.append({'status': DEPOSITED, 'amount': op['amount'], 'balance': balance})
+                applied.append({'type': op_action, 'amount': op['amount'], 'delta': op['amount'], 'balance': balance})
+            elif op_action == 'withdraw':
+                if balance >= op['amount']:
+                    balance -= op['amount']
+                    results.append({'status': WITHDREW, 'amount': op['amount'], 'balance': balance})
+                    applied.append({'type': op_action, 'amount': op['amount'], 'delta': -op['amount'],
+                                    'balance': balance})
+                else:
+                    results.append({'status': INSUFFICIENT_FUNDS})
+                    failed = True
+            elif op_action == 'balance':
+                results.append({'status': BALANCE, 'balance': balance})
+                applied.append({'type': op_action, 'delta': 0, 'balance': balance})
+            else:
+                results.append({'status': INVALID_BATCH_ACTION})
+                failed = True
 
 
-        try:
-            # Step 4: Extract the payload and MAC from the packet
-            payload_json, mac = encrypted_packet[:-32], encrypted_packet[-32:]
+        # Step 2: All-or-nothing mode discards the staged balance on any failure
+        if atomic and failed:
+            result = {'status': ROLLED_BACK, 'results': results}
+            if request.get('request_id'):
+                commit_balance(username, db[username], request, result)  # a retry is rolled back too
+            return result
 
 
-            # Step 5: Verify the integrity of the payload using the MAC
-            if not verify_mac(k_mac, payload_json, mac):
-                raise Exception("MAC verification failed")
+        # Step 3: Commit the staged balance
+        result = {'status': BATCH, 'results': results}
+        seq = commit_balance(username, balance, request, result)
 
+    # Step 4: Audit what was applied; every operation carries the batch's one ledger write
+    event['ops'] = [dict(op_event, seq=seq) for op_event in applied]
+    return result
 
-            # Step 6: Decrypt the payload to retrieve the client's request
-            decrypted_payload = decrypt(k_enc, payload_json)
-            request = json.loads(decrypted_payload.decode())
-            action = request['action']  # Extract the requested action
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')  # Generate a timestamp
 
+def execute_action(username, request, log_action=log_encrypted_action):
+    """
+    Runs one decoded request against the account store.
 
-            # Step 7: Process the requested action
-            if action == 'deposit':
-                amount = request['amount']
-                db[username] += amount  # Update the user's balance
-                result = f"Deposited ${amount}. New balance: ${db[username]}"
-                log_encrypted_action(username, action, timestamp)  # Log the action
+    Parameters:
+        username (str): The authenticated user.
+        request (dict): The decoded request.
+        log_action (callable): Audit hook called as log_action(customer_id, action, timestamp, event),
+                               event being the typed fields of the audit entry.
 
-            elif action == 'withdraw':
-                amount = request['amount']
-                if db[username] >= amount:
-                    db[username] -= amount  # Deduct the amount from the user's balance
-                    result = f"Withdrew ${amount}. New balance: ${db[username]}"
+    Returns:
+        dict: The typed result, {'status': <wire_codec status code>, ...fields}
+              (see wire_codec.describe_result for its text form).
+    """
+    action = request['action']  # Extract the requested action
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')  # Generate a timestamp
+    request_id = request.get('request_id')
+    if request_id is not None and (not isinstance(request_id, str) or len(request_id) > MAX_REQUEST_ID_LENGTH):
+        raise Exception("Invalid request ID")
+    event = {'type': action}  # typed audit event, filled in by the branch below
+
+
+    # Process the requested action
+    # Deposits and withdrawals hold the account's lock for the whole
+    # read-check-write, so concurrent sessions cannot lose updates;
+    # a request_id seen before is answered with its original result
+    if action in ('deposit', 'withdraw') and not valid_amount(request.get('amount')):
+        # Negative, fractional or out-of-range amounts never reach the ledger
+        result = {'status': ERROR, 'message': "Invalid amount"}
+        event['type'] = 'invalid'
+
+    elif action == 'deposit':
+        amount = request['amount']
+        with account_locks.lock(username):
+            result = replayed_result(username, request)
+            if result is None:
+                balance = db[username] + amount
+                result = {'status': DEPOSITED, 'amount': amount, 'balance': balance}
+                seq = commit_balance(username, balance, request, result)  # Update the user's balance
+                event.update(amount=amount, delta=amount, balance=balance, seq=seq)
+
+    elif action == 'withdraw':
+        amount = request['amount']
+        with account_locks.lock(username):
+            result = replayed_result(username, request)
+            if result is None:
+                balance = db[username]
+                if balance >= amount:
+                    balance -= amount
+                    result = {'status': WITHDREW, 'amount': amount, 'balance': balance}
+                    seq = commit_balance(username, balance, request, result)  # Deduct the amount from the user's balance
+                    event.update(amount=amount, delta=-amount, balance=balance, seq=seq)
                 else:
-                    result = "Insufficient funds."
-                log_encrypted_action(username, action, timestamp)  # Log the action
+                    result = {'status': INSUFFICIENT_FUNDS}
+                    event.update(amount=amount, delta=0, balance=balance)
+                    if request_id:
+                        event['seq'] = commit_balance(username, balance, request, result)  # a retry cannot succeed later
 
-            elif action == 'balance':
-                result = f"Current balance: ${db[username]}"
-                log_encrypted_action(username, action, timestamp)  # Log the action
+    elif action == 'balance':
+        # Snapshot read of the committed balance: no lock, no waiting for writes in flight
+        result = {'status': BALANCE, 'balance': db.read(username)}
+        event['balance'] = result['balance']
 
 
 
 
-            elif action == 'view_log':
-                user_log_file = f"server/audit_logs/{username}.enc"  # Path to the user's log file
-                result_lines = []
-                try:
-                    # Open the log file and decrypt each entry
-                    with open(user_log_file, 'rb') as f:
-                        for line in f:
-                            try:
-                                decrypted = decrypt(get_audit_key(), line.strip())
-                                entry = json.loads(decrypted.decode())
-                                result_lines.append(f"{entry['timestamp']} - {entry['customer_id']} - {entry['action']}")
-                            except Exception:
-                                continue  # Skip invalid log entries
-                    result = "\n".join(result_lines) if result_lines else "No logs found."
-                except FileNotFoundError:
-                    result = "No log file found."
+    elif action == 'view_log' and request.get('stream'):
+        # Every entry in [since, until] before `cursor`, sent as a series of
+        # chunk frames; entries are decrypted lazily while the frames go out
+        audit_log.audit_writer.flush()
+        chunks = stream_audit_log(username, since=request.get('since'), until=request.get('until'),
+                                  cursor=request.get('cursor'))
+        result = {'status': NO_LOG_FILE} if chunks is None else {'status': LOG_CHUNK, 'chunks': chunks}
 
 
+    elif action == 'view_log':
+        # Paged through the audit index: newest `limit` entries in [since, until]
+        # before `cursor`, so cost does not depend on the length of the history
+        audit_log.audit_writer.flush()  # make entries still queued in the audit writer visible
+        limit = max(1, min(int(request.get('limit', VIEW_LOG_PAGE_SIZE)), VIEW_LOG_MAX_PAGE_SIZE))
+        entries, next_cursor = query_audit_log(username, since=request.get('since'), until=request.get('until'),
+                                               limit=limit, cursor=request.get('cursor'))
+        if entries is None:
+            result = {'status': NO_LOG_FILE}
+        else:
+            result = {'status': LOG_PAGE, 'next_cursor': next_cursor, 'entries': log_entries(entries)}
 
 
-            else:
-                result = "Invalid action."
+    elif action == 'batch':
+        result = execute_batch(username, request, event)
 
 
-            # Step 8: Log the action (for audit purposes)
-            log_encrypted_action(username, action, timestamp)
+    else:
+        result = {'status': INVALID_ACTION}
+        event['type'] = 'invalid'
 
 
-            # Step 9: Prepare the response to send back to the client
-            response = json.dumps({"result": result}).encode()  # Serialize the result
-            encrypted_response = encrypt(k_enc, response)  # Encrypt the response
-            response_mac = generate_mac(k_mac, encrypted_response)  # Generate a MAC for the response
-            conn.sendall(encrypted_response + response_mac)  # Send the encrypted response with the MAC
+    # Log the action (for audit purposes) - once per request, whatever the action
+    metrics.count('requests:action', action)
+    t = metrics.now()
+    if result.get('replayed'):
+        log_action(username, f"{action} (replayed)", timestamp, {'type': action, 'replayed': True})
+    else:
+        log_action(username, action, timestamp, event)
+    metrics.observe('audit', t)
+    return result
 
 
-        except Exception as e:
-            # Step 10: Handle errors and send an error response to the client
-            error_msg = json.dumps({"result": str(e)}).encode()  # Serialize the error message
-            encrypted_error = encrypt(k_enc, error_msg)  # Encrypt the error message
-            error_mac = generate_mac(k_mac, encrypted_error)  # Generate a MAC for the error message
-            conn.sendall(encrypted_error + error_mac)  # Send the encrypted error response with the MAC
\ No newline at end of file
+def tracked_action(username, request, log_action=log_encrypted_action):
+    """
+    execute_action that also returns the ledger seq its reply has to wait for:
+    the request's own write (or, for a replay, the original request's write),
+    not whatever other sessions wrote since.
+
+    Returns:
+        tuple: (result (dict), seq (int or None)), seq being None if the request wrote nothing.
+    """
+    _commit.seq = None
+    result = execute_action(username, request, log_action)
+    return result, _commit.seq
+
+
+def shed_result(username):
+    """
+    The BUSY result for a request over its user's rate limit, or None to admit it.
+    """
+    retry_after = admission.rate_limiter.check(username)
+    return admission.busy_result("rate limited", retry_after) if retry_after else None
+
+
+def submit_action(username, request, log_action, run=execute_action):
+    """
+    Queues an expensive request (batch, view_log) on the priority pool.
+
+    Parameters:
+        run (callable): execute_action, or tracked_action to get the request's ledger seq too.
+
+    Returns:
+        concurrent.futures.Future: What `run` returns (the typed result for execute_action).
+
+    Raises:
+        admission.Overloaded: If the pool's queue is too full for the request's class.
+    """
+    return admission.pool.submit(admission.PRIORITY[request['action']], run, username, request, log_action)
+
+
+def run_admitted(username, request, log_action=log_encrypted_action):
+    """
+    tracked_action under admission control: requests over the user's rate are
+    shed, cheap ones run on the calling thread and expensive ones wait for the
+    priority pool (or are shed when it is too busy).
+
+    Returns:
+        tuple: (result (dict), seq (int or None)) as from tracked_action.
+    """
+    result = shed_result(username)
+    if result is not None:
+        return result, None
+    if request.get('action') not in admission.POOLED_ACTIONS:
+        return tracked_action(username, request, log_action)
+    try:
+        return submit_action(username, request, log_action, run=tracked_action).result()
+    except admission.Overloaded as e:
+        return admission.busy_result(str(e), e.retry_after), None
+
+
+def process_request(username, record, encrypted_packet, log_action=log_encrypted_action, wire_format=FORMAT_JSON):
+    """
+    Verifies, decrypts and executes one request packet and returns the sealed reply.
+    Errors are reported back to the client as an encrypted result.
+
+    Returns:
+        iterator of list: The protected response frames as send_frame parts (one, or one per streamed log chunk).
+    """
+    try:
+        request = open_request(record, encrypted_packet, wire_format)
+        t = metrics.now()
+        result, seq = run_admitted(username, request, log_action)
+        metrics.observe('execute', t)
+        if seq is not None:
+            t = metrics.now()
+            db.wait_durable(seq)  # never acknowledge a balance change before it is on disk
+            metrics.observe('durable_wait', t)
+    except Exception as e:
+        # Send an encrypted error message with a MAC
+        metrics.count('errors:type', type(e).__name__)
+        result = {'status': ERROR, 'message': str(e)}
+    return seal_responses(record, result, username, wire_format)
+
+
+def handle_client(conn):
+    """
+    Handles a connected client by processing encrypted and integrity-protected
+    transactions such as deposit, withdraw, balance inquiry, and log viewing.
+
+    Parameters:
+        conn: The socket connection to the client.
+
+    Returns:
+        None
+    """
+
+
+    metrics.gauge_add('active_sessions', 1)
+    # The reaper shuts the connection down when the handshake, an idle wait,
+    # a started request or a reply send runs past its deadline
+    deadline = reaper.watch_socket(conn)
+    try:
+        # Step 1: Authenticate the client and establish a shared master secret
+        # One frame reader (receive buffer) serves the whole connection;
+        # frames are kept small until the client has authenticated
+        t = metrics.now()
+        reader = FrameReader(conn, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+        username, master_secret, suite, wire_format = authenticate_and_generate_master_secret(conn, reader)
+
+
+        # Step 2: Derive the record keys (k_enc/k_mac or AEAD keys) from the master secret
+        record = new_record_layer(suite, master_secret, is_server=True)
+        metrics.observe('handshake', t)
+        reader.on_partial = lambda: deadline.set('request', reaper.REQUEST_TIMEOUT)
+        reader.max_frame_size = MAX_FRAME_SIZE
+
+
+        while True:
+            # Step 3: Receive one complete encrypted frame from the client
+            # (a view into the connection's receive buffer, used up before the next receive)
+            deadline.set('idle', reaper.IDLE_TIMEOUT)
+            t = metrics.now()
+            encrypted_packet = reader.recv_frame_view()
+            metrics.observe('recv', t)
+            if encrypted_packet is None:
+                break
+            deadline.clear()
+
+
+            # Step 4: Verify, decrypt, execute and send back the sealed result (frame by frame)
+            for response in process_request(username, record, encrypted_packet, wire_format=wire_format):
+                deadline.set('send', reaper.REQUEST_TIMEOUT)
+                t = metrics.now()
+                send_frame(conn, *response)
+                metrics.observe('send', t)
+    except Exception as e:
+        if deadline.reaped:
+            raise reaper.SessionTimeout(f"{deadline.reason} timeout") from e
+        raise
+    finally:
+        deadline.cancel()
+        metrics.gauge_add('active_sessions', -1)
+
+
+async def handle_client_async(reader, writer):
+    """
+    Coroutine version of handle_client for the asyncio server.
+    Dispatch runs on the event loop; audit entries are queued to the
+    background audit writer without waiting. Batch and view_log run on the
+    admission priority pool; every other request (deposits and withdrawals
+    take the account lock, and in a prefork worker every ledger and audit
+    call is a round trip to the supervisor) and durability waits run in the
+    default executor, so they never block other sessions. A reply waits
+    only for its own ledger write.
+
+    Parameters:
+        reader (asyncio.StreamReader): Incoming side of the client connection.
+        writer (asyncio.StreamWriter): Outgoing side of the client connection.
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+
+    def log_in_background(customer_id, action, timestamp, event=None):
+        log_encrypted_action(customer_id, action, timestamp, event, wait=False)
+
+
+    def request_started():
+        deadline.set('request', reaper.REQUEST_TIMEOUT)
+
+
+    metrics.gauge_add('active_sessions', 1)
+    deadline = reaper.watch_transport(loop, writer.transport)
+    try:
+        # Step 1: Authenticate the client and establish a shared master secret
+        t = metrics.now()
+        username, master_secret, suite, wire_format = await authenticate_and_generate_master_secret_async(reader, writer)
+
+
+        # Step 2: Derive the record keys (k_enc/k_mac or AEAD keys) from the master secret
+        record = new_record_layer(suite, master_secret, is_server=True)
+        metrics.observe('handshake', t)
+
+
+        while True:
+            # Step 3: Receive an encrypted packet from the client
+            deadline.set('idle', reaper.IDLE_TIMEOUT)
+            t = metrics.now()
+            encrypted_packet = await read_frame_async(reader, request_started)
+            metrics.observe('recv', t)
+            if encrypted_packet is None:
+                break
+            deadline.clear()
+
+
+            # Step 4: Verify, decrypt and execute the request
+            try:
+                request = open_request(record, encrypted_packet, wire_format)
+                t = metrics.now()
+                result, seq = shed_result(username), None
+                if result is None and request.get('action') in admission.POOLED_ACTIONS:
+                    try:
+                        result, seq = await asyncio.wrap_future(
+                            submit_action(username, request, log_in_background, run=tracked_action))
+                    except admission.Overloaded as e:
+                        result = admission.busy_result(str(e), e.retry_after)
+                elif result is None:
+                    # Even a balance read blocks: on the account lock, or on a round trip to the
+                    # supervisor (db.read, audit submit) in a prefork worker
+                    result, seq = await loop.run_in_executor(None, tracked_action, username, request,
+                                                             log_in_background)
+                metrics.observe('execute', t)
+
+                # Honour the 'sync' audit policy without blocking the loop
+                t = metrics.now()
+                if audit_log.AUDIT_DURABILITY == 'sync':
+                    await loop.run_in_executor(None, audit_log.audit_writer.flush, True)
+
+                # Wait for the request's own write to be group-committed, off the loop
+                if seq is not None and not db.is_durable(seq):
+                    await loop.run_in_executor(None, db.wait_durable, seq)
+                metrics.observe('durable_wait', t)
+            except Exception as e:
+                metrics.count('errors:type', type(e).__name__)
+                result = {'status': ERROR, 'message': str(e)}
+
+
+            # Step 5: Send back the sealed result; log chunks are decrypted off the loop
+            frames = seal_responses(record, result, username, wire_format)
+            while True:
+                if result['status'] == LOG_CHUNK:
+                    response = await loop.run_in_executor(None, next, frames, None)
+                else:
+                    response = next(frames, None)
+                if response is None:
+                    break
+                deadline.set('send', reaper.REQUEST_TIMEOUT)
+                t = metrics.now()
+                await write_frame_async(writer, *response)
+                metrics.observe('send', t)
+    except Exception as e:
+        if deadline.reaped:
+            raise reaper.SessionTimeout(f"{deadline.reason} timeout") from e
+        raise
+    finally:
+        deadline.cancel()
+        metrics.gauge_add('active_sessions', -1)
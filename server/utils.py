@@ -6,6 +6,7 @@ from base64 import b64encode, b64decode
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
+from key_store import key_store
 
 # =============================
 # Utilities for Encryption, MAC, Nonces, Key Management
@@ -65,10 +66,8 @@ def verify_mac(mac_key, data, received_mac):
 #     return bytes.fromhex(key_store[username])
 
 def load_user_key(username):
-    with open('server/user_keys.json', 'r') as f:
-        key_store = json.load(f)
-        print(f"Loaded key store: {key_store}")  # Debugging line
-    key_bytes = bytes.fromhex(key_store[username])
+    # Cached, hot-reloaded lookup (see key_store.py) instead of re-reading the file per handshake
+    key_bytes = key_store.get(username)
     if len(key_bytes) != 32:
         raise ValueError(f"Invalid key length ({len(key_bytes)} bytes) for user {username}. Must be 32.")
     return key_bytes
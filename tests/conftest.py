@@ -0,0 +1,92 @@
+import os
+import sys
+import errno
+import tempfile
+import pytest
+
+
+# =============================
+# Test Setup
+# The server modules import each other by bare name, as when run from
+# server/, so that directory goes first on the path. They also keep their
+# data under paths relative to the working directory (server/ledger_data,
+# server/audit_logs, server/user_keys.json), opened at import, so the tests
+# run from a scratch directory and never touch a real ledger or audit log.
+# Run from the repository root: python -m pytest -q
+# =============================
+
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+CLIENT_DIR = os.path.join(os.path.dirname(SERVER_DIR), 'client')
+sys.path.insert(0, SERVER_DIR)
+os.chdir(tempfile.mkdtemp(prefix='bank-tests-'))
+
+
+@pytest.fixture
+def client_modules():
+    """
+    Imports by bare name find the client's modules (several share their names
+    with server modules) until the test ends; the server's are put back after.
+    """
+    names = {name[:-3] for name in os.listdir(CLIENT_DIR) if name.endswith('.py')}
+    saved = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+    sys.path.insert(0, CLIENT_DIR)
+    yield
+    sys.path.remove(CLIENT_DIR)
+    for name in names:
+        sys.modules.pop(name, None)
+    sys.modules.update(saved)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    An in-memory ledger with alice at 1000, installed as the handler's ledger.
+    """
+    import transaction_handler
+    from ledger import MemoryLedger
+    ledger = MemoryLedger({'alice': 1000})
+    monkeypatch.setattr(transaction_handler, 'db', ledger)
+    return ledger
+
+
+@pytest.fixture
+def audit():
+    """
+    (events, log_action): a log_action stand-in that records (action, event) instead of writing a log.
+    """
+    events = []
+    return events, lambda customer_id, action, timestamp, event=None: events.append((action, event))
+
+
+@pytest.fixture
+def no_audit():
+    """
+    A log_action stand-in that logs nothing.
+    """
+    return lambda customer_id, action, timestamp, event=None: None
+
+
+class FullDisk:
+    """
+    Stands in for a ledger's WAL file: every write fails like a full disk.
+    """
+
+    def write(self, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def full_disk_ledger(tmp_path):
+    """
+    A WALLedger with alice at 1000 whose WAL writes fail from now on.
+    """
+    from ledger import WALLedger
+    ledger = WALLedger(str(tmp_path / 'ledger'), initial={'alice': 1000})
+    ledger._wal.close()
+    ledger._wal = FullDisk()
+    yield ledger
+    ledger.close()
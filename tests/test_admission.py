@@ -0,0 +1,69 @@
+import socket
+import threading
+import pytest
+import admission
+import transaction_handler
+import wire_codec
+from admission import SessionLimiter, RateLimiter, PriorityPool, Overloaded, Rejector
+from framing import FrameReader
+from wire_codec import BUSY, BALANCE
+
+
+def test_session_limit():
+    sessions = SessionLimiter(max_sessions=2)
+    assert sessions.try_enter() and sessions.try_enter()
+    assert not sessions.try_enter()
+    sessions.leave()
+    assert sessions.try_enter()
+
+
+def test_rate_limit_allows_bursts_then_refills():
+    limiter = RateLimiter(rate=10, burst=3)
+    assert [limiter.check('alice', now=100) for _ in range(3)] == [0, 0, 0]
+    assert limiter.check('alice', now=100) == pytest.approx(0.1)
+    assert limiter.check('bob', now=100) == 0   # buckets are per user
+    assert limiter.check('alice', now=100.11) == 0
+    assert RateLimiter(rate=0).check('alice') == 0
+
+
+def test_pool_serves_lower_classes_first_and_sheds_by_class():
+    pool = PriorityPool(workers=1, max_queue=4, shed_at={3: 0.5})
+    started, release, order = threading.Event(), threading.Event(), []
+    blocker = pool.submit(0, lambda: started.set() or release.wait())
+    started.wait()   # the only worker is busy from now on
+
+    futures = [pool.submit(2, order.append, 'batch'), pool.submit(3, order.append, 'view_log')]
+    with pytest.raises(Overloaded):
+        pool.submit(3, order.append, 'view_log')   # class 3 may only fill half the queue
+    futures += [pool.submit(0, order.append, 'balance'), pool.submit(2, order.append, 'batch 2')]
+    with pytest.raises(Overloaded):
+        pool.submit(0, order.append, 'balance')    # the queue is full
+    release.set()
+    for future in [blocker] + futures:
+        future.result(5)
+    assert order == ['balance', 'batch', 'batch 2', 'view_log']
+
+
+def test_requests_over_the_rate_or_the_pool_are_answered_busy(db, no_audit, monkeypatch):
+    monkeypatch.setattr(admission, 'rate_limiter', RateLimiter(rate=1, burst=1))
+    assert transaction_handler.run_admitted('alice', {'action': 'balance'}, no_audit)[0]['status'] == BALANCE
+    result, seq = transaction_handler.run_admitted('alice', {'action': 'balance'}, no_audit)
+    assert result['status'] == BUSY and result['retry_after'] > 0 and seq is None
+
+    monkeypatch.setattr(admission, 'rate_limiter', RateLimiter(rate=0))
+    monkeypatch.setattr(admission, 'pool', PriorityPool(workers=1, max_queue=0))
+    result, _ = transaction_handler.run_admitted('alice', {'action': 'view_log'}, no_audit)
+    assert result == {'status': BUSY, 'message': "request queue full",
+                      'retry_after': int(admission.BUSY_RETRY_AFTER * 1000)}
+
+
+def test_refused_connection_gets_server_busy():
+    client, server = socket.socketpair()
+    client.sendall(b'client hello')   # read and dropped, so the close does not reset the connection
+    Rejector().reject(server)
+    client.settimeout(5)
+    frame = FrameReader(client).recv_frame()
+    assert wire_codec.busy_message(frame) == {'reason': "too many sessions",
+                                              'retry_after': int(admission.BUSY_RETRY_AFTER * 1000)}
+    assert client.recv(1) == b''
+    client.close()
@@ -0,0 +1,124 @@
+import time
+import pytest
+import audit_log
+import audit_store
+import transaction_handler
+from audit_log import AuditWriter, log_encrypted_action, query_audit_log
+import wire_codec
+from record_layer import new_record_layer, SUITE_AES_GCM
+from wire_codec import LOG_PAGE, LOG_CHUNK, NO_LOG_FILE, RESPONSE, FORMAT_BINARY
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    log_dir = str(tmp_path / 'audit')
+    writer = AuditWriter(log_dir=log_dir)
+    monkeypatch.setattr(audit_log, 'audit_writer', writer)
+    monkeypatch.setattr(audit_log, 'AUDIT_LOG_DIR', log_dir)
+    yield writer
+    writer.close()
+
+
+def test_batch_is_logged_in_one_submission_with_one_wait(db, writer, monkeypatch):
+    monkeypatch.setattr(audit_log, 'AUDIT_DURABILITY', 'sync')
+    submissions = []
+    submit_many = writer.submit_many
+    monkeypatch.setattr(writer, 'submit_many',
+                        lambda entries, wait=False: submissions.append((len(entries), wait)) or submit_many(entries, wait))
+
+    operations = [{'action': 'deposit', 'amount': 1}] * 500 + [{'action': 'withdraw', 'amount': 100}]
+    transaction_handler.execute_action('alice', {'action': 'batch', 'operations': operations}, log_encrypted_action)
+    assert submissions == [(502, True)]
+
+    entries, _ = query_audit_log('alice', limit=1000)
+    assert [e['type'] for e in entries] == ['deposit'] * 500 + ['withdraw', 'batch']
+    assert 'ops' not in entries[-1]
+    assert len({e['seq'] for e in entries[:-1]}) == 1   # the batch's one ledger write
+    assert entries[-2]['balance'] == 1400 and entries[-2]['delta'] == -100
+
+
+def test_single_action_entry(writer):
+    log_encrypted_action('bob', 'deposit', '2026-01-01 00:00:00', {'amount': 5, 'delta': 5, 'balance': 505, 'seq': 3})
+    writer.flush()
+    (entry,), _ = query_audit_log('bob')
+    assert entry == {'customer_id': 'bob', 'action': 'deposit', 'timestamp': '2026-01-01 00:00:00',
+                     'v': audit_log.EVENT_VERSION, 'type': 'deposit', 'amount': 5, 'delta': 5, 'balance': 505,
+                     'seq': 3}
+
+
+def test_entries_of_many_requests_share_one_fsync_per_user(tmp_path, monkeypatch):
+    fsyncs = []
+    fsync = audit_store.UserAuditLog.fsync
+    monkeypatch.setattr(audit_store.UserAuditLog, 'fsync', lambda f: fsyncs.append(f.customer_id) or fsync(f))
+    writer = AuditWriter(log_dir=str(tmp_path / 'audit'), durability_window=60)
+    now = time.strftime('%Y-%m-%d %H:%M:%S')   # a fresh segment: no rotation
+    try:
+        for n in range(300):
+            writer.submit({'customer_id': ('alice', 'bob', 'carol')[n % 3], 'n': n, 'timestamp': now})
+        writer.flush()
+        assert fsyncs == []   # written, but the group fsync is not due yet
+        writer.flush(durable=True)
+        assert sorted(fsyncs) == ['alice', 'bob', 'carol']
+    finally:
+        writer.close()
+
+
+def test_waiting_submit_returns_once_fsynced(writer, monkeypatch):
+    calls = []
+    fsync = audit_store.UserAuditLog.fsync
+    monkeypatch.setattr(audit_store.UserAuditLog, 'fsync', lambda f: calls.append('fsync') or fsync(f))
+    writer.submit({'customer_id': 'alice', 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')}, wait=True)
+    calls.append('returned')
+    assert calls == ['fsync', 'returned']
+
+
+def test_view_log_pages_back_through_a_time_range(writer, no_audit):
+    start = time.time() - 3600
+    stamps = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start + 60 * n)) for n in range(25)]
+    for n, stamp in enumerate(stamps):
+        log_encrypted_action('alice', f'deposit {n}', stamp)
+
+    def view_log(**request):
+        return transaction_handler.execute_action('alice', dict(request, action='view_log'), no_audit)
+
+    pages, cursor = [], None
+    while True:
+        result = view_log(limit=10, cursor=cursor)
+        assert result['status'] == LOG_PAGE
+        pages.append([entry['action'] for entry in result['entries']])
+        cursor = result['next_cursor']
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [10, 10, 5]   # newest first, each page oldest first
+    assert [action for page in reversed(pages) for action in page] == [f'deposit {n}' for n in range(25)]
+
+    result = view_log(since=stamps[5], until=stamps[8])
+    assert [entry['timestamp'] for entry in result['entries']] == stamps[5:9]
+    assert view_log(since=stamps[-1], until=stamps[0])['entries'] == []
+    assert transaction_handler.execute_action('nobody', {'action': 'view_log'}, no_audit) == {'status': NO_LOG_FILE}
+
+
+def test_streamed_view_log_is_sent_chunk_by_chunk(writer, no_audit):
+    size = audit_log.AUDIT_STREAM_CHUNK
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    for n in range(2 * size + 50):
+        log_encrypted_action('alice', f'deposit {n}', now)
+
+    def stream(**request):
+        result = transaction_handler.execute_action('alice', dict(request, action='view_log', stream=True), no_audit)
+        server = new_record_layer(SUITE_AES_GCM, bytes(32), is_server=True)
+        client = new_record_layer(SUITE_AES_GCM, bytes(32), is_server=False)
+        frames = transaction_handler.seal_responses(server, result, 'alice', FORMAT_BINARY)
+        return result, frames, lambda frame: wire_codec.decode(RESPONSE, client.open(b''.join(frame)))[0]
+
+    result, frames, open_frame = stream()
+    assert result['status'] == LOG_CHUNK
+    first = open_frame(next(frames))
+    log_encrypted_action('alice', 'late deposit', now)   # after the request: not part of its answer
+    chunks = [first] + [open_frame(frame) for frame in frames]
+    assert [(len(chunk['entries']), chunk.get('more')) for chunk in chunks] == [(size, True), (size, True), (50, None)]
+    actions = [entry['action'] for chunk in chunks for entry in chunk['entries']]
+    assert actions == [f'deposit {n}' for n in range(2 * size + 50)]
+
+    _, frames, open_frame = stream(since='2000-01-01 00:00:00', until='2000-01-02 00:00:00')
+    assert [open_frame(frame)['entries'] for frame in frames] == [[]]
@@ -0,0 +1,99 @@
+import os
+import json
+import pytest
+from utils import encrypt, get_audit_key
+from audit_store import (UserAuditLog, AuditLogReader, compact_segment, load_manifest, pending_sealing,
+                         data_path, manifest_path, migrate_legacy_logs)
+
+
+def timestamp(n):
+    return f"2026-01-01 00:{n // 60 % 60:02d}:{n % 60:02d}"
+
+
+def append(log, start, stop):
+    log.append_many([(encrypt(get_audit_key(), json.dumps({'n': n}).encode()), timestamp(n))
+                     for n in range(start, stop)])
+    log.fsync()
+
+
+def read_all(log_dir, customer_id):
+    with AuditLogReader(log_dir, customer_id) as reader:
+        return [entry['n'] for entry in reader.entries(0, len(reader))]
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    return str(tmp_path)
+
+
+def test_rotation_and_compaction_keep_one_numbered_history(log_dir):
+    log = UserAuditLog(log_dir, 'alice')
+    append(log, 0, 600)
+    first = log.rotate()
+    append(log, 600, 610)
+    assert read_all(log_dir, 'alice') == list(range(610))   # sealing pair + active segment
+
+    before, after = compact_segment(log_dir, 'alice', first, block_entries=100)
+    assert after < before
+    assert pending_sealing(log_dir, 'alice') == []
+    assert [(s['first_entry'], s['count']) for s in load_manifest(log_dir, 'alice')] == [(0, 600)]
+    assert read_all(log_dir, 'alice') == list(range(610))
+
+    # Compacting again (as after a crash before the clean-up) changes nothing
+    compact_segment(log_dir, 'alice', first, block_entries=100)
+    assert read_all(log_dir, 'alice') == list(range(610))
+    log.close()
+
+    # A reopened writer continues the numbering after the sealed entries
+    log = UserAuditLog(log_dir, 'alice')
+    assert (log.base, log.count) == (600, 10)
+    append(log, 610, 615)
+    log.close()
+    assert read_all(log_dir, 'alice') == list(range(615))
+
+
+def test_timestamp_search_and_pages_across_segments(log_dir):
+    log = UserAuditLog(log_dir, 'alice')
+    append(log, 0, 300)
+    compact_segment(log_dir, 'alice', log.rotate(), block_entries=64)
+    append(log, 300, 400)
+    log.close()
+
+    with AuditLogReader(log_dir, 'alice') as reader:
+        assert reader.bisect(timestamp(250)) == 250
+        assert reader.bisect(timestamp(250), after=True) == 251
+        assert reader.span(since=timestamp(280), until=timestamp(320)) == (280, 321)
+        entries, cursor = reader.page(since=timestamp(280), until=timestamp(320), limit=30)
+        assert [e['n'] for e in entries] == list(range(291, 321)) and cursor == 291
+        entries, cursor = reader.page(since=timestamp(280), until=timestamp(320), limit=30, cursor=cursor)
+        assert [e['n'] for e in entries] == list(range(280, 291)) and cursor is None
+
+
+def test_torn_tail_is_dropped_on_reopen(log_dir):
+    log = UserAuditLog(log_dir, 'alice')
+    append(log, 0, 5)
+    log.close()
+    with open(data_path(log_dir, 'alice'), 'ab') as f:
+        f.write(b'\x00\x00\x01\x00torn record')
+
+    log = UserAuditLog(log_dir, 'alice')
+    assert log.count == 5
+    append(log, 5, 7)
+    log.close()
+    assert read_all(log_dir, 'alice') == list(range(7))
+    assert not os.path.exists(manifest_path(log_dir, 'alice'))
+
+
+def test_legacy_logs_are_converted_at_start_up_and_never_by_readers(log_dir):
+    with open(data_path(log_dir, 'alice'), 'wb') as f:   # the original one-line-per-entry format
+        for n in range(3):
+            f.write(encrypt(get_audit_key(), json.dumps({'n': n, 'timestamp': timestamp(n)}).encode()) + b'\n')
+    before = os.stat(data_path(log_dir, 'alice'))
+
+    with pytest.raises(ValueError, match="legacy format"):
+        AuditLogReader(log_dir, 'alice')
+    assert os.stat(data_path(log_dir, 'alice')) == before
+
+    assert migrate_legacy_logs(log_dir) == 1
+    assert read_all(log_dir, 'alice') == [0, 1, 2]
+    assert migrate_legacy_logs(log_dir) == 0
@@ -0,0 +1,59 @@
+import io
+import os
+import json
+import audit_tool
+from utils import encrypt, get_audit_key
+from audit_store import UserAuditLog, compact_segment, data_path
+
+
+def timestamp(n):
+    return f"2026-01-01 00:{n // 60 % 60:02d}:{n % 60:02d}"
+
+
+def entry(customer_id, n):
+    return encrypt(get_audit_key(), json.dumps({'customer_id': customer_id, 'action': f'deposit {n}',
+                                                'timestamp': timestamp(n)}).encode())
+
+
+def write_log(log_dir, customer_id, sealed, active):
+    log = UserAuditLog(log_dir, customer_id)
+    log.append_many([(entry(customer_id, n), timestamp(n)) for n in range(sealed)])
+    compact_segment(log_dir, customer_id, log.rotate(), block_entries=16)
+    log.append_many([(entry(customer_id, n), timestamp(n)) for n in range(sealed, sealed + active)])
+    log.close()
+
+
+def test_every_entry_is_verified_and_exported_in_log_order(tmp_path, monkeypatch):
+    log_dir = str(tmp_path)
+    monkeypatch.setattr(audit_tool, 'TASK_ENTRIES', 40)   # several tasks per segment
+    write_log(log_dir, 'alice', 100, 30)
+    write_log(log_dir, 'bob', 50, 5)
+    with open(data_path(log_dir, 'carol'), 'wb') as f:    # legacy format: checked as it is
+        f.write(b''.join(entry('carol', n) + b'\n' for n in range(3)))
+    legacy = os.stat(data_path(log_dir, 'carol'))
+
+    export = io.StringIO()
+    assert audit_tool.run(log_dir, processes=2, export=export, quiet=True) == (188, 0)
+    rows = [json.loads(line) for line in export.getvalue().splitlines()]
+    expected = [(user, n) for user, count in (('alice', 130), ('bob', 55), ('carol', 3)) for n in range(count)]
+    assert [(row['customer_id'], row['entry']) for row in rows] == expected
+    assert rows[0] == {'customer_id': 'alice', 'entry': 0, 'timestamp': timestamp(0), 'action': 'deposit 0'}
+    assert os.stat(data_path(log_dir, 'carol')) == legacy
+
+
+def test_corrupt_entries_are_reported_and_skipped(tmp_path):
+    log_dir = str(tmp_path)
+    write_log(log_dir, 'alice', 20, 5)
+    with open(data_path(log_dir, 'alice'), 'r+b') as f:
+        f.seek(-5, os.SEEK_END)   # inside the last entry
+        byte = f.read(1)
+        f.seek(-5, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 1]))
+
+    export, report = io.StringIO(), io.StringIO()
+    assert audit_tool.run(log_dir, processes=1, export=export, export_format='csv', report=report,
+                          quiet=True) == (25, 1)
+    (problem,) = [json.loads(line) for line in report.getvalue().splitlines()]
+    assert problem['customer_id'] == 'alice' and problem['entry'] == 24
+    lines = export.getvalue().splitlines()
+    assert lines[0] == ','.join(audit_tool.EXPORT_FIELDS) and len(lines) == 1 + 24
@@ -0,0 +1,108 @@
+import os
+import socket
+import threading
+import pytest
+from framing import (FrameReader, FrameError, send_frame, encode_frame, HEADER, RECV_BUFFER_SIZE, RECV_CHUNK, MAX_FRAME_SIZE,
+                     HANDSHAKE_MAX_FRAME_SIZE, GATHER_MIN_SIZE)
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_frames_split_anywhere_or_sent_together():
+    stream = b''.join(encode_frame(p) for p in (b'one', b'', b'three' * 1000))
+    reader = FrameReader()
+    frames = []
+    for i in range(len(stream)):
+        reader.feed(stream[i:i + 1])
+        frame = reader.next_frame()
+        if frame is not None:
+            frames.append(frame)
+    assert frames == [b'one', b'', b'three' * 1000]
+
+    reader.feed(stream)
+    assert [reader.next_frame() for _ in range(4)] == [b'one', b'', b'three' * 1000, None]
+
+
+def test_close_between_frames_or_mid_frame(pair):
+    a, b = pair
+    a.sendall(encode_frame(b'last') + encode_frame(b'cut')[:-1])
+    a.close()
+    reader = FrameReader(b)
+    assert reader.recv_frame() == b'last'
+    with pytest.raises(FrameError):
+        reader.recv_frame()
+
+    c, d = socket.socketpair()
+    c.close()
+    assert FrameReader(d).recv_frame() is None
+    d.close()
+
+
+def test_declared_length_does_not_size_the_buffer(pair):
+    a, b = pair
+    reader = FrameReader(b)
+    b.settimeout(0.5)
+    a.sendall(HEADER.pack(MAX_FRAME_SIZE) + b'x')
+    with pytest.raises(socket.timeout):
+        reader.recv_frame_view()
+    assert len(reader.buffer) <= RECV_BUFFER_SIZE + RECV_CHUNK
+
+
+def test_handshake_limit(pair):
+    a, b = pair
+    reader = FrameReader(b, max_frame_size=HANDSHAKE_MAX_FRAME_SIZE)
+    a.sendall(HEADER.pack(HANDSHAKE_MAX_FRAME_SIZE + 1))
+    with pytest.raises(FrameError):
+        reader.recv_frame()
+
+
+def test_large_frames_arrive_intact_and_the_buffer_shrinks_back(pair):
+    a, b = pair
+    payloads = [os.urandom(5 * 1024 * 1024), b'small', os.urandom(100000)]
+    sender = threading.Thread(target=lambda: [send_frame(a, p[:7], p[7:]) for p in payloads])
+    sender.start()
+    reader = FrameReader(b)
+    received = [reader.recv_frame() for _ in payloads]
+    sender.join()
+    assert received == payloads
+    assert len(reader.buffer) == RECV_BUFFER_SIZE
+
+
+class TrickleSocket:
+    """
+    Takes at most 7 bytes per sendmsg call, like a socket whose send buffer is full.
+    """
+
+    def __init__(self):
+        self.sent = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(bytes(b) for b in buffers)[:7]
+        self.sent += data
+        return len(data)
+
+
+def test_gathered_send_resumes_after_partial_sends():
+    parts = [os.urandom(10), os.urandom(GATHER_MIN_SIZE), b'', os.urandom(33)]
+    sock = TrickleSocket()
+    send_frame(sock, *parts)
+    assert bytes(sock.sent) == encode_frame(b''.join(parts))
+    assert sock.calls == -(-len(sock.sent) // 7)
+
+
+def test_frames_are_views_into_the_receive_buffer(pair):
+    a, b = pair
+    a.sendall(encode_frame(b'first') + encode_frame(b'second'))
+    reader = FrameReader(b)
+    first = reader.recv_frame_view()
+    assert isinstance(first, memoryview) and first.obj is reader.buffer and bytes(first) == b'first'
+    second = reader.recv_frame_view()   # from the same receive, without another recv
+    assert second.obj is reader.buffer and bytes(second) == b'second'
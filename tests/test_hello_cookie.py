@@ -0,0 +1,48 @@
+import pytest
+import hello_cookie
+from hello_cookie import (make_cookie, check_cookie, challenge, require, peer_address, CookieError, COOKIE_SIZE)
+from wire_codec import cookie_message
+
+
+NOW = 1_800_000_000
+
+
+def test_cookie_is_bound_to_address_and_username():
+    cookie = make_cookie('10.0.0.1', 'alice', now=NOW)
+    assert len(cookie) == COOKIE_SIZE
+    assert check_cookie(cookie, '10.0.0.1', 'alice', now=NOW + 1)
+    assert not check_cookie(cookie, '10.0.0.2', 'alice', now=NOW + 1)
+    assert not check_cookie(cookie, '10.0.0.1', 'bob', now=NOW + 1)
+
+
+def test_cookie_lifetime():
+    cookie = make_cookie('10.0.0.1', 'alice', now=NOW)
+    assert check_cookie(cookie, '10.0.0.1', 'alice', now=NOW + hello_cookie.COOKIE_LIFETIME)
+    assert not check_cookie(cookie, '10.0.0.1', 'alice', now=NOW + hello_cookie.COOKIE_LIFETIME + 1)
+    assert not check_cookie(cookie, '10.0.0.1', 'alice', now=NOW - 1)   # issued in the future
+
+
+def test_forged_cookies_are_refused():
+    cookie = make_cookie('10.0.0.1', 'alice', now=NOW)
+    later = (NOW + 100).to_bytes(4, 'big') + cookie[4:]   # moving the issue time breaks the MAC
+    tampered = cookie[:-1] + bytes([cookie[-1] ^ 1])
+    for bad in (later, tampered, cookie[:-1], cookie + b'\0', b'', None):
+        assert not check_cookie(bad, '10.0.0.1', 'alice', now=NOW + 200)
+
+
+def test_challenge_then_require():
+    frame = challenge('10.0.0.1', 'alice', None)
+    cookie = cookie_message(frame)
+    assert check_cookie(cookie, '10.0.0.1', 'alice')
+    assert challenge('10.0.0.1', 'alice', cookie) is None   # a kept cookie skips the extra round trip
+    require('10.0.0.1', 'alice', cookie)
+    with pytest.raises(CookieError):
+        require('10.0.0.9', 'alice', cookie)
+    with pytest.raises(CookieError):
+        require('10.0.0.1', 'alice', None)
+
+
+def test_peer_address_drops_the_port():
+    assert peer_address(('10.0.0.1', 5000)) == peer_address(('10.0.0.1', 5001)) == '10.0.0.1'
+    assert peer_address(('::1', 5000, 0, 0)) == '::1'
+    assert peer_address('/tmp/bank.sock') == '/tmp/bank.sock'
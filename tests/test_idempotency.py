@@ -0,0 +1,74 @@
+import pytest
+import transaction_handler
+from ledger import WALLedger
+from idempotency import IdempotencyCache, request_fingerprint
+from wire_codec import DEPOSITED, INSUFFICIENT_FUNDS, BATCH
+
+
+def test_cache_expiry_and_per_account_cap():
+    cache = IdempotencyCache(ttl=10, max_per_account=2)
+    cache.remember('alice', 'a', 'fp-a', {'n': 1}, now=100)
+    cache.remember('alice', 'b', 'fp-b', {'n': 2}, now=101)
+    cache.remember('alice', 'c', 'fp-c', {'n': 3}, now=102, seq=7)
+    cache.remember('bob', 'a', 'fp-x', {'n': 4}, now=102)
+    assert cache.recall('alice', 'a', now=103) is None   # over the cap: oldest dropped
+    assert cache.recall('alice', 'c', now=103) == ('fp-c', {'n': 3}, 7)
+    assert cache.recall('bob', 'a', now=103) == ('fp-x', {'n': 4}, 0)   # IDs are per account
+    assert cache.recall('alice', 'b', now=111) is None   # expired
+    assert [entry[:2] for entry in cache.entries(now=111.5)] == [['alice', 'c'], ['bob', 'a']]
+
+
+def test_fingerprint_ignores_missing_atomic_flag():
+    request = {'action': 'batch', 'operations': [{'action': 'deposit', 'amount': 5}]}
+    assert request_fingerprint(request) == request_fingerprint(dict(request, atomic=False))
+    assert request_fingerprint(request) != request_fingerprint(dict(request, atomic=True))
+
+
+def test_retried_deposit_is_applied_once(db, no_audit):
+    request = {'action': 'deposit', 'amount': 100, 'request_id': 'r1'}
+    first = transaction_handler.execute_action('alice', request, no_audit)
+    retry = transaction_handler.execute_action('alice', dict(request), no_audit)
+    assert first == {'status': DEPOSITED, 'amount': 100, 'balance': 1100}
+    assert retry == dict(first, replayed=True)
+    assert db['alice'] == 1100
+
+
+def test_refused_withdrawal_stays_refused(db, no_audit):
+    request = {'action': 'withdraw', 'amount': 5000, 'request_id': 'r2'}
+    assert transaction_handler.execute_action('alice', request, no_audit)['status'] == INSUFFICIENT_FUNDS
+    transaction_handler.execute_action('alice', {'action': 'deposit', 'amount': 10000}, no_audit)
+    retry = transaction_handler.execute_action('alice', dict(request), no_audit)
+    assert retry['status'] == INSUFFICIENT_FUNDS and retry['replayed']
+    assert db['alice'] == 11000
+
+
+def test_retried_batch_is_applied_once(db, no_audit):
+    request = {'action': 'batch', 'request_id': 'r3', 'operations': [{'action': 'deposit', 'amount': 7}]}
+    assert transaction_handler.execute_action('alice', request, no_audit)['status'] == BATCH
+    assert transaction_handler.execute_action('alice', dict(request), no_audit)['replayed']
+    assert db['alice'] == 1007
+
+
+def test_reused_request_id_for_another_request_is_refused(db, no_audit):
+    transaction_handler.execute_action('alice', {'action': 'deposit', 'amount': 1, 'request_id': 'r4'}, no_audit)
+    with pytest.raises(Exception, match="Request ID already used"):
+        transaction_handler.execute_action('alice', {'action': 'deposit', 'amount': 2, 'request_id': 'r4'}, no_audit)
+    assert db['alice'] == 1001
+
+
+def test_memos_survive_a_restart(tmp_path, monkeypatch, no_audit):
+    data_dir = str(tmp_path / 'ledger')
+    request = {'action': 'deposit', 'amount': 100, 'request_id': 'r5'}
+    ledger = WALLedger(data_dir, initial={'alice': 1000})
+    monkeypatch.setattr(transaction_handler, 'db', ledger)
+    first = transaction_handler.execute_action('alice', request, no_audit)
+    ledger.wait_durable()
+    ledger.close(snapshot=False)   # memo only in the WAL
+
+    ledger = WALLedger(data_dir)
+    monkeypatch.setattr(transaction_handler, 'db', ledger)
+    try:
+        assert transaction_handler.execute_action('alice', dict(request), no_audit) == dict(first, replayed=True)
+        assert ledger['alice'] == 1100
+    finally:
+        ledger.close()
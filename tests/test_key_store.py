@@ -0,0 +1,42 @@
+import os
+import json
+import pytest
+from key_store import KeyStore, write_binary_key_store
+
+
+def write_json(path, keys):
+    with open(path, 'w') as f:
+        json.dump({name: key.hex() for name, key in keys.items()}, f)
+
+
+def test_changed_file_is_reloaded(tmp_path):
+    path = str(tmp_path / 'keys')
+    write_json(path, {'alice': b'a' * 32})
+    store = KeyStore(path, check_interval=0)
+    assert store.get('alice') == b'a' * 32
+
+    write_binary_key_store({'alice': b'A' * 32, 'bob': b'b' * 32}, path)
+    assert store.get('alice') == b'A' * 32 and len(store) == 2
+    with pytest.raises(KeyError):
+        store.get('carol')
+
+
+def test_missing_or_broken_file_keeps_the_old_keys(tmp_path):
+    path = str(tmp_path / 'keys')
+    write_json(path, {'alice': b'a' * 32})
+    store = KeyStore(path, check_interval=0)
+    assert store.get('alice') == b'a' * 32
+
+    os.remove(path)   # e.g. between the unlink and the rename of a non-atomic replace
+    assert store.get('alice') == b'a' * 32
+    with open(path, 'w') as f:
+        f.write('{"alice": ')
+    assert store.get('alice') == b'a' * 32
+
+    write_json(path, {'alice': b'n' * 32})
+    assert store.get('alice') == b'n' * 32
+
+
+def test_first_load_of_a_missing_file_fails(tmp_path):
+    with pytest.raises(OSError):
+        KeyStore(str(tmp_path / 'missing')).get('alice')
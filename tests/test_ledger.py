@@ -0,0 +1,184 @@
+import os
+import sys
+import struct
+import pytest
+from array import array
+from ledger import WALLedger, LedgerError, SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1, SNAPSHOT_HEADER_V1
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    db = WALLedger(str(tmp_path / 'ledger'), initial={'alice': 1000})
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('balance', [1000.5, 2 ** 63, -2 ** 63 - 1])
+def test_unloggable_balance_changes_nothing(ledger, balance):
+    seq = ledger.last_seq
+    with pytest.raises(struct.error):
+        ledger.commit('alice', balance)
+    with pytest.raises(struct.error):
+        ledger.commit('alice', balance, 'req-1', 'fp', {'status': 1})
+    assert ledger.last_seq == seq
+    assert ledger['alice'] == 1000
+    assert ledger.recall('alice', 'req-1') is None
+
+    # The account keeps working and the ledger still closes with a snapshot
+    ledger.wait_durable(ledger.commit('alice', 1001))
+    assert ledger.read('alice') == 1001
+
+
+def wal_segments(data_dir):
+    return sorted(p for p in os.listdir(data_dir) if p.startswith('wal-'))
+
+
+def test_recovery_replays_the_wal_and_cuts_a_torn_tail(tmp_path):
+    data_dir = str(tmp_path / 'ledger')
+    db = WALLedger(data_dir, initial={'alice': 1000, 'bob': 500})
+    db.commit('alice', 1100)
+    db.commit('bob', 450, 'req-1', 'fp-1', {'status': 2, 'amount': 50, 'balance': 450})
+    db.commit('carol', 75)
+    db.wait_durable()
+    last_seq = db.last_seq
+    db.close(snapshot=False)   # as after a crash: only snapshot 0 and the WAL
+
+    # A record cut off mid-write
+    segment = os.path.join(data_dir, wal_segments(data_dir)[-1])
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'\x00\x01\x02torn')
+
+    db = WALLedger(data_dir, initial={'alice': 1000, 'bob': 500})
+    try:
+        assert dict(db.items()) == {'alice': 1100, 'bob': 450, 'carol': 75}
+        assert db.last_seq == last_seq
+        assert db.recall('bob', 'req-1')[:2] == ('fp-1', {'status': 2, 'amount': 50, 'balance': 450})
+        assert os.path.getsize(segment) == size
+        db.wait_durable(db.commit('alice', 1200))
+    finally:
+        db.close(snapshot=False)
+
+    db = WALLedger(data_dir)
+    try:
+        assert db['alice'] == 1200
+        assert db.last_seq == last_seq + 1
+    finally:
+        db.close()
+
+
+def test_snapshot_round_trip(tmp_path):
+    data_dir = str(tmp_path / 'ledger')
+    db = WALLedger(data_dir, initial={'alice': 1000}, snapshot_every=10)
+    for n in range(1, 51):
+        db.commit('alice', 1000 + n)
+        db.wait_durable()
+    db.commit('bob', 20, 'req-7', 'fp-7', {'status': 1, 'amount': 20, 'balance': 20})
+    last_seq = db.last_seq
+    db.close()
+
+    snapshots = [p for p in os.listdir(data_dir) if p.endswith('.snap')]
+    assert snapshots == [f"snapshot-{last_seq:020d}.snap"]
+    with open(os.path.join(data_dir, snapshots[0]), 'rb') as f:
+        assert f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    assert len(wal_segments(data_dir)) <= 2   # segments the snapshots cover are deleted
+
+    db = WALLedger(data_dir)
+    try:
+        assert dict(db.items()) == {'alice': 1050, 'bob': 20}
+        assert db.last_seq == last_seq
+        assert db.recall('bob', 'req-7')[:2] == ('fp-7', {'status': 1, 'amount': 20, 'balance': 20})
+        with db.read_view() as view:
+            assert view.to_dict() == {'alice': 1050, 'bob': 20}
+    finally:
+        db.close()
+
+
+def test_lsnp1_snapshot_still_loads(tmp_path):
+    data_dir = tmp_path / 'ledger'
+    data_dir.mkdir()
+    names = b'alice\nbob'
+    balances = array('q', [1234, -5])
+    if sys.byteorder == 'little':
+        balances.byteswap()
+    with open(data_dir / f"snapshot-{7:020d}.snap", 'wb') as f:
+        f.write(SNAPSHOT_HEADER_V1.pack(SNAPSHOT_MAGIC_V1, 7, 2, len(names)) + balances.tobytes() + names)
+
+    db = WALLedger(str(data_dir))
+    try:
+        assert dict(db.items()) == {'alice': 1234, 'bob': -5}
+        assert db.last_seq == 7
+    finally:
+        db.close()
+
+
+def test_wal_write_failure_fails_the_waiters_and_further_writes(full_disk_ledger):
+    db = full_disk_ledger
+    seq = db.commit('alice', 1100)
+    with pytest.raises(LedgerError, match="No space left"):
+        db.wait_durable(seq)
+    with pytest.raises(LedgerError):
+        db.commit('alice', 1200)
+    assert not db.is_durable(seq) and db.read('alice') == 1000
+    db.close()   # does not hang, and writes no snapshot of the lost write
+
+    db = WALLedger(db.data_dir)
+    try:
+        assert db['alice'] == 1000
+    finally:
+        db.close()
+
+
+def test_corrupt_record_before_the_tail_refuses_to_start(tmp_path, capsys):
+    data_dir = str(tmp_path / 'ledger')
+    db = WALLedger(data_dir, initial={'alice': 1000})
+    for balance in (1001, 1002, 1003):
+        db.commit('alice', balance)
+    db.wait_durable()
+    db.close(snapshot=False)
+
+    segment = os.path.join(data_dir, wal_segments(data_dir)[-1])
+    with open(segment, 'r+b') as f:
+        f.seek(30)   # inside the second of three records
+        original = f.read(1)
+        f.seek(30)
+        f.write(bytes([original[0] ^ 0xFF]))
+    with pytest.raises(LedgerError, match="Corrupt WAL record"):
+        WALLedger(data_dir)
+
+    # A torn tail is cut off, and reported
+    with open(segment, 'r+b') as f:
+        f.truncate(os.path.getsize(segment) - 3)
+        f.seek(30)
+        f.write(original)
+    db = WALLedger(data_dir)
+    try:
+        assert db['alice'] == 1002
+        assert "Dropped a torn tail" in capsys.readouterr().out
+    finally:
+        db.close()
+
+
+def test_reads_see_committed_balances_and_views_stay_pinned(tmp_path):
+    # A long group-commit window keeps writes in flight while the test looks at them
+    ledger = WALLedger(str(tmp_path / 'ledger'), initial={'alice': 1000, 'bob': 500}, group_commit_window=0.5)
+    try:
+        seq = ledger.commit('alice', 900)
+        assert ledger['alice'] == 900 and ledger.read('alice') == 1000   # not fsynced yet
+        ledger.wait_durable(seq)
+        assert ledger.read('alice') == 900
+
+        view = ledger.read_view()
+        ledger.commit('alice', 800)
+        ledger.commit('alice', 700)
+        ledger.commit('carol', 50)
+        ledger.wait_durable()
+        assert ledger.read('alice') == 700
+        assert view['alice'] == 900 and view.get('carol') is None
+        assert view.to_dict() == {'alice': 900, 'bob': 500}
+        with ledger.read_view() as newer:
+            assert newer.to_dict() == {'alice': 700, 'bob': 500, 'carol': 50}
+        view.close()
+        assert ledger._history == {}   # no open view needs the old versions
+    finally:
+        ledger.close()
@@ -0,0 +1,65 @@
+import time
+import pytest
+import audit_log
+import transaction_handler
+from audit_log import AuditWriter
+from ledger import WALLedger
+from ledger_rebuild import rebuild, replay_account, compare
+
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    """
+    A WAL ledger and an audit writer (checkpointing every 10 entries) in tmp_path.
+    """
+    log_dir, ledger_dir = str(tmp_path / 'audit'), str(tmp_path / 'ledger')
+    writer = AuditWriter(log_dir=log_dir, checkpoint_every=10)
+    ledger = WALLedger(ledger_dir, initial={'alice': 1000, 'bob': 500})
+    monkeypatch.setattr(audit_log, 'audit_writer', writer)
+    monkeypatch.setattr(audit_log, 'AUDIT_LOG_DIR', log_dir)
+    monkeypatch.setattr(transaction_handler, 'db', ledger)
+    yield writer, ledger, log_dir, ledger_dir
+    writer.close()
+    ledger.close()
+
+
+def run(username, request):
+    return transaction_handler.execute_action(username, request)
+
+
+def test_balances_are_rebuilt_from_the_audit_events(bank):
+    writer, ledger, log_dir, ledger_dir = bank
+    for n in range(30):
+        run('alice', {'action': 'deposit', 'amount': n + 1, 'request_id': f'a{n}'})
+        run('bob', {'action': 'withdraw', 'amount': 7})
+    run('alice', {'action': 'deposit', 'amount': 1, 'request_id': 'a0'})   # a replay changes nothing
+    run('bob', {'action': 'batch', 'operations': [{'action': 'deposit', 'amount': 5},
+                                                  {'action': 'withdraw', 'amount': 1000},
+                                                  {'action': 'balance'}]})
+    run('bob', {'action': 'withdraw', 'amount': 10 ** 6})                  # refused: no balance change
+    ledger.wait_durable()
+    writer.flush(durable=True)
+    expected = {'alice': ledger['alice'], 'bob': ledger['bob']}
+    assert expected == {'alice': 1000 + 465, 'bob': 500 - 210 + 5}
+
+    assert rebuild(log_dir, processes=2, quiet=True) == (expected, 0)
+    assert rebuild(log_dir, processes=2, use_checkpoints=False, quiet=True) == (expected, 0)
+    checkpointed = replay_account((log_dir, 'alice', True))
+    assert checkpointed['from_entry'] > 0 and checkpointed['entries'] < 31
+    assert replay_account((log_dir, 'alice', False))['from_entry'] == 0
+
+    ledger.close()
+    assert compare(expected, ledger_dir) == 0
+    assert compare(dict(expected, bob=0), ledger_dir) == 1
+
+
+def test_an_event_that_does_not_add_up_is_reported(bank):
+    writer, ledger, log_dir, _ = bank
+    run('alice', {'action': 'deposit', 'amount': 10})
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    writer.submit({'customer_id': 'alice', 'action': 'deposit', 'timestamp': now, 'v': audit_log.EVENT_VERSION,
+                   'type': 'deposit', 'amount': 5, 'delta': 5, 'balance': 1020, 'seq': ledger.last_seq + 1})
+    writer.flush(durable=True)
+    summary = replay_account((log_dir, 'alice', False))
+    assert summary['balance'] == 1020 and len(summary['problems']) == 1
+    assert "1010 +5 does not give the logged balance 1020" in summary['problems'][0]
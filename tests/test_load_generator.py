@@ -0,0 +1,30 @@
+import argparse
+import threading
+import pytest
+
+
+def test_mix_and_latency_summary(client_modules):
+    from load_generator import parse_mix, summarize
+    assert parse_mix('deposit=3,balance') == (['deposit', 'balance'], [3.0, 1.0])
+    with pytest.raises(ValueError):
+        parse_mix('transfer=1')
+    summary = summarize([n / 1000 for n in range(1, 1001)])
+    assert summary['count'] == 1000 and summary['max_ms'] == 1000
+    assert summary['p50_ms'] == 501 and summary['p99_ms'] == 991 and summary['p999_ms'] == 1000
+    assert summarize([]) == {'count': 0}
+
+
+def test_only_served_replies_count_as_transactions(client_modules, monkeypatch):
+    import load_generator
+    from wire_codec import DEPOSITED, ERROR, BUSY
+    replies = iter([{'status': DEPOSITED, 'amount': 5, 'balance': 1005},
+                    {'status': ERROR, 'message': "WAL write failed"},
+                    {'status': BUSY, 'retry_after': 0}])
+    monkeypatch.setattr(load_generator.AtmSession, 'ensure_connected', lambda session: None)
+    monkeypatch.setattr(load_generator.AtmSession, 'request', lambda session, data: next(replies))
+    args = argparse.Namespace(seed=1, users='alice', sessions=1, mode='closed', rate=1.0, duration=60,
+                              requests=3, think_time=0)
+    stats = load_generator.SessionStats()
+    load_generator.run_session(args, 0, ['deposit'], [1], stats, threading.Barrier(1))
+    assert len(stats.transactions['deposit']) == 1
+    assert stats.errors == {'ServerError': 1, 'Shed': 1}
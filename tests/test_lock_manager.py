@@ -0,0 +1,43 @@
+import sys
+import subprocess
+import threading
+import transaction_handler
+from lock_manager import LockManager
+
+
+def test_concurrent_deposits_and_withdrawals_are_exact(db, no_audit):
+    def worker():
+        for _ in range(200):
+            transaction_handler.execute_action('alice', {'action': 'deposit', 'amount': 3}, no_audit)
+            transaction_handler.execute_action('alice', {'action': 'withdraw', 'amount': 1}, no_audit)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert db['alice'] == 1000 + 8 * 200 * 2
+
+
+def test_lock_many_takes_each_stripe_once():
+    locks = LockManager(stripes=4)
+    accounts = ['a', 'b', 'c', 'd', 'e', 'a']   # duplicates, and more accounts than stripes
+    with locks.lock_many(accounts):
+        held = {i for i, lock in enumerate(locks._locks) if lock.locked()}
+        assert held == {locks._index(account) for account in accounts}
+    assert not any(lock.locked() for lock in locks._locks)
+
+
+def test_lock_file_excludes_other_processes(tmp_path):
+    path = str(tmp_path / 'account.locks')
+    locks = LockManager(stripes=4, lock_path=path)
+    index = locks._index('alice')
+
+    def child_can_lock():
+        child = (f"import fcntl, os; fd = os.open({path!r}, os.O_RDWR); "
+                 f"fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, {index})")
+        return subprocess.run([sys.executable, '-c', child], stderr=subprocess.DEVNULL).returncode == 0
+
+    with locks.lock('alice'):
+        assert not child_can_lock()
+    assert child_can_lock()
@@ -0,0 +1,59 @@
+import urllib.error
+import urllib.request
+import pytest
+import metrics
+import transaction_handler
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_stage_histograms_are_cumulative(registry):
+    for seconds in (0.00001, 0.003, 0.003, 20.0):
+        registry.histogram('execute').observe(seconds)
+    lines = registry.render().splitlines()
+    assert 'bank_stage_seconds_bucket{stage="execute",le="1e-05"} 1' in lines
+    assert 'bank_stage_seconds_bucket{stage="execute",le="0.0025"} 1' in lines
+    assert 'bank_stage_seconds_bucket{stage="execute",le="0.005"} 3' in lines
+    assert 'bank_stage_seconds_bucket{stage="execute",le="10.0"} 3' in lines
+    assert 'bank_stage_seconds_bucket{stage="execute",le="+Inf"} 4' in lines
+    assert 'bank_stage_seconds_count{stage="execute"} 4' in lines
+
+
+def test_requests_are_counted_by_action(registry, db, no_audit):
+    for request in ({'action': 'deposit', 'amount': 1}, {'action': 'deposit', 'amount': 2}, {'action': 'balance'}):
+        transaction_handler.execute_action('alice', request, no_audit)
+    metrics.gauge_add('active_sessions', 2)
+    lines = registry.render().splitlines()
+    assert 'bank_requests_total{action="deposit"} 2' in lines
+    assert 'bank_requests_total{action="balance"} 1' in lines
+    assert lines.count('# TYPE bank_requests_total counter') == 1
+    assert 'bank_active_sessions 2' in lines
+
+
+def test_hooks_do_nothing_when_disabled(registry, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', False)
+    metrics.observe('execute', metrics.now())
+    metrics.count('requests:action', 'deposit')
+    metrics.gauge_add('active_sessions', 1)
+    assert registry.stages == {} and registry.counters == {} and registry.gauges == {}
+
+
+def test_endpoint_serves_metrics_only(registry):
+    metrics.count('errors:type', 'ValueError')
+    server = metrics.start_metrics_server(port=0)
+    try:
+        base = 'http://%s:%d' % server.server_address
+        with urllib.request.urlopen(base + '/metrics') as reply:
+            assert reply.headers['Content-Type'].startswith('text/plain')
+            assert 'bank_errors_total{type="ValueError"} 1' in reply.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(base + '/admin')
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,51 @@
+import socket
+import threading
+import time
+import pytest
+import reaper
+import transaction_handler
+from reaper import Reaper, SessionTimeout
+
+
+@pytest.fixture
+def fast_reaper(monkeypatch):
+    wheel = Reaper(tick=0.02, rescan=0.1)
+    monkeypatch.setattr(reaper, 'reaper', wheel)
+    return wheel
+
+
+def watch(wheel, timeout):
+    closed = threading.Event()
+    return wheel.watch(closed.set, 'idle', timeout), closed
+
+
+def test_expired_deadlines_are_reaped_and_moved_ones_are_not(fast_reaper):
+    expired, expired_closed = watch(fast_reaper, 0.05)
+    moved, moved_closed = watch(fast_reaper, 0.05)
+    cleared, cleared_closed = watch(fast_reaper, 0.05)
+    cancelled, cancelled_closed = watch(fast_reaper, 0.05)
+    never, never_closed = watch(fast_reaper, 0)
+    moved.set('request', 10)   # later than the wheel's rescan interval
+    cleared.clear()
+    cancelled.cancel()
+
+    assert expired_closed.wait(2) and expired.reaped and expired.reason == 'idle'
+    time.sleep(0.3)   # a few rescans
+    assert not any(e.is_set() for e in (moved_closed, cleared_closed, cancelled_closed, never_closed))
+
+    moved.set('send', 0.05)    # moved earlier again
+    assert moved_closed.wait(2) and moved.reason == 'send'
+
+
+def test_a_client_that_never_finishes_the_handshake_is_reaped(fast_reaper, monkeypatch):
+    monkeypatch.setattr(reaper, 'HANDSHAKE_TIMEOUT', 0.1)
+    client, server = socket.socketpair()
+    client.sendall(b'\x00\x00')   # the start of a frame header, then nothing
+    started = time.monotonic()
+    try:
+        with pytest.raises(SessionTimeout, match="handshake timeout"):
+            transaction_handler.handle_client(server)
+        assert time.monotonic() - started < 2
+    finally:
+        client.close()
+        server.close()
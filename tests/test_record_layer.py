@@ -0,0 +1,91 @@
+import os
+import random
+import threading
+import pytest
+from utils import encrypt, decrypt, generate_mac, verify_mac
+from key_derivation import derive_keys
+from record_layer import (new_record_layer, negotiate_suite, CbcHmacContext, RecordError, SUPPORTED_SUITES,
+                          SUITE_AES_GCM, SUITE_CBC_HMAC, LEGACY_SUITE, MAC_SIZE)
+
+
+MASTER_SECRET = bytes(range(48))
+
+
+def session(suite):
+    return new_record_layer(suite, MASTER_SECRET, True), new_record_layer(suite, MASTER_SECRET, False)
+
+
+@pytest.mark.parametrize('suite', SUPPORTED_SUITES)
+def test_records_round_trip_both_ways(suite):
+    server, client = session(suite)
+    for size in (0, 1, 15, 16, 17, 32, 1000, 70000):
+        message = os.urandom(size)
+        assert bytes(server.open(b''.join(client.seal_parts(bytearray(message))))) == message
+        record = memoryview(bytearray(b'..' + server.seal(message)))[2:]   # a slice of a receive buffer
+        assert bytes(client.open(record)) == message
+
+
+@pytest.mark.parametrize('suite', SUPPORTED_SUITES)
+def test_tampered_record_is_rejected(suite):
+    server, client = session(suite)
+    record = bytearray(client.seal(b'{"action": "balance"}'))
+    record[len(record) // 2] ^= 1
+    with pytest.raises(RecordError):
+        server.open(bytes(record))
+
+
+@pytest.mark.parametrize('suite', [s for s in SUPPORTED_SUITES if s != SUITE_CBC_HMAC])
+def test_aead_records_cannot_be_replayed_or_reordered(suite):
+    server, client = session(suite)
+    first, second = client.seal(b'one'), client.seal(b'two')
+    with pytest.raises(RecordError):
+        server.open(second)
+    assert server.open(first) == b'one'   # the failure did not advance the counter
+    with pytest.raises(RecordError):
+        server.open(first)
+    assert server.open(second) == b'two'
+
+
+def test_cbc_records_match_the_original_scheme():
+    k_enc, k_mac = derive_keys(MASTER_SECRET)
+    _, client = session(SUITE_CBC_HMAC)
+    for message in (b'', b'x' * 16, b'{"action": "deposit", "amount": 5}'):
+        record = client.seal(message)
+        ciphertext, tag = record[:-MAC_SIZE], record[-MAC_SIZE:]
+        assert verify_mac(k_mac, ciphertext, tag)
+        assert decrypt(k_enc, ciphertext) == message
+
+
+def test_cached_cbc_context_opens_records_in_any_order_and_from_any_thread():
+    k_enc, k_mac = os.urandom(32), os.urandom(32)
+    context = CbcHmacContext(k_enc, k_mac)
+    messages = [os.urandom(size) for size in range(0, 100, 7)]
+    # Records built the original way, with a cipher per message, open through the long-lived context
+    records = [(message, encrypt(k_enc, message)) for message in messages]
+    records = [(message, ciphertext + generate_mac(k_mac, ciphertext)) for message, ciphertext in records]
+    records += [(message, context.seal(message)) for message in messages]
+    random.Random(1).shuffle(records)
+    assert [bytes(context.open(record)) for _, record in records] == [message for message, _ in records]
+
+    opened = []
+
+    def worker(n):
+        for i in range(200):
+            message = b'%d:%d' % (n, i) * (i % 5)
+            opened.append(bytes(context.open(context.seal(message))) == message)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert opened == [True] * 8 * 200   # a thread that raised leaves fewer
+
+
+def test_suite_negotiation():
+    assert negotiate_suite(None) == LEGACY_SUITE
+    assert negotiate_suite(['unknown']) == LEGACY_SUITE
+    assert negotiate_suite(list(reversed(SUPPORTED_SUITES))) == SUPPORTED_SUITES[0]
+    assert negotiate_suite([SUITE_CBC_HMAC, SUITE_AES_GCM]) == SUITE_AES_GCM
+    with pytest.raises(ValueError):
+        new_record_layer('rot13', MASTER_SECRET, True)
@@ -0,0 +1,64 @@
+import pytest
+import session_ticket
+from session_ticket import (issue_ticket, redeem_ticket, ReplayCache, TicketError, compute_resumed_master_secret)
+
+
+MASTER_SECRET = bytes(range(32))
+
+
+@pytest.fixture(autouse=True)
+def replay_cache(monkeypatch):
+    cache = ReplayCache()
+    monkeypatch.setattr(session_ticket, 'replay_cache', cache)
+    return cache
+
+
+def test_ticket_resumes_once():
+    ticket = issue_ticket('alice', MASTER_SECRET)
+    assert redeem_ticket(ticket, 'alice') == MASTER_SECRET
+    with pytest.raises(TicketError, match="already used"):
+        redeem_ticket(ticket, 'alice')
+
+
+def test_refused_tickets_are_not_consumed(replay_cache):
+    ticket = issue_ticket('alice', MASTER_SECRET)
+    with pytest.raises(TicketError, match="another user"):
+        redeem_ticket(ticket, 'bob')
+    forged = bytearray(ticket)
+    forged[20] ^= 1
+    for bad in (bytes(forged), ticket[:32], b''):
+        with pytest.raises(TicketError, match="Invalid ticket"):
+            redeem_ticket(bad, 'alice')
+    assert len(replay_cache) == 0
+    assert redeem_ticket(ticket, 'alice') == MASTER_SECRET
+
+
+def test_expired_ticket_is_refused():
+    with pytest.raises(TicketError, match="expired"):
+        redeem_ticket(issue_ticket('alice', MASTER_SECRET, lifetime=0), 'alice')
+
+
+def test_full_cache_refuses_everything_issued_before_what_it_evicted():
+    cache = ReplayCache(max_entries=2)
+    assert cache.use('a', issued=1, expires=100, now=10)
+    assert cache.use('b', issued=2, expires=100, now=10)
+    assert cache.use('c', issued=3, expires=100, now=10)   # evicts 'a'
+    assert not cache.use('a', issued=1, expires=100, now=10)
+    assert not cache.use('c', issued=3, expires=100, now=10)
+    assert not cache.use('d', issued=1.5, expires=100, now=10)   # evicts 'b' on the way
+    assert not cache.use('b', issued=2, expires=100, now=10)
+    assert cache.use('e', issued=4, expires=100, now=10)
+
+
+def test_expired_entries_are_forgotten():
+    cache = ReplayCache()
+    cache.use('a', issued=1, expires=20, now=10)
+    cache.use('b', issued=2, expires=50, now=30)
+    assert len(cache) == 1
+
+
+def test_resumed_master_secret_depends_on_both_nonces():
+    base = compute_resumed_master_secret(MASTER_SECRET, b'c' * 16, b's' * 16)
+    assert base != MASTER_SECRET
+    assert base != compute_resumed_master_secret(MASTER_SECRET, b'c' * 16, b't' * 16)
+    assert base != compute_resumed_master_secret(MASTER_SECRET, b'd' * 16, b's' * 16)
@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+import pytest
+import transaction_handler
+from ledger import WALLedger
+from state_service import StateService, StateClient, RemoteLedger
+
+
+# A pre-forked worker: swaps in the proxies as server_main.worker_main does,
+# then moves money in and out of two accounts on several threads, like its sessions
+WORKER = '''
+import sys
+import threading
+sys.path.insert(0, sys.argv[1])
+import transaction_handler
+from lock_manager import LockManager
+from state_service import StateClient, RemoteLedger
+transaction_handler.db = RemoteLedger(StateClient(sys.argv[2], bytes.fromhex(sys.argv[3])))
+transaction_handler.account_locks = LockManager(lock_path=sys.argv[4])
+
+failed = []
+
+def session(account):
+    for _ in range(100):
+        for action, amount in (('deposit', 3), ('withdraw', 1)):
+            try:
+                transaction_handler.execute_action(account, {'action': action, 'amount': amount},
+                                                   lambda *args, **kwargs: None)
+            except Exception as e:
+                failed.append(e)
+
+threads = [threading.Thread(target=session, args=(account,)) for account in ('alice', 'bob') * 2]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+sys.exit(repr(failed[0]) if failed else 0)
+'''
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    # A long group-commit window keeps writes in flight while the test looks at them
+    ledger = WALLedger(str(tmp_path / 'ledger'), initial={'alice': 1000, 'bob': 500}, group_commit_window=0.5)
+    address, authkey = str(tmp_path / 'state.sock'), os.urandom(32)
+    service = StateService(address, authkey, ledger, None, None)
+    yield ledger, address, authkey
+    service.close()
+    ledger.close()
+
+
+def test_retry_on_another_worker_waits_for_the_original_write(supervisor, monkeypatch, no_audit):
+    ledger, address, authkey = supervisor
+    first, second = RemoteLedger(StateClient(address, authkey)), RemoteLedger(StateClient(address, authkey))
+    request = {'action': 'deposit', 'amount': 100, 'request_id': 'r1'}
+
+    monkeypatch.setattr(transaction_handler, 'db', first)
+    result, seq = transaction_handler.tracked_action('alice', request, no_audit)
+
+    # The reply was lost; the retry reaches the other worker before the group commit
+    monkeypatch.setattr(transaction_handler, 'db', second)
+    replay, replay_seq = transaction_handler.tracked_action('alice', dict(request), no_audit)
+    assert replay == dict(result, replayed=True)
+    assert replay_seq == seq and second.last_seq == 0
+    assert not second.is_durable(replay_seq)
+    second.wait_durable(replay_seq)
+    assert ledger.is_durable(seq)
+
+
+def test_workers_share_one_ledger_and_its_account_locks(supervisor, tmp_path):
+    ledger, address, authkey = supervisor
+    server_dir = os.path.dirname(transaction_handler.__file__)
+    args = [server_dir, address, authkey.hex(), str(tmp_path / 'account.locks')]
+    workers = []
+    for n in range(3):
+        # Each imports transaction_handler (and opens its default ledger) in a directory of its own
+        (tmp_path / f'worker{n}').mkdir()
+        workers.append(subprocess.Popen([sys.executable, '-c', WORKER, *args], cwd=str(tmp_path / f'worker{n}')))
+    assert [worker.wait(60) for worker in workers] == [0, 0, 0]
+    assert (ledger['alice'], ledger['bob']) == (1000 + 3 * 2 * 100 * 2, 500 + 3 * 2 * 100 * 2)
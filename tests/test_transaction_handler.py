@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import pytest
+import transaction_handler
+import wire_codec
+from ledger import WALLedger
+from record_layer import new_record_layer, SUITE_AES_GCM
+from framing import read_frame_async, write_frame_async
+from wire_codec import (ERROR, DEPOSITED, WITHDREW, BALANCE, BATCH, ROLLED_BACK, INSUFFICIENT_FUNDS,
+                        INVALID_BATCH_ACTION, REQUEST, RESPONSE, FORMAT_BINARY)
+
+
+INVALID_AMOUNTS = [
+    pytest.param(-5, id='negative'),
+    pytest.param(0.5, id='float'),
+    pytest.param(2 ** 63, id='too-large'),
+    pytest.param(True, id='bool'),
+    pytest.param('10', id='string'),
+    pytest.param(None, id='missing'),
+]
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+@pytest.mark.parametrize('action', ['deposit', 'withdraw'])
+def test_invalid_amount_is_rejected(db, audit, action, amount):
+    events, log_action = audit
+    result = transaction_handler.execute_action('alice', {'action': action, 'amount': amount}, log_action)
+    assert result == {'status': ERROR, 'message': "Invalid amount"}
+    assert db['alice'] == 1000
+    assert events == [(action, {'type': 'invalid'})]
+
+
+@pytest.mark.parametrize('amount', INVALID_AMOUNTS)
+def test_invalid_amount_rejects_the_whole_batch(db, audit, amount):
+    _, log_action = audit
+    request = {'action': 'batch', 'operations': [{'action': 'deposit', 'amount': 100},
+                                                 {'action': 'withdraw', 'amount': amount}]}
+    result = transaction_handler.execute_action('alice', request, log_action)
+    assert result['status'] == ERROR
+    assert db['alice'] == 1000
+
+
+def test_valid_amounts_still_apply(db, audit):
+    _, log_action = audit
+    assert transaction_handler.execute_action('alice', {'action': 'deposit', 'amount': 0}, log_action)['status'] == DEPOSITED
+    result = transaction_handler.execute_action('alice', {'action': 'withdraw', 'amount': 400}, log_action)
+    assert result == {'status': WITHDREW, 'amount': 400, 'balance': 600}
+    request = {'action': 'batch', 'operations': [{'action': 'deposit', 'amount': 50},
+                                                 {'action': 'withdraw', 'amount': 25}]}
+    assert transaction_handler.execute_action('alice', request, log_action)['status'] == BATCH
+    assert db['alice'] == 625
+
+
+def test_batch_applies_in_order_and_atomic_batches_roll_back(db, audit):
+    events, log_action = audit
+    operations = [{'action': 'withdraw', 'amount': 1500}, {'action': 'deposit', 'amount': 600},
+                  {'action': 'withdraw', 'amount': 1500}, {'action': 'balance'}, {'action': 'transfer'}]
+    result = transaction_handler.execute_action('alice', {'action': 'batch', 'operations': operations}, log_action)
+    assert result == {'status': BATCH, 'results': [
+        {'status': INSUFFICIENT_FUNDS}, {'status': DEPOSITED, 'amount': 600, 'balance': 1600},
+        {'status': WITHDREW, 'amount': 1500, 'balance': 100}, {'status': BALANCE, 'balance': 100},
+        {'status': INVALID_BATCH_ACTION}]}
+    assert db['alice'] == 100
+    assert [op['type'] for op in events[-1][1]['ops']] == ['deposit', 'withdraw', 'balance']
+
+    request = {'action': 'batch', 'atomic': True, 'operations': [{'action': 'deposit', 'amount': 50},
+                                                                 {'action': 'withdraw', 'amount': 500}]}
+    result = transaction_handler.execute_action('alice', request, log_action)
+    assert result['status'] == ROLLED_BACK and result['results'][1] == {'status': INSUFFICIENT_FUNDS}
+    assert db['alice'] == 100 and 'ops' not in events[-1][1]
+
+    too_large = [{'action': 'balance'}] * (transaction_handler.MAX_BATCH_SIZE + 1)
+    with pytest.raises(Exception, match="Batch too large"):
+        transaction_handler.execute_action('alice', {'action': 'batch', 'operations': too_large}, log_action)
+
+
+def test_tracked_action_reports_the_requests_own_write(tmp_path, monkeypatch, audit):
+    _, log_action = audit
+    ledger = WALLedger(str(tmp_path / 'ledger'), initial={'alice': 1000, 'bob': 500})
+    monkeypatch.setattr(transaction_handler, 'db', ledger)
+    try:
+        request = {'action': 'deposit', 'amount': 5, 'request_id': 'r1'}
+        _, seq = transaction_handler.tracked_action('alice', request, log_action)
+        ledger.commit('bob', 600)   # another session's later write
+        assert seq == ledger.last_seq - 1
+        ledger.wait_durable(seq)   # balance reads see committed writes only
+        assert transaction_handler.tracked_action('alice', {'action': 'balance'}, log_action) == (
+            {'status': BALANCE, 'balance': 1005}, None)
+        assert transaction_handler.tracked_action('alice', {'action': 'withdraw', 'amount': -1}, log_action)[1] is None
+        result, replay_seq = transaction_handler.tracked_action('alice', dict(request), log_action)
+        assert result['replayed'] and replay_seq == seq
+    finally:
+        ledger.close()
+
+
+def test_failed_wal_write_is_answered_with_an_error(full_disk_ledger, monkeypatch, audit):
+    _, log_action = audit
+    monkeypatch.setattr(transaction_handler, 'db', full_disk_ledger)
+    server = new_record_layer(SUITE_AES_GCM, bytes(32), is_server=True)
+    client = new_record_layer(SUITE_AES_GCM, bytes(32), is_server=False)
+    packet = client.seal(wire_codec.encode(REQUEST, {'action': 'deposit', 'amount': 5}))
+    (reply,) = transaction_handler.process_request('alice', server, packet, log_action, FORMAT_BINARY)
+    result = wire_codec.decode(RESPONSE, client.open(b''.join(reply)))[0]
+    assert result['status'] == ERROR and "WAL write failed" in result['message']
+
+
+def test_blocked_request_does_not_stall_other_async_sessions(db, monkeypatch):
+    async def authenticated(reader, writer):
+        return 'alice', bytes(32), SUITE_AES_GCM, FORMAT_BINARY
+
+    monkeypatch.setattr(transaction_handler, 'authenticate_and_generate_master_secret_async', authenticated)
+    monkeypatch.setattr(transaction_handler, 'log_encrypted_action', lambda *args, **kwargs: None)
+    released = threading.Event()
+    read = db.read
+    monkeypatch.setattr(db, 'read', lambda account: released.wait(5) and read(account))
+
+    async def session(server, request):
+        client = new_record_layer(SUITE_AES_GCM, bytes(32), is_server=False)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        await write_frame_async(writer, *client.seal_parts(wire_codec.encode(REQUEST, request)))
+        reply = await read_frame_async(reader)
+        writer.close()
+        return wire_codec.decode(RESPONSE, client.open(reply))[0]
+
+    async def run():
+        server = await asyncio.start_server(transaction_handler.handle_client_async, '127.0.0.1', 0)
+        async with server:
+            balance = asyncio.ensure_future(session(server, {'action': 'balance'}))
+            await asyncio.sleep(0.1)   # the balance read is now blocked
+            deposit = await asyncio.wait_for(session(server, {'action': 'deposit', 'amount': 5}), 2)
+            released.set()
+            return deposit, await balance
+
+    deposit, balance = asyncio.run(run())
+    assert deposit == {'status': DEPOSITED, 'amount': 5, 'balance': 1005}
+    assert balance == {'status': BALANCE, 'balance': 1005}
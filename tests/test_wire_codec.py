@@ -0,0 +1,57 @@
+import pytest
+from wire_codec import (encode, decode, dumps, loads, busy_message, cookie_message, detect_format, WireError,
+                        CLIENT_HELLO, SERVER_BUSY, HELLO_COOKIE, REQUEST, RESPONSE, FORMAT_BINARY, FORMAT_JSON,
+                        LOG_PAGE, BATCH, WIRE_VERSION)
+
+
+MESSAGES = [
+    (CLIENT_HELLO, {'username': 'alice', 'nonce': b'\x00' * 16, 'tickets': True, 'suites': ['a', 'b'],
+                    'cookie': b'\xff\x01'}),
+    (REQUEST, {'action': 'batch', 'atomic': True, 'request_id': 'r1',
+               'operations': [{'action': 'deposit', 'amount': 5}, {'action': 'withdraw', 'amount': 2 ** 62}]}),
+    (REQUEST, {'action': 'view_log', 'since': '2026-01-01 00:00:00', 'limit': 50, 'cursor': 300, 'stream': True}),
+    (RESPONSE, {'status': LOG_PAGE, 'entries': [{'timestamp': '2026-01-01 00:00:00', 'action': 'Deposited 5'}],
+                'next_cursor': 7, 'more': True}),
+    (RESPONSE, {'status': BATCH, 'balance': -3, 'results': [{'status': 1, 'amount': 5, 'balance': -3}],
+                'replayed': True}),
+]
+
+
+@pytest.mark.parametrize('msg_type, fields', MESSAGES)
+@pytest.mark.parametrize('wire_format', [FORMAT_BINARY, FORMAT_JSON])
+def test_round_trip(msg_type, fields, wire_format):
+    data = dumps(msg_type, fields, wire_format)
+    assert detect_format(data) == wire_format
+    assert loads(msg_type, data) == fields
+
+
+def test_missing_and_false_fields_are_left_out():
+    data = encode(REQUEST, {'action': 'balance', 'amount': None, 'atomic': False})
+    assert decode(REQUEST, data) == ({'action': 'balance'}, WIRE_VERSION)
+    assert loads(REQUEST, dumps(REQUEST, {'action': 'foo'}, FORMAT_BINARY)) == {'action': None}
+
+
+@pytest.mark.parametrize('data', [
+    pytest.param(encode(REQUEST, {'action': 'balance'})[:-1], id='truncated'),
+    pytest.param(encode(REQUEST, {'action': 'balance'}) + b'\x00', id='trailing'),
+    pytest.param(encode(RESPONSE, {'status': 1}), id='wrong-type'),
+    pytest.param(encode(REQUEST, {'action': 'balance'}, version=WIRE_VERSION + 1), id='newer-version'),
+    pytest.param(encode(REQUEST, {})[:3] + b'\xff\xff\x7f', id='unknown-fields'),
+])
+def test_malformed_messages_are_rejected(data):
+    with pytest.raises(WireError):
+        decode(REQUEST, data)
+
+
+def test_whole_numbers_only():
+    with pytest.raises(WireError):
+        encode(REQUEST, {'action': 'deposit', 'amount': 1.5})
+
+
+def test_busy_and_cookie_messages_are_told_apart():
+    busy = encode(SERVER_BUSY, {'reason': 'overloaded', 'retry_after': 250})
+    cookie = encode(HELLO_COOKIE, {'cookie': b'c' * 24})
+    assert busy_message(busy) == {'reason': 'overloaded', 'retry_after': 250}
+    assert cookie_message(cookie) == b'c' * 24
+    assert busy_message(cookie) is None and cookie_message(busy) is None
+    assert cookie_message(b'{"nonce_c": "00"}') is None